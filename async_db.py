@@ -0,0 +1,189 @@
+import asyncio
+import sys
+
+from pathlib import Path
+from random import random
+from typing import Dict, Iterable, Mapping, Sequence, Tuple, List
+
+import psycopg
+
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+sys.path.append(str(Path(__file__).parent))
+from db import merge_rows
+
+
+def _is_conflict(err: psycopg.Error) -> bool:
+    # Класс SQLSTATE 40 - откат транзакции (взаимоблокировка, ошибка
+    # сериализации), как TransactionRollbackError в psycopg2.
+    return (err.sqlstate or '').startswith('40')
+
+
+class AsyncRecSysDataBase:
+    """
+    Асинхронный аналог RecSysDataBase для работы из event loop. Использует
+    собственный пул соединений, а пачки запросов отправляет в pipeline-режиме,
+    не дожидаясь ответа на каждый запрос по отдельности.
+    """
+    MAX_RETRIES = 5
+    RETRY_DELAY = 0.05
+    def __init__(
+        self,
+        database: str = 'postgres',
+        user: str = 'postgres',
+        password: str = '12345',
+        host: str = 'localhost',
+        port: int = 5432,
+        pool_size: Tuple[int, int] = (1, 10)
+    ) -> None:
+        conninfo = make_conninfo(
+            dbname=database,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        min_size, max_size = pool_size
+        self.pool = AsyncConnectionPool(
+            conninfo, min_size=min_size, max_size=max_size, open=False
+        )
+        self.dict_name = 'key2num'
+        # Определяется при открытии, как в RecSysDataBase.create_dict.
+        self.partitioned = None
+
+    async def open(self) -> None:
+        await self.pool.open(wait=True)
+        self.partitioned = await self._is_partitioned()
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def _is_partitioned(self) -> bool:
+        sql = f"""
+        select c.relkind
+            from pg_catalog.pg_class c
+            join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = 'public'
+                and c.relname = '{self.dict_name}';
+        """
+        res = await self.select(sql)
+        return bool(res) and res[0][0] == 'p'
+
+    @property
+    def conflict_target(self) -> str:
+        # У секционированной таблицы ключ (key, inn_kpp), см. RecSysDataBase.
+        return '(key, inn_kpp)' if self.partitioned else '(key)'
+
+    async def select(self, sql: str, params: Sequence = ()) -> List[Tuple]:
+        async with self.pool.connection() as conn:
+            cur = await conn.execute(sql, params)
+            return await cur.fetchall()
+
+    async def incr(self, key: str, inn_kpp: str, num: int = 1) -> None:
+        await self.incrby([(key, inn_kpp, num)])
+
+    async def incrby(
+        self,
+        rows: Mapping[str, Tuple[str, int]] | Iterable[Tuple[str, str, int]]
+    ) -> None:
+        """
+        Повторяющиеся ключи суммируются, строки пишутся в порядке ключа (см.
+        merge_rows), а при взаимоблокировке или ошибке сериализации пачка
+        откатывается к точке сохранения и повторяется, как в
+        RecSysDataBase.incrby.
+        """
+        if not isinstance(rows, Mapping):
+            rows = list(rows)
+        rows = merge_rows(rows)
+        if not rows:
+            return
+
+        sql = f"""
+        insert into public.{self.dict_name} values
+        (%s, %s, %s)
+        on conflict {self.conflict_target}
+        do update set
+            num = {self.dict_name}.num + excluded.num;
+        """
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cur:
+                for attempt in range(self.MAX_RETRIES + 1):
+                    await cur.execute('savepoint retry_on_conflict;')
+                    try:
+                        # executemany отправляет все строки одним pipeline.
+                        await cur.executemany(sql, rows)
+                    except psycopg.OperationalError as err:
+                        if not _is_conflict(err):
+                            raise
+                        await cur.execute('rollback to savepoint retry_on_conflict;')
+                        if attempt == self.MAX_RETRIES:
+                            raise
+                        await asyncio.sleep(
+                            self.RETRY_DELAY * 2 ** attempt * (1 + random())
+                        )
+                    else:
+                        await cur.execute('release savepoint retry_on_conflict;')
+                        return
+
+    async def get(self, key: str) -> int:
+        sql = f"""
+        select num
+            from public.{self.dict_name}
+            where key = %s;
+        """
+        res = await self.select(sql, (key,))
+        try:
+            return res[0][0]
+        except IndexError:
+            return 0
+
+    async def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        keys = list(keys)
+        sql = f"""
+        select key, num
+            from public.{self.dict_name}
+            where key = any(%s);
+        """
+        res = dict.fromkeys(keys, 0)
+        if keys:
+            res.update(await self.select(sql, (keys,)))
+        return res
+
+    async def get_innkpp(self, inn_kpp: str) -> List[Tuple[str, int]]:
+        sql = f"""
+        select key, num
+            from public.{self.dict_name}
+            where inn_kpp = %s;
+        """
+        return await self.select(sql, (inn_kpp,))
+
+    async def get_innkpp_many(
+        self,
+        inn_kpps: Iterable[str]
+    ) -> Dict[str, List[Tuple[str, int]]]:
+        """
+        Строки нескольких поставщиков. Все запросы уходят на сервер одним
+        pipeline на одном соединении, ответы читаются после синхронизации.
+        """
+        inn_kpps = list(inn_kpps)
+        sql = f"""
+        select key, num
+            from public.{self.dict_name}
+            where inn_kpp = %s;
+        """
+        async with self.pool.connection() as conn:
+            async with conn.pipeline():
+                curs = [await conn.execute(sql, (inn_kpp,))
+                        for inn_kpp in inn_kpps]
+            return {
+                inn_kpp: await cur.fetchall()
+                for inn_kpp, cur in zip(inn_kpps, curs)
+            }
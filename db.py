@@ -1,10 +1,30 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+from io import StringIO
+from itertools import groupby, islice
+from operator import itemgetter
 from pathlib import Path
-from typing import Mapping, Generator, Sequence, Tuple, List, NamedTuple
+from random import random
+from sys import intern
+from threading import BoundedSemaphore, Lock, local
+from time import monotonic, sleep
+from uuid import uuid4
+from typing import (
+    Any, Callable, Dict, Mapping, Generator, Iterable, Iterator, Sequence,
+    Tuple, List, NamedTuple
+)
 from functools import wraps
 
 import jinja2
 import psycopg2
 
+from psycopg2.extensions import (
+    connection, cursor, TransactionRollbackError,
+    TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_UNKNOWN
+)
+from psycopg2.pool import ThreadedConnectionPool, PoolError
+
 
 def autocommit(func):
     @wraps(func)
@@ -15,38 +35,415 @@ def autocommit(func):
         return res
     return wrapper
 
-class RecSysDataBase:
+def _copy_escape(value: str | None) -> str:
+    if value is None:
+        return '\\N'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+def _track_rows(
+    rows: Iterable[Tuple[str, str, int]],
+    keys: set,
+    inn_kpps: set
+) -> Iterator[Tuple[str, str, int]]:
+    for row in rows:
+        keys.add(row[0])
+        inn_kpps.add(row[1])
+        yield row
+
+def merge_rows(
+    rows: Mapping[str, Tuple[str, int]] | Sequence[Tuple[str, str, int]]
+) -> List[Tuple[str, str, int]]:
+    """
+    Сложить num у повторяющихся ключей и упорядочить строки по ключу.
+    Без этого один запрос upsert падает на повторном ключе, а параллельные
+    запросы с пересекающимися ключами в разном порядке взаимоблокируются.
+    """
+    if isinstance(rows, Mapping):
+        rows = ((key, inn_kpp, num) for key, (inn_kpp, num) in rows.items())
+    elif not isinstance(rows, (Generator, Sequence)):
+        raise ValueError(f'Неправильный тип rows - `{type(rows)}`.')
+
+    merged = {}
+    for key, inn_kpp, num in rows:
+        if key in merged:
+            merged[key][1] += num
+        else:
+            merged[key] = [inn_kpp, num]
+    return [(key, *merged[key]) for key in sorted(merged)]
+
+def retry_on_conflict(
+    cur: cursor,
+    action: Callable[[], Any],
+    max_retries: int = 5,
+    delay: float = 0.05
+) -> Any:
+    """
+    Выполнить action внутри точки сохранения. При взаимоблокировке или
+    ошибке сериализации откатиться к ней и повторить с экспоненциально
+    растущей задержкой, не более max_retries раз. Работает и внутри
+    внешней транзакции.
+    """
+    for attempt in range(max_retries + 1):
+        cur.execute('savepoint retry_on_conflict;')
+        try:
+            res = action()
+        except TransactionRollbackError:
+            cur.execute('rollback to savepoint retry_on_conflict;')
+            if attempt == max_retries:
+                raise
+            sleep(delay * 2 ** attempt * (1 + random()))
+        else:
+            cur.execute('release savepoint retry_on_conflict;')
+            return res
+
+_MISSING = object()
+
+class LRUCache:
+    """
+    Потокобезопасный кеш ограниченного размера с вытеснением давно не
+    использованных записей (LRU) и временем жизни записи ttl в секундах.
+    Ведет счетчики попаданий, промахов и вытеснений.
+
+    Чтобы значение, прочитанное до записи, не попало в кеш после ее
+    сброса, у ключей есть поколения (token): pop и clear увеличивают
+    поколение, а set с token, снятым до чтения, ничего не делает, если
+    поколение с тех пор сменилось. Поколения хранятся в GENERATIONS
+    счетчиках по хешу ключа, так что их память ограничена, а редкие
+    совпадения хешей приводят лишь к лишнему промаху.
+    """
+    GENERATIONS = 1024
+    def __init__(self, maxsize: int = 100_000, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.generations = [0] * self.GENERATIONS
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def get(self, key: Any, default: Any = _MISSING) -> Any:
+        with self._lock:
+            item = self.data.get(key)
+            if item is not None and item[1] is not None and item[1] < monotonic():
+                del self.data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self.data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def token(self, key: Any) -> int:
+        """Поколение key; снимается до чтения значения из источника."""
+        return self.generations[hash(key) % self.GENERATIONS]
+
+    def set(self, key: Any, value: Any, token: int | None = None) -> None:
+        expires = None if self.ttl is None else monotonic() + self.ttl
+        with self._lock:
+            if token is not None and token != self.token(key):
+                return
+            self.data[key] = (value, expires)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key: Any) -> None:
+        with self._lock:
+            self.data.pop(key, None)
+            self.generations[hash(key) % self.GENERATIONS] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self.data.clear()
+            self.generations = [gen + 1 for gen in self.generations]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'size': len(self.data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+class CounterBackend(ABC):
+    """
+    Интерфейс хранилища счетчиков key -> num с привязкой ключа к inn_kpp.
+    RecSysDataBase - реализация поверх Postgres, SQLiteDataBase -
+    встроенная в процесс.
+    """
+    dict_name: str
+
+    @abstractmethod
+    def create_dict(self) -> bool: ...
+
+    @abstractmethod
+    def clear_dict(self) -> bool: ...
+
+    @abstractmethod
+    def incr(self, key: str, inn_kpp: str, num: int = 1) -> None: ...
+
+    @abstractmethod
+    def incrby(
+        self,
+        rows: Mapping[str, Tuple[str, int]] | Sequence[Tuple[str, str, int]]
+    ) -> None: ...
+
+    @abstractmethod
+    def get(self, key: str) -> int: ...
+
+    @abstractmethod
+    def get_innkpp(self, inn_kpp: str) -> List[Tuple[str, int]]: ...
+
+    @abstractmethod
+    def iter_innkpp(
+        self,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000
+    ) -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """
+        Пары (inn_kpp, [(key, num), ...]) по поставщикам в порядке inn_kpp
+        за один проход (см. SupplierInfo.iter_from_db).
+        """
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        return {key: self.get(key) for key in keys}
+
+    def close(self) -> None:
+        pass
+
+class RecSysDataBase(CounterBackend):
     CURDIR = Path(__file__).parent
+    MAX_RETRIES = 5
+    RETRY_DELAY = 0.05
     def __init__(
         self, 
         database: str = 'postgres',
         user: str = 'postgres',
         password: str = '12345',
         host: str = 'localhost',
-        port: int = 5432
+        port: int = 5432,
+        pool_size: Tuple[int, int] | None = None,
+        partitions: int | None = None,
+        cache_size: int = 0,
+        cache_ttl: float | None = None
     ) -> None:
-        self.connection = psycopg2.connect(
+        """
+        pool_size - (min, max) кол-во соединений. Если задан, то вместо одного
+        соединения используется потокобезопасный пул, и каждый вызов
+        берет из него отдельное соединение.
+        partitions - если задан, то новая таблица создается секционированной
+        по хешу inn_kpp на указанное кол-во секций.
+        cache_size, cache_ttl - если cache_size > 0, то результаты get,
+        get_many и get_innkpp кешируются в процессе (см. LRUCache), а записи
+        через incr/incrby/incrby_bulk сбрасывают затронутые записи кеша.
+        """
+        self.cache = LRUCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.pool_size = pool_size
+        self.partitions = partitions
+        self.partitioned = False
+        self.pool = None
+        self._local = local()
+        self.connection = None
+        self.cursor = None
+        self._connect(database, user, password, host, port)
+        self.tpl_loader = jinja2.FileSystemLoader(self.CURDIR / 'templates')
+        self.tpl_env = jinja2.Environment(loader=self.tpl_loader, trim_blocks=True)
+        self.dict_name = 'key2num'
+        self.create_dict()
+
+    def _connect(
+        self,
+        database: str,
+        user: str,
+        password: str,
+        host: str,
+        port: int
+    ) -> None:
+        self._connect_kwargs = dict(
             database=database,
             user=user,
             password=password,
             host=host,
             port=port
         )
-        self.cursor = self.connection.cursor()
-        self.tpl_loader = jinja2.FileSystemLoader(self.CURDIR / 'templates')
-        self.tpl_env = jinja2.Environment(loader=self.tpl_loader, trim_blocks=True)
-        self.dict_name = 'key2num'
-        self.create_dict()
+        if self.pool_size is None:
+            self.connection = psycopg2.connect(
+                database=database,
+                user=user,
+                password=password,
+                host=host,
+                port=port
+            )
+            self.cursor = self.connection.cursor()
+            return
+
+        minconn, maxconn = self.pool_size
+        self.pool = ThreadedConnectionPool(
+            minconn,
+            maxconn,
+            database=database,
+            user=user,
+            password=password,
+            host=host,
+            port=port
+        )
+        self._pool_slots = BoundedSemaphore(maxconn)
+
+    def _getconn(self) -> connection:
+        # Соединения, оборванные сервером или оставшиеся в неизвестном
+        # состоянии транзакции, выбрасываются из пула. Обрыв на стороне
+        # сервера клиент замечает только при обращении, поэтому простаивающее
+        # соединение проверяется запросом select 1.
+        for _ in range(self.pool_size[1] + 1):
+            conn = self.pool.getconn()
+            status = None if conn.closed else conn.get_transaction_status()
+            if (status not in (None, TRANSACTION_STATUS_UNKNOWN)
+                and (status != TRANSACTION_STATUS_IDLE or self._is_alive(conn))):
+                return conn
+            self.pool.putconn(conn, close=True)
+        raise PoolError('Не удалось получить рабочее соединение из пула.')
+
+    @staticmethod
+    def _is_alive(conn: connection) -> bool:
+        try:
+            with conn.cursor() as cur:
+                cur.execute('select 1;')
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+        return True
+
+    @contextmanager
+    def _pooled_connection(self) -> Iterator[connection]:
+        with self._pool_slots:
+            conn = self._getconn()
+            broken = False
+            try:
+                yield conn
+                conn.commit()
+            except TransactionRollbackError:
+                conn.rollback()
+                raise
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            except BaseException:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    @contextmanager
+    def checkout(self, name: str | None = None) -> Iterator[cursor]:
+        """
+        Курсор для одного вызова. В режиме пула соединение берется из пула,
+        по завершении фиксируется (или откатывается при ошибке) и
+        возвращается обратно. Если задан name, создается серверный
+        (именованный) курсор. Внутри transaction() используется соединение
+        текущей транзакции.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            with conn.cursor(name) as cur:
+                yield cur
+            return
+
+        if self.pool is None:
+            if name is None:
+                yield self.cursor
+                return
+            with self.connection.cursor(name) as cur:
+                yield cur
+            return
+
+        with self._pooled_connection() as conn:
+            with conn.cursor(name) as cur:
+                yield cur
+
+    @contextmanager
+    def _stream_cursor(self, name: str) -> Iterator[cursor]:
+        """
+        Серверный курсор для потокового чтения. В режиме одного соединения
+        он открывается на отдельном соединении: commit основного соединения
+        (любая запись через autocommit или IncrBuffer во время чтения)
+        закрыл бы курсор. Внутри transaction() используется соединение
+        транзакции, и курсор живет до ее завершения.
+        """
+        if self.pool is not None or getattr(self._local, 'conn', None) is not None:
+            with self.checkout(name) as cur:
+                yield cur
+            return
+
+        conn = psycopg2.connect(**self._connect_kwargs)
+        try:
+            with conn.cursor(name) as cur:
+                yield cur
+        finally:
+            conn.close()
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        Выполнить все вызовы внутри блока в одной транзакции: вместо двух
+        commit на каждый вызов (autocommit) делается один commit в конце
+        блока, при ошибке - rollback. Вложенные блоки входят во внешний.
+        """
+        if getattr(self._local, 'conn', None) is not None:
+            yield
+            return
+
+        self._local.invalidated = []
+        try:
+            if self.pool is None:
+                self.commit()
+                self._local.conn = self.connection
+                try:
+                    yield
+                    self.connection.commit()
+                except BaseException:
+                    self.connection.rollback()
+                    raise
+                finally:
+                    self._local.conn = None
+            else:
+                with self._pooled_connection() as conn:
+                    self._local.conn = conn
+                    try:
+                        yield
+                    finally:
+                        self._local.conn = None
+        finally:
+            # Пока транзакция не зафиксирована, другие потоки могли
+            # закешировать старые значения, поэтому сбрасываем их повторно.
+            invalidated, self._local.invalidated = self._local.invalidated, None
+            for keys, inn_kpps in invalidated:
+                self._invalidate(keys, inn_kpps)
 
     def commit(self) -> None:
-        self.connection.commit()
+        if self.pool is None and getattr(self._local, 'conn', None) is None:
+            self.connection.commit()
 
-    def select(self, sql: str) -> List[Tuple]:
-        self.cursor.execute(sql)
-        res = self.cursor.fetchall()
+    def select(self, sql: str, params: Sequence | None = None) -> List[Tuple]:
+        with self.checkout() as cur:
+            cur.execute(sql, params)
+            res = cur.fetchall()
         return res
 
     def close(self) -> None:
+        if self.pool is not None:
+            self.pool.closeall()
+            return
         self.commit()
         self.connection.close()
 
@@ -58,20 +455,25 @@ class RecSysDataBase:
         host: str = 'localhost',
         port: int = 5432
     ) -> None:
-        if not self.connection.closed:
+        if self.pool is not None:
+            if not self.pool.closed:
+                self.close()
+        elif not self.connection.closed:
             self.close()
-        self.connection = psycopg2.connect(
-            database=database,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
-        self.cursor = self.connection.cursor()
+        self._connect(database, user, password, host, port)
 
     @autocommit
     def execute(self, sql: str) -> None:
-        self.cursor.execute(sql)
+        with self.checkout() as cur:
+            cur.execute(sql)
+
+    @autocommit
+    def _upsert(self, sql: str) -> None:
+        with self.checkout() as cur:
+            retry_on_conflict(
+                cur, lambda: cur.execute(sql),
+                self.MAX_RETRIES, self.RETRY_DELAY
+            )
 
     @autocommit
     def create_dict(self) -> bool:
@@ -82,20 +484,91 @@ class RecSysDataBase:
         """
         tables = [row[0] for row in self.select(sql)]
         if self.dict_name in tables:
+            self.partitioned = self._is_partitioned()
             return False
 
-        sql = f"""
-        create table {self.dict_name}
-        (
-            key varchar(100) primary key,
-            inn_kpp varchar(22),
-            num int not null
-        );
-        create index index_{self.dict_name}_inn_kpp on key2num(inn_kpp);
-        """
+        if self.partitions is None:
+            sql = f"""
+            create table {self.dict_name}
+            (
+                key varchar(100) primary key,
+                inn_kpp varchar(22),
+                num int not null
+            );
+            create index index_{self.dict_name}_inn_kpp on key2num(inn_kpp);
+            """
+        else:
+            # Ключ секционирования обязан входить в первичный ключ. Так как
+            # inn_kpp однозначно определяется key, уникальность не меняется.
+            sql = f"""
+            create table {self.dict_name}
+            (
+                key varchar(100),
+                inn_kpp varchar(22) not null,
+                num int not null,
+                primary key (key, inn_kpp)
+            ) partition by hash (inn_kpp);
+            create index index_{self.dict_name}_inn_kpp on key2num(inn_kpp);
+            """ + \
+            ''.join(f"""
+            create table {self.dict_name}_p{i}
+                partition of {self.dict_name}
+                for values with (modulus {self.partitions}, remainder {i});
+            """ for i in range(self.partitions))
         self.execute(sql)
+        self.partitioned = self.partitions is not None
         return True
 
+    def _is_partitioned(self) -> bool:
+        sql = f"""
+        select c.relkind
+            from pg_catalog.pg_class c
+            join pg_catalog.pg_namespace n on n.oid = c.relnamespace
+            where n.nspname = 'public'
+                and c.relname = '{self.dict_name}';
+        """
+        return self.select(sql)[0][0] == 'p'
+
+    @property
+    def conflict_target(self) -> str:
+        return '(key, inn_kpp)' if self.partitioned else '(key)'
+
+    def partition_names(self) -> List[str]:
+        sql = f"""
+        select c.relname
+            from pg_catalog.pg_inherits i
+            join pg_catalog.pg_class c on c.oid = i.inhrelid
+            join pg_catalog.pg_class p on p.oid = i.inhparent
+            join pg_catalog.pg_namespace n on n.oid = p.relnamespace
+            where n.nspname = 'public'
+                and p.relname = '{self.dict_name}'
+            order by c.relname;
+        """
+        return [row[0] for row in self.select(sql)]
+
+    def vacuum_partitions(self, analyze: bool = True) -> List[str]:
+        """
+        Выполнить vacuum (analyze) отдельно для каждой секции. vacuum не
+        работает внутри транзакции, поэтому на время вызова соединение
+        переводится в autocommit. Возвращает имена обработанных таблиц.
+        """
+        names = self.partition_names() or [self.dict_name]
+        sql = 'vacuum analyze' if analyze else 'vacuum'
+        if self.pool is None:
+            self.commit()
+            conn_ctx = nullcontext(self.connection)
+        else:
+            conn_ctx = self._pooled_connection()
+        with conn_ctx as conn:
+            conn.autocommit = True
+            try:
+                with conn.cursor() as cur:
+                    for name in names:
+                        cur.execute(f'{sql} public.{name};')
+            finally:
+                conn.autocommit = False
+        return names
+
     def clear_dict(self) -> bool:
         sql = f"""
         select count(*)
@@ -110,18 +583,21 @@ class RecSysDataBase:
         truncate table public.{self.dict_name};
         """
         self.execute(sql)
+        if self.cache is not None:
+            self.cache.clear()
         return True
 
     def incr(self, key: str, inn_kpp: str, num: int = 1) -> None:
         sql = f"""
         insert into public.{self.dict_name} values
         ('{key}', '{inn_kpp}', {num})
-        on conflict (key)
+        on conflict {self.conflict_target}
         do update set
             key = excluded.key,
             num = {self.dict_name}.num + excluded.num;
         """
-        self.execute(sql)
+        self._upsert(sql)
+        self._invalidate((key,), (inn_kpp,))
 
     def incrby(
         self, 
@@ -133,28 +609,111 @@ class RecSysDataBase:
         ('{{ key }}', '{{ innkpp }}', {{ num }}),
         {%- endfor %}
         ('{{ rows[-1][0] }}', '{{ rows[-1][1] }}', {{ rows[-1][2] }})
-        on conflict (key)
+        on conflict {{ conflict_target }}
         do update set
             key = excluded.key,
             num = {{ dict_name }}.num + excluded.num;
         """)
-        if isinstance(rows, Mapping):
-            rows = tuple((key, inn_kpp, num) 
-                         for key, (inn_kpp, num) in rows.items())
-        elif isinstance(rows, Generator):
-            rows = tuple(rows)
-        elif isinstance(rows, Sequence):
-            rows = rows
-        else:
-            raise ValueError(f'Неправильный тип rows - `{type(rows)}`.')
+        rows = merge_rows(rows)
+        if not rows:
+            return
 
         sql = tpl.render({
             'dict_name': self.dict_name,
+            'conflict_target': self.conflict_target,
             'rows': rows
         })
-        self.execute(sql)
+        self._upsert(sql)
+        self._invalidate(
+            [key for key, _, _ in rows], [inn_kpp for _, inn_kpp, _ in rows]
+        )
+
+    @autocommit
+    def incrby_bulk(
+        self,
+        rows: Mapping[str, Tuple[str, int]] | Iterable[Tuple[str, str, int]],
+        chunk_size: int = 100_000
+    ) -> None:
+        """
+        Массовый аналог incrby: строки потоком загружаются через COPY во
+        временную таблицу порциями по chunk_size, после чего одним запросом
+        сливаются в основную таблицу. Повторяющиеся ключи суммируются.
+        """
+        staging_name = f'{self.dict_name}_staging'
+        with self.checkout() as cur:
+            cur.execute(f"""
+            create temp table if not exists {staging_name}
+            (
+                key varchar(100),
+                inn_kpp varchar(22),
+                num int not null
+            ) on commit delete rows;
+            """)
+
+            if isinstance(rows, Mapping):
+                rows = ((key, inn_kpp, num)
+                        for key, (inn_kpp, num) in rows.items())
+            if self.cache is not None:
+                keys, inn_kpps = set(), set()
+                rows = _track_rows(rows, keys, inn_kpps)
+            for chunk in self._copy_chunks(rows, chunk_size):
+                cur.copy_expert(f'copy {staging_name} from stdin', chunk)
+
+            # Строки сливаются в порядке ключа, чтобы параллельные загрузки
+            # блокировали строки в одном порядке.
+            retry_on_conflict(cur, lambda: cur.execute(f"""
+            insert into public.{self.dict_name}
+                select key, min(inn_kpp), sum(num)
+                    from {staging_name}
+                    group by key
+                    order by key
+            on conflict {self.conflict_target}
+            do update set
+                num = {self.dict_name}.num + excluded.num;
+            """), self.MAX_RETRIES, self.RETRY_DELAY)
+            cur.execute(f'truncate {staging_name};')
+        if self.cache is not None:
+            self._invalidate(keys, inn_kpps)
+
+    def _invalidate(self, keys: Iterable[str], inn_kpps: Iterable[str]) -> None:
+        if self.cache is None:
+            return
+        keys, inn_kpps = tuple(keys), tuple(inn_kpps)
+        for key in keys:
+            self.cache.pop(('key', key))
+        for inn_kpp in inn_kpps:
+            self.cache.pop(('inn_kpp', inn_kpp))
+        invalidated = getattr(self._local, 'invalidated', None)
+        if invalidated is not None:
+            invalidated.append((keys, inn_kpps))
+
+    @staticmethod
+    def _copy_chunks(
+        rows: Iterable[Tuple[str, str, int]],
+        chunk_size: int
+    ) -> Iterator[StringIO]:
+        if chunk_size < 1:
+            raise ValueError(f'Неправильный размер порции - `{chunk_size}`.')
+        rows = iter(rows)
+        while True:
+            chunk = tuple(islice(rows, chunk_size))
+            if not chunk:
+                return
+            buf = StringIO()
+            for key, inn_kpp, num in chunk:
+                buf.write('\t'.join(
+                    (_copy_escape(key), _copy_escape(inn_kpp), str(int(num)))
+                ) + '\n')
+            buf.seek(0)
+            yield buf
 
     def get(self, key: str) -> str:
+        if self.cache is not None:
+            num = self.cache.get(('key', key))
+            if num is not _MISSING:
+                return num
+            token = self.cache.token(('key', key))
+
         sql = f"""
         select num
             from public.{self.dict_name}
@@ -162,23 +721,173 @@ class RecSysDataBase:
         """
         res = self.select(sql)
         try:
-            return res[0][0]
+            num = res[0][0]
         except IndexError:
-            return 0
+            num = 0
+        if self.cache is not None:
+            self.cache.set(('key', key), num, token)
+        return num
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        """
+        Значения сразу для нескольких ключей за один запрос. Для отсутствующих
+        ключей, как и в get, возвращается 0.
+        """
+        keys = list(keys)
+        res = dict.fromkeys(keys, 0)
+        if self.cache is not None:
+            for key in keys:
+                res[key] = self.cache.get(('key', key))
+            keys = [key for key, num in res.items() if num is _MISSING]
+            res.update(dict.fromkeys(keys, 0))
+            tokens = [self.cache.token(('key', key)) for key in keys]
+        if not keys:
+            return res
+
+        sql = f"""
+        select key, num
+            from public.{self.dict_name}
+            where key = any(%s);
+        """
+        found = dict(self.select(sql, (keys,)))
+        res.update(found)
+        if self.cache is not None:
+            for key, token in zip(keys, tokens):
+                self.cache.set(('key', key), found.get(key, 0), token)
+        return res
 
     def get_innkpp(self, inn_kpp: str) -> List[Tuple[str, int]]:
+        if self.cache is not None:
+            rows = self.cache.get(('inn_kpp', inn_kpp))
+            if rows is not _MISSING:
+                return list(rows)
+            token = self.cache.token(('inn_kpp', inn_kpp))
+
         sql = f"""
         select key, num
             from public.{self.dict_name}
             where inn_kpp = '{inn_kpp}';
         """
-        return self.select(sql)
+        rows = self.select(sql)
+        if self.cache is not None:
+            self.cache.set(('inn_kpp', inn_kpp), tuple(rows), token)
+        return rows
+
+    def iter_innkpp(
+        self,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000
+    ) -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """
+        Потоковое чтение строк сразу по многим поставщикам: один проход по
+        таблице через серверный курсор, отсортированный по inn_kpp. Строки
+        подгружаются порциями по fetch_size и отдаются парами
+        (inn_kpp, [(key, num), ...]). Если inn_kpps не задан, читаются все
+        поставщики. Во время чтения можно писать в таблицу (см.
+        _stream_cursor), но сделанные записи в поток не попадают.
+        """
+        sql = f"""
+        select inn_kpp, key, num
+            from public.{self.dict_name}
+            {'' if inn_kpps is None else 'where inn_kpp = any(%s)'}
+            order by inn_kpp;
+        """
+        params = None if inn_kpps is None else (list(inn_kpps),)
+        with self._stream_cursor(f'{self.dict_name}_stream_{uuid4().hex}') as cur:
+            cur.itersize = fetch_size
+            cur.execute(sql, params)
+            for inn_kpp, group in groupby(cur, key=itemgetter(0)):
+                yield inn_kpp, [(key, num) for _, key, num in group]
 
     @staticmethod
     def gen_key(*args) -> str:
         return ':'.join(str(arg) for arg in args) 
 
 
+class IncrBuffer:
+    """
+    Буфер отложенной записи для incr: приращения суммируются по ключу в
+    памяти и записываются через RecSysDataBase.incrby_bulk одной транзакцией.
+    Сброс происходит при накоплении max_keys различных ключей, при
+    очередной записи спустя flush_interval секунд после прошлого сброса,
+    а также при явном вызове flush() и при close().
+    """
+    def __init__(
+        self,
+        db: RecSysDataBase,
+        max_keys: int = 100_000,
+        flush_interval: float | None = 5.
+    ) -> None:
+        self.db = db
+        self.max_keys = max_keys
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self._lock = Lock()
+        self._last_flush = monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.pending)
+
+    def incr(self, key: str, inn_kpp: str, num: int = 1) -> None:
+        with self._lock:
+            self._add(key, inn_kpp, num)
+        self._flush_if_needed()
+
+    def incrby(
+        self,
+        rows: Mapping[str, Tuple[str, int]] | Iterable[Tuple[str, str, int]]
+    ) -> None:
+        if isinstance(rows, Mapping):
+            rows = ((key, inn_kpp, num)
+                    for key, (inn_kpp, num) in rows.items())
+        with self._lock:
+            for key, inn_kpp, num in rows:
+                self._add(key, inn_kpp, num)
+        self._flush_if_needed()
+
+    def flush(self) -> int:
+        """Записать накопленные приращения. Возвращает кол-во ключей."""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+            self._last_flush = monotonic()
+            if not pending:
+                return 0
+            try:
+                with self.db.transaction():
+                    self.db.incrby_bulk(
+                        (key, inn_kpp, num)
+                        for key, (inn_kpp, num) in pending.items()
+                    )
+            except BaseException:
+                # Не теряем приращения: возвращаем их обратно в буфер.
+                for key, (inn_kpp, num) in pending.items():
+                    self._add(key, inn_kpp, num)
+                raise
+        return len(pending)
+
+    def close(self) -> None:
+        self.flush()
+
+    def _add(self, key: str, inn_kpp: str, num: int) -> None:
+        if key in self.pending:
+            self.pending[key][1] += num
+        else:
+            self.pending[key] = [inn_kpp, num]
+
+    def _flush_if_needed(self) -> None:
+        if len(self.pending) >= self.max_keys or (
+            self.flush_interval is not None
+            and monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
+
+
 rc = NamedTuple('rc', region_code=str)
 fz = NamedTuple('fz', fz=str)
 pr = NamedTuple('pr', price_cat=int)
@@ -189,93 +898,148 @@ okw = NamedTuple('okw', okpd2_code=str, iswin=bool)
 okrw = NamedTuple('okrw', okpd2_code=str, region_code=str, iswin=bool)
 okcw = NamedTuple('okcw', okpd2_code=str, customer_inn_kpp=str, iswin=bool)
 
+
+def _parse_iswin(iswin: str) -> bool:
+    if iswin == 'True':
+        return True
+    if iswin == 'False':
+        return False
+    try:
+        return bool(int(iswin))
+    except ValueError:
+        raise ValueError(f'iswin `{iswin}` записан некорректно.')
+
+
+# Определитель ключа -> (кол-во элементов, сборка ключа из элементов).
+# Ключ разбивается один раз, по таблице выбирается только сборка.
+KEY_PARSERS = {
+    'rc': (3, lambda e: rc(e[2])),
+    'fz': (3, lambda e: fz(e[2])),
+    'pr': (3, lambda e: pr(int(e[2]))),
+    'okw': (4, lambda e: okw(e[2], _parse_iswin(e[3]))),
+    'okrw': (5, lambda e: okrw(e[2], e[3], _parse_iswin(e[4]))),
+    'okcw': (5, lambda e: okcw(e[2], e[3], _parse_iswin(e[4]))),
+}
+
+
+class KeyPool:
+    """
+    Пул канонических ключей. Одинаковые ключи разных поставщиков (и строки
+    кодов внутри них) хранятся в одном экземпляре, профили держат только
+    ссылки на него. Хеширование и сравнение ключей не меняются.
+    """
+    def __init__(self) -> None:
+        self._keys = {}
+
+    def intern(self, key_info: NamedTuple) -> NamedTuple:
+        canon = self._keys.get(key_info)
+        if canon is None:
+            canon = key_info._make(
+                intern(value) if type(value) is str else value
+                for value in key_info
+            )
+            canon = self._keys.setdefault(canon, canon)
+        return canon
+
+    def clear(self) -> None:
+        self._keys.clear()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
 class KeyInfoBuilder:
+    def __init__(self, pool: KeyPool | None = None) -> None:
+        # С пулом разобранные ключи возвращаются каноническими (см. KeyPool).
+        self.pool = pool
+
     def from_str(self, key: str) -> NamedTuple:
         key_elems = key.split(':')
         if len(key_elems) < 3 or len(key_elems) > 5:
             raise ValueError(f'Структура ключа `{key}` является невалидной.')
-        
-        if key_elems[0] == 'rc': return self.rc_from_str(key)
-        if key_elems[0] == 'fz': return self.fz_from_str(key)
-        if key_elems[0] == 'pr': return self.pr_from_str(key)
-        if key_elems[0] == 'okw': return self.okw_from_str(key)
-        if key_elems[0] == 'okrw': return self.okrw_from_str(key)
-        if key_elems[0] == 'okcw': return self.okcw_from_str(key)
-
-        raise ValueError(
-            f'Ключ `{key}` содержит неправильный определитель (1 элемент).'
-        )
+        try:
+            n_elems, build = KEY_PARSERS[key_elems[0]]
+        except KeyError:
+            raise ValueError(
+                f'Ключ `{key}` содержит неправильный определитель (1 элемент).'
+            )
+        if len(key_elems) != n_elems:
+            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
+        if self.pool is None:
+            return build(key_elems)
+        return self.pool.intern(build(key_elems))
 
-    def rc_from_str(self, key: str) -> rc:
+    def parse_many(
+        self,
+        keys: Iterable[str],
+        columnar: bool = False
+    ) -> List[NamedTuple] | Dict[type, Dict[str, list]]:
+        """
+        Разбор набора ключей за один вызов. По умолчанию возвращает список
+        ключей в порядке keys. При columnar=True - колонки по типам ключей:
+        {okw: {'index': [...], 'okpd2_code': [...], 'iswin': [...]}, ...},
+        где index - позиции ключей в keys.
+        """
+        parsers = KEY_PARSERS
+        res = []
+        append = res.append
+        for key in keys:
+            key_elems = key.split(':')
+            parser = parsers.get(key_elems[0])
+            if parser is None or len(key_elems) != parser[0]:
+                # Медленный путь только ради сообщения об ошибке.
+                self.from_str(key)
+            append(parser[1](key_elems))
+        if self.pool is not None:
+            res = list(map(self.pool.intern, res))
+        if not columnar:
+            return res
+
+        columns = {}
+        for i, key_info in enumerate(res):
+            type_ = type(key_info)
+            cols = columns.get(type_)
+            if cols is None:
+                cols = columns[type_] = {
+                    'index': [], **{field: [] for field in type_._fields}
+                }
+            cols['index'].append(i)
+            for field, value in zip(type_._fields, key_info):
+                cols[field].append(value)
+        return columns
+
+    def _from_str(self, key: str, kind: str) -> NamedTuple:
         key_elems = key.split(':')
-        if len(key_elems) != 3:
+        n_elems, build = KEY_PARSERS[kind]
+        if len(key_elems) != n_elems:
             raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'rc':
+        if key_elems[0] != kind:
             raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        region_code = key_elems[2]
-        return rc(region_code)
-    
+        if self.pool is None:
+            return build(key_elems)
+        return self.pool.intern(build(key_elems))
+
+    def rc_from_str(self, key: str) -> rc:
+        return self._from_str(key, 'rc')
+
     def fz_from_str(self, key: str) -> fz:
-        key_elems = key.split(':')
-        if len(key_elems) != 3:
-            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'fz':
-            raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        fz_ = key_elems[2]
-        return fz(fz_)
+        return self._from_str(key, 'fz')
 
     def pr_from_str(self, key: str) -> pr:
-        key_elems = key.split(':')
-        if len(key_elems) != 3:
-            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'pr':
-            raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        price_cat = int(key_elems[2])
-        return pr(price_cat)
+        return self._from_str(key, 'pr')
 
-    def okw_from_str(self, key: str) -> rc:
-        key_elems = key.split(':')
-        if len(key_elems) != 4:
-            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'okw':
-            raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        okpd2_code = key_elems[2]
-        iswin = self.parse_iswin(key_elems[3])
-        return okw(okpd2_code, iswin)
+    def okw_from_str(self, key: str) -> okw:
+        return self._from_str(key, 'okw')
 
-    def okrw_from_str(self, key: str) -> rc:
-        key_elems = key.split(':')
-        if len(key_elems) != 5:
-            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'okrw':
-            raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        okpd2_code = key_elems[2]
-        region_code = key_elems[3]
-        iswin = self.parse_iswin(key_elems[4])
-        return okrw(okpd2_code, region_code, iswin)
+    def okrw_from_str(self, key: str) -> okrw:
+        return self._from_str(key, 'okrw')
 
-    def okcw_from_str(self, key: str) -> rc:
-        key_elems = key.split(':')
-        if len(key_elems) != 5:
-            raise ValueError(f'В ключе `{key}` неправильное кол-во элементов.')
-        if key_elems[0] != 'okcw':
-            raise ValueError(f'Ключ `{key}` имеет неправильную структуру.')
-        okpd2_code = key_elems[2]
-        customer_inn_kpp = key_elems[3]
-        iswin = self.parse_iswin(key_elems[4])
-        return okcw(okpd2_code, customer_inn_kpp, iswin)
-
-    def parse_iswin(self, iswin: str) -> bool:
-        if iswin == 'True':
-            iswin = True
-        elif iswin == 'False':
-            iswin = False
-        else:
-            try:
-                iswin = bool(int(iswin))
-            except ValueError:
-                raise ValueError(f'iswin `{iswin}` записан некорректно.')
-        return iswin
+    def okcw_from_str(self, key: str) -> okcw:
+        return self._from_str(key, 'okcw')
+
+    @staticmethod
+    def parse_iswin(iswin: str) -> bool:
+        return _parse_iswin(iswin)
 
     @staticmethod
     def gen_key(*args) -> str:
@@ -0,0 +1,146 @@
+import sys
+
+from multiprocessing import get_context
+from operator import itemgetter
+from pathlib import Path
+from queue import Full
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Sequence, Tuple
+from zlib import crc32
+
+try:
+    # Импорт из пакета (db.ingest): sys.path не трогаем, иначе в
+    # порожденных процессах имя db разрешится в модуль db.py.
+    from .db import RecSysDataBase
+except ImportError:
+    sys.path.append(str(Path(__file__).parent))
+    from db import RecSysDataBase
+
+
+def route(inn_kpp: str, workers: int) -> int:
+    """
+    Номер воркера для поставщика. Хеш стабилен между процессами и
+    запусками, поэтому все строки одного поставщика всегда пишет один и
+    тот же воркер, и воркеры не конкурируют за одни и те же ключи.
+    """
+    return crc32(str(inn_kpp).encode()) % workers
+
+
+def _write_worker(
+    connect_kwargs: Dict[str, Any],
+    chunk_size: int,
+    transform: Callable[[List], Sequence[Tuple[str, str, int]]] | None,
+    tasks,
+    results
+) -> None:
+    db = RecSysDataBase(**connect_kwargs)
+    items, written = 0, 0
+    while (batch := tasks.get()) is not None:
+        rows = batch if transform is None else transform(batch)
+        db.incrby_bulk(rows, chunk_size)
+        items += len(batch)
+        written += len(rows)
+    db.close()
+    results.put((items, written))
+
+
+def _put(queue, proc, item) -> None:
+    # Очередь ограничена, поэтому при падении воркера put заблокировался бы
+    # навсегда. Периодически проверяем, что воркер жив.
+    while True:
+        try:
+            queue.put(item, timeout=1.)
+            return
+        except Full:
+            if not proc.is_alive():
+                raise RuntimeError(
+                    f'Воркер загрузки завершился с кодом {proc.exitcode}.'
+                )
+
+
+def run_sharded(
+    items: Iterable[Any],
+    inn_kpp_getter: Callable[[Any], str],
+    transform: Callable[[List], Sequence[Tuple[str, str, int]]] | None = None,
+    workers: int = 4,
+    batch_size: int = 50_000,
+    chunk_size: int = 100_000,
+    max_pending: int = 2,
+    **connect_kwargs
+) -> List[Tuple[int, int]]:
+    """
+    Раздать элементы по процессам-воркерам по inn_kpp (см. route) пачками
+    по batch_size. Воркер превращает пачку в строки key2num функцией
+    transform (по умолчанию элементы и есть строки) и пишет их через
+    собственное соединение методом incrby_bulk. В очереди каждого воркера
+    не больше max_pending пачек, так что память процесса-распределителя
+    ограничена. transform и inn_kpp_getter должны сериализоваться pickle.
+    Возвращает для каждого воркера пару (кол-во элементов, кол-во строк).
+    """
+    ctx = get_context('spawn')
+    results = ctx.Queue()
+    queues = [ctx.Queue(max_pending) for _ in range(workers)]
+    procs = [
+        ctx.Process(
+            target=_write_worker,
+            args=(connect_kwargs, chunk_size, transform, queue, results),
+            daemon=True
+        )
+        for queue in queues
+    ]
+    for proc in procs:
+        proc.start()
+
+    batches = [[] for _ in range(workers)]
+    try:
+        for item in items:
+            i = route(inn_kpp_getter(item), workers)
+            batches[i].append(item)
+            if len(batches[i]) >= batch_size:
+                _put(queues[i], procs[i], batches[i])
+                batches[i] = []
+        for queue, proc, batch in zip(queues, procs, batches):
+            if batch:
+                _put(queue, proc, batch)
+    finally:
+        for queue, proc in zip(queues, procs):
+            if proc.is_alive():
+                queue.put(None)
+        for proc in procs:
+            proc.join()
+
+    for proc in procs:
+        if proc.exitcode != 0:
+            raise RuntimeError(
+                f'Воркер загрузки завершился с кодом {proc.exitcode}.'
+            )
+    return [results.get() for _ in procs]
+
+
+def parallel_incrby(
+    rows: Mapping[str, Tuple[str, int]] | Iterable[Tuple[str, str, int]],
+    workers: int = 4,
+    batch_size: int = 50_000,
+    chunk_size: int = 100_000,
+    max_pending: int = 2,
+    **connect_kwargs
+) -> int:
+    """
+    Параллельная загрузка строк в key2num несколькими процессами
+    (см. run_sharded). Строки распределяются по воркерам по inn_kpp
+    (см. route); это crc32, а не хеш-секционирование Postgres, поэтому
+    воркер не привязан к секции таблицы. Возвращает кол-во записанных строк.
+    """
+    if isinstance(rows, Mapping):
+        rows = ((key, inn_kpp, num)
+                for key, (inn_kpp, num) in rows.items())
+
+    stats = run_sharded(
+        rows,
+        itemgetter(1),
+        workers=workers,
+        batch_size=batch_size,
+        chunk_size=chunk_size,
+        max_pending=max_pending,
+        **connect_kwargs
+    )
+    return sum(written for _, written in stats)
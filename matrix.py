@@ -0,0 +1,207 @@
+import sys
+
+from array import array
+from pathlib import Path
+from typing import (
+    Any, Callable, Dict, Hashable, Iterable, List, Mapping, NamedTuple, Tuple
+)
+
+import numpy as np
+
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils import NormDict
+from db.db import CounterBackend
+
+
+class Vocab:
+    """
+    Словарь меток строк/столбцов матрицы. Метки только добавляются, поэтому
+    словарь, переданный в следующую сборку, сохраняет прежние индексы.
+    """
+    def __init__(self, labels: Iterable[Hashable] = ()) -> None:
+        self.labels: List[Hashable] = []
+        self.index: Dict[Hashable, int] = {}
+        for label in labels:
+            self.add(label)
+
+    def add(self, label: Hashable) -> int:
+        i = self.index.get(label)
+        if i is None:
+            i = self.index[label] = len(self.labels)
+            self.labels.append(label)
+        return i
+
+    def copy(self) -> 'Vocab':
+        return Vocab(self.labels)
+
+    def get(self, label: Hashable, default: int = -1) -> int:
+        return self.index.get(label, default)
+
+    def __getitem__(self, i: int) -> Hashable:
+        return self.labels[i]
+
+    def __contains__(self, label: Hashable) -> bool:
+        return label in self.index
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+class CSRMatrix(NamedTuple):
+    data: np.ndarray
+    indices: np.ndarray
+    indptr: np.ndarray
+    shape: Tuple[int, int]
+
+    def toarray(self) -> np.ndarray:
+        res = np.zeros(self.shape, dtype=self.data.dtype)
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        res[rows, self.indices] = self.data
+        return res
+
+    def to_scipy(self):
+        """scipy.sparse.csr_matrix с теми же массивами (нужен scipy)."""
+        from scipy.sparse import csr_matrix
+        return csr_matrix(
+            (self.data, self.indices, self.indptr), shape=self.shape
+        )
+
+
+class FeatureMatrix(NamedTuple):
+    counts: CSRMatrix
+    norms: CSRMatrix
+    rows: Vocab
+    columns: Vocab
+
+
+# Признак -> (представление SupplierInfo, метка столбца по ключу представления).
+FEATURES: Dict[str, Tuple[Callable[[SupplierInfo], NormDict], Callable]] = {
+    'okpd2': (lambda m: m.get_okpd2count(), lambda key: key.okpd2_code),
+    'region': (lambda m: m.region2count, lambda key: key.region_code),
+    'customer': (
+        # Свертка до 0 знаков ОКПД2 - счетчики по заказчикам.
+        lambda m: m.get_okpd_customer2count(0),
+        lambda key: key.customer_inn_kpp
+    ),
+    'fz': (lambda m: m.fz2count, lambda key: key.fz),
+    'price_cat': (lambda m: m.price_cat2count, lambda key: key.price_cat),
+}
+
+
+class MatrixBuilder:
+    """
+    Построение разреженных матриц поставщик x признак (CSR) по профилям
+    SupplierInfo за один проход. Для каждого признака строятся матрицы
+    счетчиков и норм с общими словарями строк и столбцов.
+    """
+    def __init__(
+        self,
+        features: Iterable[str] | Mapping[str, Tuple[Callable, Callable]]
+            = ('okpd2', 'region', 'customer'),
+        rows: Vocab | None = None,
+        columns: Mapping[str, Vocab] | None = None
+    ) -> None:
+        if not isinstance(features, Mapping):
+            features = {name: FEATURES[name] for name in features}
+        self.features = dict(features)
+        # Переданные словари копируются и дополняются новыми метками.
+        self.rows = Vocab() if rows is None else rows.copy()
+        columns = columns or {}
+        self.columns = {
+            name: columns[name].copy() if name in columns else Vocab()
+            for name in self.features
+        }
+        # Строки матриц копятся в компактных массивах до build().
+        self._row_ids = array('q')
+        self._parts = {
+            name: (array('q', [0]), array('q'), array('q'), array('d'))
+            for name in self.features
+        }
+
+    def add(self, model: SupplierInfo) -> None:
+        self._row_ids.append(self.rows.add(model.inn_kpp))
+        for name, (view_getter, label_getter) in self.features.items():
+            indptr, indices, counts, norms = self._parts[name]
+            columns = self.columns[name]
+            cells = sorted(
+                (columns.add(label_getter(key)), value.count, value.norm)
+                for key, value in view_getter(model).items()
+            )
+            for i, count, norm in cells:
+                indices.append(i)
+                counts.append(count)
+                norms.append(norm)
+            indptr.append(len(indices))
+
+    def update(self, models: Iterable[SupplierInfo]) -> 'MatrixBuilder':
+        for model in models:
+            self.add(model)
+        return self
+
+    def build(self) -> Dict[str, FeatureMatrix]:
+        """
+        Матрицы по признакам. Строка i соответствует rows[i]; если поставщик
+        добавлялся несколько раз, его строки суммируются (нормы - тоже,
+        поэтому в этом случае они имеют смысл только для одной записи).
+        """
+        n_rows = len(self.rows)
+        row_ids = np.frombuffer(self._row_ids, dtype=np.int64)
+        res = {}
+        for name, (indptr, indices, counts, norms) in self._parts.items():
+            shape = (n_rows, len(self.columns[name]))
+            res[name] = FeatureMatrix(
+                counts=_to_csr(row_ids, indptr, indices, counts, shape),
+                norms=_to_csr(row_ids, indptr, indices, norms, shape),
+                rows=self.rows,
+                columns=self.columns[name]
+            )
+        return res
+
+
+def _to_csr(
+    row_ids: np.ndarray,
+    indptr: array,
+    indices: array,
+    data: array,
+    shape: Tuple[int, int]
+) -> CSRMatrix:
+    indptr = np.frombuffer(indptr, dtype=np.int64)
+    indices = np.frombuffer(indices, dtype=np.int64)
+    data = np.frombuffer(
+        data, dtype=np.int64 if data.typecode == 'q' else np.float64
+    )
+    rows = np.repeat(row_ids, np.diff(indptr))
+    # Ячейки сортируются по (строка, столбец), повторы складываются.
+    cells = rows * max(shape[1], 1) + indices
+    order = np.argsort(cells, kind='stable')
+    cells, data = cells[order], data[order]
+    uniq, start = np.unique(cells, return_index=True)
+    data = np.add.reduceat(data, start) if len(data) else data
+    rows, indices = np.divmod(uniq, max(shape[1], 1))
+    res_indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=shape[0]), out=res_indptr[1:])
+    return CSRMatrix(data, indices.astype(np.int32), res_indptr, shape)
+
+
+def build_matrices(
+    models: Iterable[SupplierInfo],
+    features: Iterable[str] | Mapping[str, Tuple[Callable, Callable]]
+        = ('okpd2', 'region', 'customer'),
+    rows: Vocab | None = None,
+    columns: Mapping[str, Vocab] | None = None
+) -> Dict[str, FeatureMatrix]:
+    return MatrixBuilder(features, rows, columns).update(models).build()
+
+
+def build_matrices_from_db(
+    db: CounterBackend,
+    inn_kpps: Iterable[str] | None = None,
+    fetch_size: int = 10_000,
+    **kwargs: Any
+) -> Dict[str, FeatureMatrix]:
+    """Матрицы прямо из key2num за один проход (см. SupplierInfo.iter_from_db)."""
+    return build_matrices(
+        SupplierInfo.iter_from_db(db, inn_kpps, fetch_size), **kwargs
+    )
@@ -0,0 +1,109 @@
+import sys
+
+from operator import attrgetter
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Sequence, Tuple
+
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils import get_price_cat
+from db.ingest import run_sharded
+
+
+class Purchase(NamedTuple):
+    inn_kpp: str
+    okpd2_codes: Sequence[str]
+    region_code: str
+    customer_inn_kpp: str
+    fz: str
+    price: float
+    is_win: bool
+
+
+class BuildReport(NamedTuple):
+    records: int
+    suppliers: int
+    rows: int
+    seconds: float
+
+    def __str__(self) -> str:
+        return (
+            f'Записей: {self.records}, поставщиков: {self.suppliers}, '
+            f'строк: {self.rows}, время: {self.seconds:.1f} с, '
+            f'{self.records / max(self.seconds, 1e-9):.0f} записей/с'
+        )
+
+
+def build_profiles(records: Iterable[Purchase]) -> Dict[str, SupplierInfo]:
+    """Профили поставщиков по сырым записям о закупках."""
+    profiles = {}
+    for rec in records:
+        model = profiles.get(rec.inn_kpp)
+        if model is None:
+            model = profiles[rec.inn_kpp] = SupplierInfo(rec.inn_kpp)
+        model.update_region2count((rec.region_code,))
+        model.update_fz2count((rec.fz,))
+        model.update_price_cat2count((get_price_cat(rec.price),))
+        model.update_okpd_iswin2count(rec.okpd2_codes, rec.is_win)
+        model.update_okpd_region_iswin2count(
+            rec.okpd2_codes, rec.region_code, rec.is_win
+        )
+        model.update_okpd_customer_iswin2count(
+            rec.okpd2_codes, rec.customer_inn_kpp, rec.is_win
+        )
+    return profiles
+
+
+def build_rows(records: List[Purchase]) -> List[Tuple[str, str, int]]:
+    return [
+        row
+        for model in build_profiles(records).values()
+        for row in model.as_rows()
+    ]
+
+
+def build_and_store(
+    records: Iterable[Purchase | Mapping[str, Any]],
+    workers: int = 4,
+    batch_size: int = 10_000,
+    chunk_size: int = 100_000,
+    verbose: bool = True,
+    **connect_kwargs
+) -> BuildReport:
+    """
+    Построить профили поставщиков в несколько процессов и записать их в БД.
+    Записи распределяются по воркерам по inn_kpp поставщика, каждый воркер
+    строит профили своих поставщиков (build_rows) и пишет строки через
+    собственное соединение (см. ingest.run_sharded). Так как счетчики
+    аддитивны, профиль поставщика может строиться по частям из разных пачек.
+    """
+    start = perf_counter()
+    suppliers = set()
+
+    def tracked():
+        for rec in records:
+            if not isinstance(rec, Purchase):
+                rec = Purchase(**rec)
+            suppliers.add(rec.inn_kpp)
+            yield rec
+
+    stats = run_sharded(
+        tracked(),
+        attrgetter('inn_kpp'),
+        build_rows,
+        workers=workers,
+        batch_size=batch_size,
+        chunk_size=chunk_size,
+        **connect_kwargs
+    )
+    report = BuildReport(
+        records=sum(items for items, _ in stats),
+        suppliers=len(suppliers),
+        rows=sum(rows for _, rows in stats),
+        seconds=perf_counter() - start
+    )
+    if verbose:
+        print(report)
+    return report
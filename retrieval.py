@@ -0,0 +1,211 @@
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .matrix import Vocab
+from .scoring import Query
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils import prepare_okpd2_code
+from db.db import CounterBackend, okw, okrw, okcw
+
+Term = Tuple[str, str]
+
+
+class CandidateIndex:
+    """
+    Инвертированный индекс для подбора кандидатов: терм (ОКПД2 на
+    нескольких уровнях, регион, заказчик) -> список поставщиков со
+    счетчиками. Термы строятся по ключам okw (ОКПД2), okrw (регион) и okcw
+    (заказчик). Списки хранятся массивами, отсортированными по номеру
+    поставщика, поэтому пересечение и объединение - операции NumPy.
+    """
+    def __init__(
+        self,
+        okpd_depths: Sequence[int] = (2, 5, 8, 12),
+        max_postings: int | None = None
+    ) -> None:
+        self.okpd_depths = tuple(okpd_depths)
+        # Сколько самых частых поставщиков хранить в списке терма
+        # (None - всех). Отсечение ускоряет запросы ценой полноты.
+        self.max_postings = max_postings
+        self.suppliers = Vocab()
+        self.postings: Dict[Term, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Dict[Term, Dict[int, int]] = {}
+
+    @classmethod
+    def from_db(
+        cls,
+        db: CounterBackend,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000,
+        **kwargs
+    ) -> 'CandidateIndex':
+        """Индекс по key2num за один проход (см. SupplierInfo.iter_from_db)."""
+        return cls(**kwargs).update(
+            SupplierInfo.iter_from_db(db, inn_kpps, fetch_size)
+        )
+
+    def okpd_terms(self, okpd2_code: str) -> List[Term]:
+        return [
+            ('okpd2', prepare_okpd2_code(okpd2_code[:depth]))
+            for depth in self.okpd_depths
+        ]
+
+    def add(self, model: SupplierInfo) -> None:
+        """
+        Добавить счетчики поставщика. Повторное добавление складывает
+        счетчики, списки обновляются при следующем запросе.
+        """
+        i = self.suppliers.add(model.inn_kpp)
+        terms = {}
+        for key, count in model.info.part(okw).items():
+            for term in set(self.okpd_terms(key.okpd2_code)):
+                terms[term] = terms.get(term, 0) + count
+        for key, count in model.info.part(okrw).items():
+            term = ('region', key.region_code)
+            terms[term] = terms.get(term, 0) + count
+        for key, count in model.info.part(okcw).items():
+            term = ('customer', key.customer_inn_kpp)
+            terms[term] = terms.get(term, 0) + count
+        for term, count in terms.items():
+            pending = self._pending.setdefault(term, {})
+            pending[i] = pending.get(i, 0) + count
+
+    def update(self, models: Iterable[SupplierInfo]) -> 'CandidateIndex':
+        for model in models:
+            self.add(model)
+        return self
+
+    def posting(self, term: Term) -> Tuple[np.ndarray, np.ndarray]:
+        """(номера поставщиков по возрастанию, счетчики) терма."""
+        self._flush()
+        return self.postings.get(term, _EMPTY_POSTING)
+
+    def search(
+        self,
+        terms: Iterable[Term],
+        mode: str = 'or',
+        top_n: int | None = 100
+    ) -> List[Tuple[str, int]]:
+        """
+        Поставщики, у которых есть все (mode='and') или хотя бы один
+        (mode='or') из термов, по убыванию суммы счетчиков по термам.
+        """
+        if mode not in ('and', 'or'):
+            raise ValueError(f'Неизвестный режим поиска `{mode}`.')
+        postings = [self.posting(term) for term in set(terms)]
+        if mode == 'and':
+            ids, scores = _intersect(postings)
+        else:
+            ids, scores = _union(postings)
+        return self._top(ids, scores, top_n)
+
+    def candidates(
+        self,
+        query: Query,
+        top_n: int | None = 100,
+        len_okpd: int = 5
+    ) -> List[Tuple[str, int]]:
+        """
+        Кандидаты для закупки: поставщики с кодами ОКПД2 закупки (до
+        len_okpd знаков), ранжированные по сумме счетчиков ОКПД2, региона
+        и заказчика закупки. Результат подходит как candidates для
+        ScoringEngine. len_okpd должен быть одним из okpd_depths индекса.
+        """
+        if len_okpd not in self.okpd_depths:
+            raise ValueError(
+                f'Индекс не хранит термы ОКПД2 длины {len_okpd}, '
+                f'доступны: {self.okpd_depths}.'
+            )
+        okpd_terms = {
+            ('okpd2', prepare_okpd2_code(prepare_okpd2_code(code)[:len_okpd]))
+            for code in query.okpd2_codes
+        }
+        ids, scores = _union([self.posting(term) for term in okpd_terms])
+        for term in (('region', str(query.region_code)),
+                     ('customer', str(query.customer_inn_kpp))):
+            scores = scores + _lookup(self.posting(term), ids)
+        return self._top(ids, scores, top_n)
+
+    def _top(
+        self,
+        ids: np.ndarray,
+        scores: np.ndarray,
+        top_n: int | None
+    ) -> List[Tuple[str, int]]:
+        if top_n is not None and len(ids) > top_n:
+            top = np.argpartition(-scores, top_n - 1)[:top_n]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return [
+            (self.suppliers[i], int(score))
+            for i, score in zip(ids[order].tolist(), scores[order].tolist())
+        ]
+
+    def _flush(self) -> None:
+        for term, pending in self._pending.items():
+            ids = np.fromiter(
+                pending.keys(), dtype=np.int64, count=len(pending)
+            )
+            counts = np.fromiter(
+                pending.values(), dtype=np.int64, count=len(pending)
+            )
+            if term in self.postings:
+                ids, counts = _union([self.postings[term], (ids, counts)])
+            if self.max_postings is not None and len(ids) > self.max_postings:
+                top = np.argpartition(-counts, self.max_postings - 1)
+                top = top[:self.max_postings]
+                ids, counts = ids[top], counts[top]
+            order = np.argsort(ids)
+            self.postings[term] = (ids[order], counts[order])
+        self._pending = {}
+
+
+_EMPTY_POSTING = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+
+def _union(
+    postings: List[Tuple[np.ndarray, np.ndarray]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not postings:
+        return _EMPTY_POSTING
+    ids, inverse = np.unique(
+        np.concatenate([ids for ids, _ in postings]), return_inverse=True
+    )
+    counts = np.bincount(
+        inverse,
+        weights=np.concatenate([counts for _, counts in postings]),
+        minlength=len(ids)
+    )
+    return ids, counts.astype(np.int64)
+
+
+def _intersect(
+    postings: List[Tuple[np.ndarray, np.ndarray]]
+) -> Tuple[np.ndarray, np.ndarray]:
+    if not postings:
+        return _EMPTY_POSTING
+    # Начинаем с самого короткого списка.
+    postings = sorted(postings, key=lambda posting: len(posting[0]))
+    ids = postings[0][0]
+    for other, _ in postings[1:]:
+        ids = np.intersect1d(ids, other, assume_unique=True)
+    scores = sum(_lookup(posting, ids) for posting in postings)
+    return ids, scores
+
+
+def _lookup(
+    posting: Tuple[np.ndarray, np.ndarray],
+    ids: np.ndarray
+) -> np.ndarray:
+    """Счетчики ids в списке терма (0, если поставщика в нем нет)."""
+    posting_ids, counts = posting
+    if not len(posting_ids):
+        return np.zeros(len(ids), dtype=np.int64)
+    pos = np.minimum(np.searchsorted(posting_ids, ids), len(posting_ids) - 1)
+    return np.where(posting_ids[pos] == ids, counts[pos], 0)
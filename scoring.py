@@ -0,0 +1,219 @@
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+from .matrix import MatrixBuilder, Vocab
+from .supplier_info import SupplierInfo, fold_okpd
+
+sys.path.append(str(Path(__file__).parent.parent))
+from utils import get_price_cat, prepare_okpd2_code
+from db.db import okr, okc, okrw, okcw, pr
+
+
+class Query(NamedTuple):
+    """Входящая закупка, для которой подбираются поставщики."""
+    okpd2_codes: Sequence[str]
+    region_code: str
+    customer_inn_kpp: str
+    price: float
+
+
+class Candidate(NamedTuple):
+    inn_kpp: str
+    score: float
+    contributions: Dict[str, float]
+
+
+FEATURE_NAMES = ('okpd_region', 'okpd_customer', 'price_cat', 'msp')
+DEFAULT_WEIGHTS = dict.fromkeys(FEATURE_NAMES, 1.)
+
+
+def query_keys(
+    query: Query,
+    len_okpd_region: int = 12,
+    len_okpd_customer: int = 5
+) -> Dict[str, List]:
+    """Ключи представлений SupplierInfo, по которым оценивается закупка."""
+    codes = [prepare_okpd2_code(str(code)) for code in query.okpd2_codes]
+    region_code = str(query.region_code)
+    customer_inn_kpp = str(query.customer_inn_kpp)
+    return {
+        'okpd_region': [
+            fold_okpd(okr, okrw(code, region_code, True), len_okpd_region)
+            for code in codes
+        ],
+        'okpd_customer': [
+            fold_okpd(okc, okcw(code, customer_inn_kpp, True), len_okpd_customer)
+            for code in codes
+        ],
+        'price_cat': [pr(get_price_cat(query.price))],
+    }
+
+
+def score_supplier(
+    model: SupplierInfo,
+    query: Query,
+    weights: Mapping[str, float] = DEFAULT_WEIGHTS,
+    len_okpd_region: int = 12,
+    len_okpd_customer: int = 5
+) -> Candidate:
+    """
+    Оценка одного поставщика по словарям SupplierInfo. Признаки по ОКПД2
+    усредняются по кодам закупки. ScoringEngine считает то же самое
+    сразу для многих поставщиков и закупок.
+    """
+    views = {
+        'okpd_region': model.get_okpd_region2count(len_okpd_region),
+        'okpd_customer': model.get_okpd_customer2count(len_okpd_customer),
+        'price_cat': model.price_cat2count,
+    }
+    contributions = {}
+    for name, keys in query_keys(
+        query, len_okpd_region, len_okpd_customer
+    ).items():
+        norm = sum(views[name].get_norm(key, 0.) for key in keys)
+        contributions[name] = weights[name] * norm / max(len(keys), 1)
+    contributions['msp'] = weights['msp'] * float(bool(model.msp))
+    return Candidate(model.inn_kpp, sum(contributions.values()), contributions)
+
+
+class ScoringEngine:
+    """
+    Пакетная оценка поставщиков. Нормы нужных представлений всех
+    поставщиков один раз раскладываются в массивы по столбцам (ключ
+    представления -> строки поставщиков и их нормы), после чего пачка
+    закупок оценивается для всех кандидатов несколькими операциями NumPy.
+    """
+    def __init__(
+        self,
+        models: Iterable[SupplierInfo],
+        weights: Mapping[str, float] | None = None,
+        len_okpd_region: int = 12,
+        len_okpd_customer: int = 5
+    ) -> None:
+        self.weights = dict(DEFAULT_WEIGHTS if weights is None else weights)
+        self.len_okpd_region = len_okpd_region
+        self.len_okpd_customer = len_okpd_customer
+
+        msp = []
+        builder = MatrixBuilder({
+            'okpd_region': (
+                lambda m: m.get_okpd_region2count(len_okpd_region),
+                lambda key: key
+            ),
+            'okpd_customer': (
+                lambda m: m.get_okpd_customer2count(len_okpd_customer),
+                lambda key: key
+            ),
+            'price_cat': (lambda m: m.price_cat2count, lambda key: key),
+        })
+        for model in models:
+            if model.inn_kpp not in builder.rows:
+                msp.append(bool(model.msp))
+            builder.add(model)
+        matrices = builder.build()
+
+        self.rows: Vocab = builder.rows
+        self.msp = np.array(msp, dtype=np.float64)
+        # Признак -> (словарь столбцов, границы столбцов, строки, нормы).
+        self._columns: Dict[str, Tuple[Vocab, np.ndarray, np.ndarray, np.ndarray]] = {}
+        for name, matrix in matrices.items():
+            norms = matrix.norms
+            rows = np.repeat(
+                np.arange(norms.shape[0], dtype=np.int64), np.diff(norms.indptr)
+            )
+            order = np.argsort(norms.indices, kind='stable')
+            colptr = np.zeros(norms.shape[1] + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(norms.indices, minlength=norms.shape[1]),
+                out=colptr[1:]
+            )
+            self._columns[name] = (
+                matrix.columns, colptr, rows[order], norms.data[order]
+            )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def score(
+        self,
+        queries: Sequence[Query],
+        candidates: Iterable[str] | None = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Оценки всех кандидатов (по умолчанию - всех поставщиков) для пачки
+        закупок. Возвращает (индексы кандидатов в rows, оценки формы
+        (закупки, кандидаты), вклады формы (признаки, закупки, кандидаты)).
+        Неизвестные кандидаты пропускаются, повторы учитываются один раз.
+        """
+        if candidates is None:
+            cand = np.arange(len(self.rows), dtype=np.int64)
+        else:
+            cand = np.array(
+                list(dict.fromkeys(
+                    i for i in map(self.rows.get, candidates) if i >= 0
+                )),
+                dtype=np.int64
+            )
+        pos = np.full(len(self.rows), -1, dtype=np.int64)
+        pos[cand] = np.arange(len(cand))
+        n_cells = len(queries) * len(cand)
+
+        contributions = np.zeros(
+            (len(FEATURE_NAMES), len(queries), len(cand)), dtype=np.float64
+        )
+        keys = [
+            query_keys(query, self.len_okpd_region, self.len_okpd_customer)
+            for query in queries
+        ]
+        for f, name in enumerate(FEATURE_NAMES[:-1]):
+            columns, colptr, rows, norms = self._columns[name]
+            cells, values = [], []
+            # Цикл Python только по ключам закупок, поставщики - массивами.
+            for q, qkeys in enumerate(keys):
+                weight = self.weights[name] / max(len(qkeys[name]), 1)
+                for key in qkeys[name]:
+                    j = columns.get(key)
+                    if j < 0:
+                        continue
+                    col_rows = pos[rows[colptr[j]:colptr[j + 1]]]
+                    mask = col_rows >= 0
+                    cells.append(q * len(cand) + col_rows[mask])
+                    values.append(norms[colptr[j]:colptr[j + 1]][mask] * weight)
+            if cells:
+                contributions[f] = np.bincount(
+                    np.concatenate(cells),
+                    weights=np.concatenate(values),
+                    minlength=n_cells
+                ).reshape(len(queries), len(cand))
+        contributions[-1] = self.weights['msp'] * self.msp[cand]
+        return cand, contributions.sum(axis=0), contributions
+
+    def top_k(
+        self,
+        queries: Sequence[Query],
+        k: int = 10,
+        candidates: Iterable[str] | None = None
+    ) -> List[List[Candidate]]:
+        """k лучших кандидатов для каждой закупки с вкладами признаков."""
+        cand, scores, contributions = self.score(queries, candidates)
+        k = min(k, len(cand))
+        res = []
+        for q in range(len(queries)):
+            if k == 0:
+                res.append([])
+                continue
+            top = np.argpartition(-scores[q], k - 1)[:k]
+            top = top[np.lexsort((cand[top], -scores[q][top]))]
+            res.append([
+                Candidate(
+                    self.rows[cand[i]],
+                    float(scores[q, i]),
+                    dict(zip(FEATURE_NAMES, contributions[:, q, i].tolist()))
+                )
+                for i in top
+            ])
+        return res
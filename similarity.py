@@ -0,0 +1,148 @@
+import sys
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Tuple
+from zlib import crc32
+
+import numpy as np
+
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from db.db import CounterBackend, okw, okrw, okcw
+
+# Простое число меньше 2**32: a * x + b (a < 2**31, x, b < 2**32)
+# помещается в uint64 без переполнения.
+PRIME = np.uint64(4_294_967_291)
+
+
+def profile_tokens(model: SupplierInfo) -> Set[str]:
+    """Множество признаков профиля: коды ОКПД2, регионы и заказчики."""
+    tokens = {f'ok:{key.okpd2_code}' for key in model.info.part(okw)}
+    tokens.update(f'r:{key.region_code}' for key in model.info.part(okrw))
+    tokens.update(f'c:{key.customer_inn_kpp}' for key in model.info.part(okcw))
+    return tokens
+
+
+class MinHashLSH:
+    """
+    Поиск похожих поставщиков: MinHash-сигнатуры множеств признаков
+    профилей (см. profile_tokens) и LSH по полосам сигнатуры. Поставщики,
+    совпавшие с запросом хотя бы в одной полосе, ранжируются по оценке
+    коэффициента Жаккара. Профиль можно добавить или обновить в любой
+    момент, индекс не перестраивается.
+    """
+    def __init__(
+        self,
+        num_perm: int = 64,
+        bands: int = 16,
+        seed: int = 1
+    ) -> None:
+        if num_perm % bands != 0:
+            raise ValueError('num_perm должно делиться на bands.')
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rnd = np.random.default_rng(seed)
+        self._a = rnd.integers(1, 2 ** 31, num_perm, dtype=np.uint64)
+        self._b = rnd.integers(0, 2 ** 32, num_perm, dtype=np.uint64)
+        self.signatures: Dict[str, np.ndarray] = {}
+        self._buckets: Dict[Tuple[int, bytes], Set[str]] = {}
+
+    @classmethod
+    def from_db(
+        cls,
+        db: CounterBackend,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000,
+        **kwargs
+    ) -> 'MinHashLSH':
+        """Индекс по key2num за один проход (см. SupplierInfo.iter_from_db)."""
+        return cls(**kwargs).update(
+            SupplierInfo.iter_from_db(db, inn_kpps, fetch_size)
+        )
+
+    def signature(self, tokens: Iterable[str]) -> np.ndarray:
+        hashes = np.fromiter(
+            (crc32(token.encode()) for token in tokens), dtype=np.uint64
+        )
+        if not len(hashes):
+            raise ValueError('Сигнатура пустого множества не определена.')
+        return ((
+            np.outer(self._a, hashes) + self._b[:, None]
+        ) % PRIME).min(axis=1)
+
+    def add(self, model: SupplierInfo) -> None:
+        """
+        Добавить профиль или заменить прежнюю сигнатуру поставщика.
+        Профили без признаков в индекс не попадают.
+        """
+        self.remove(model.inn_kpp)
+        tokens = profile_tokens(model)
+        if not tokens:
+            return
+        signature = self.signature(tokens)
+        self.signatures[model.inn_kpp] = signature
+        for band in self._bands(signature):
+            self._buckets.setdefault(band, set()).add(model.inn_kpp)
+
+    def update(self, models: Iterable[SupplierInfo]) -> 'MinHashLSH':
+        for model in models:
+            self.add(model)
+        return self
+
+    def remove(self, inn_kpp: str) -> bool:
+        signature = self.signatures.pop(inn_kpp, None)
+        if signature is None:
+            return False
+        for band in self._bands(signature):
+            bucket = self._buckets[band]
+            bucket.discard(inn_kpp)
+            if not bucket:
+                del self._buckets[band]
+        return True
+
+    def query(
+        self,
+        inn_kpp_or_model: str | SupplierInfo,
+        k: int = 10
+    ) -> List[Tuple[str, float]]:
+        """
+        k похожих поставщиков с оценкой коэффициента Жаккара. Принимает
+        inn_kpp уже добавленного поставщика или профиль SupplierInfo.
+        """
+        if isinstance(inn_kpp_or_model, SupplierInfo):
+            inn_kpp = inn_kpp_or_model.inn_kpp
+            tokens = profile_tokens(inn_kpp_or_model)
+            if not tokens:
+                return []
+            signature = self.signature(tokens)
+        else:
+            inn_kpp = inn_kpp_or_model
+            signature = self.signatures.get(inn_kpp)
+            if signature is None:
+                raise KeyError(f'Поставщик `{inn_kpp}` не найден в индексе.')
+
+        candidates = set()
+        for band in self._bands(signature):
+            candidates |= self._buckets.get(band, set())
+        candidates.discard(inn_kpp)
+        if not candidates:
+            return []
+        candidates = sorted(candidates)
+        sims = (
+            np.stack([self.signatures[c] for c in candidates]) == signature
+        ).mean(axis=1)
+        order = np.lexsort((np.arange(len(candidates)), -sims))[:k]
+        return [(candidates[i], float(sims[i])) for i in order]
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def __contains__(self, inn_kpp: str) -> bool:
+        return inn_kpp in self.signatures
+
+    def _bands(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, signature[start:start + self.rows].tobytes()
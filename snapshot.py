@@ -0,0 +1,251 @@
+import mmap
+import os
+import struct
+import sys
+
+from argparse import ArgumentParser
+from array import array
+from bisect import bisect_left
+from hashlib import blake2b
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    # Импорт из пакета (db.snapshot) - тот же RecSysDataBase, что у db.db.
+    from .db import RecSysDataBase
+except ImportError:
+    sys.path.append(str(Path(__file__).parent))
+    from db import RecSysDataBase
+
+
+MAGIC = b'RSSNAP01'
+# Секции файла в порядке записи. Ключи пишутся потоком первыми, остальное
+# накапливается в памяти (компактными массивами) и дописывается в конце.
+SECTIONS = (
+    ('key_blob', 'B'),
+    ('nums', 'q'),
+    ('key_offsets', 'Q'),
+    ('key_hashes', 'Q'),
+    ('key_order', 'I'),
+    ('supplier_blob', 'B'),
+    ('supplier_offsets', 'Q'),
+    ('supplier_starts', 'Q'),
+    ('supplier_hashes', 'Q'),
+    ('supplier_order', 'I'),
+)
+# magic, кол-во ключей, кол-во поставщиков, (смещение, длина) каждой секции.
+HEADER = struct.Struct('<8sQQ' + 'QQ' * len(SECTIONS))
+
+
+def str_hash(value: str) -> int:
+    """Стабильный между процессами 64-битный хеш строки."""
+    return int.from_bytes(
+        blake2b(value.encode(), digest_size=8).digest(), 'little'
+    )
+
+
+def _sorted_index(hashes: array) -> Tuple[array, array]:
+    order = sorted(range(len(hashes)), key=hashes.__getitem__)
+    return array('Q', (hashes[i] for i in order)), array('I', order)
+
+
+def write_snapshot(
+    path: str | Path,
+    suppliers: Iterable[Tuple[str, Iterable[Tuple[str, int]]]]
+) -> Tuple[int, int]:
+    """
+    Записать снимок из пар (inn_kpp, [(key, num), ...]). Файл сначала
+    пишется во временный и затем атомарно подменяет path.
+    Возвращает (кол-во ключей, кол-во поставщиков).
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + '.tmp')
+    nums, key_hashes = array('q'), array('Q')
+    key_offsets = array('Q', [0])
+    supplier_blob = bytearray()
+    supplier_offsets, supplier_starts = array('Q', [0]), array('Q', [0])
+    supplier_hashes = array('Q')
+
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * HEADER.size)
+        for inn_kpp, rows in suppliers:
+            inn_kpp = inn_kpp or ''
+            for key, num in sorted(rows):
+                data = key.encode()
+                f.write(data)
+                key_offsets.append(key_offsets[-1] + len(data))
+                key_hashes.append(str_hash(key))
+                nums.append(num)
+            supplier_blob += inn_kpp.encode()
+            supplier_offsets.append(len(supplier_blob))
+            supplier_starts.append(len(nums))
+            supplier_hashes.append(str_hash(inn_kpp))
+
+        key_hashes, key_order = _sorted_index(key_hashes)
+        supplier_hashes, supplier_order = _sorted_index(supplier_hashes)
+        sections = {
+            'nums': nums,
+            'key_offsets': key_offsets,
+            'key_hashes': key_hashes,
+            'key_order': key_order,
+            'supplier_blob': array('B', supplier_blob),
+            'supplier_offsets': supplier_offsets,
+            'supplier_starts': supplier_starts,
+            'supplier_hashes': supplier_hashes,
+            'supplier_order': supplier_order,
+        }
+        layout = [HEADER.size, key_offsets[-1]]
+        pos = HEADER.size + key_offsets[-1]
+        for name, _ in SECTIONS[1:]:
+            # Массивы выравниваются по 8 байт.
+            f.write(b'\0' * (-pos % 8))
+            pos += -pos % 8
+            data = sections[name]
+            data.tofile(f)
+            layout += [pos, len(data) * data.itemsize]
+            pos += len(data) * data.itemsize
+
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, len(nums), len(supplier_hashes), *layout))
+    os.replace(tmp_path, path)
+    return len(nums), len(supplier_hashes)
+
+
+def export_snapshot(
+    db: RecSysDataBase,
+    path: str | Path,
+    fetch_size: int = 10_000
+) -> Tuple[int, int]:
+    """Выгрузить всю таблицу db.dict_name в снимок одним проходом."""
+    return write_snapshot(path, db.iter_innkpp(fetch_size=fetch_size))
+
+
+class SnapshotDataBase:
+    """
+    Чтение снимка key2num, отображенного в память (mmap), с тем же API
+    чтения, что у RecSysDataBase. Данные не копируются в процесс, поэтому
+    несколько процессов делят одну копию через page cache, а открытие
+    снимка почти мгновенно.
+    """
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._mm) < HEADER.size or self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f'Файл `{path}` не является снимком key2num.')
+        _, self.n_keys, self.n_suppliers, *layout = \
+            HEADER.unpack_from(self._mm)
+
+        buf = memoryview(self._mm)
+        self._views = [buf]
+        for i, (name, typecode) in enumerate(SECTIONS):
+            start, size = layout[2 * i], layout[2 * i + 1]
+            view = buf[start:start + size].cast(typecode)
+            self._views.append(view)
+            setattr(self, f'_{name}', view)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mm.close()
+
+    def get(self, key: str) -> int:
+        i = self._find(
+            key, self._key_hashes, self._key_order,
+            self._key_blob, self._key_offsets
+        )
+        return 0 if i is None else self._nums[i]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        return {key: self.get(key) for key in keys}
+
+    def get_innkpp(self, inn_kpp: str) -> List[Tuple[str, int]]:
+        i = self._find(
+            inn_kpp, self._supplier_hashes, self._supplier_order,
+            self._supplier_blob, self._supplier_offsets
+        )
+        if i is None:
+            return []
+        return self._rows(self._supplier_starts[i], self._supplier_starts[i + 1])
+
+    def iter_innkpp(
+        self,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000
+    ) -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """
+        Аналог RecSysDataBase.iter_innkpp. Поставщики идут в порядке
+        снимка; fetch_size не используется - строки читаются из файла.
+        """
+        starts = self._supplier_starts
+        if inn_kpps is None:
+            indices = range(self.n_suppliers)
+        else:
+            indices = sorted({
+                i for inn_kpp in inn_kpps
+                if (i := self._find(
+                    inn_kpp, self._supplier_hashes, self._supplier_order,
+                    self._supplier_blob, self._supplier_offsets
+                )) is not None
+            })
+        for i in indices:
+            inn_kpp = _decode(self._supplier_blob, self._supplier_offsets, i)
+            yield inn_kpp, self._rows(starts[i], starts[i + 1])
+
+    def _find(
+        self,
+        value: str,
+        hashes: memoryview,
+        order: memoryview,
+        blob: memoryview,
+        offsets: memoryview
+    ) -> int | None:
+        # Совпадение хеша проверяется сравнением строк (коллизии).
+        h = str_hash(value)
+        i = bisect_left(hashes, h)
+        while i < len(hashes) and hashes[i] == h:
+            if _decode(blob, offsets, order[i]) == value:
+                return order[i]
+            i += 1
+        return None
+
+    def _rows(self, start: int, end: int) -> List[Tuple[str, int]]:
+        return [
+            (_decode(self._key_blob, self._key_offsets, i), self._nums[i])
+            for i in range(start, end)
+        ]
+
+
+def _decode(blob: memoryview, offsets: memoryview, i: int) -> str:
+    return str(blob[offsets[i]:offsets[i + 1]], 'utf-8')
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Выгрузка key2num в снимок.')
+    parser.add_argument('path')
+    parser.add_argument('--database', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='12345')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--fetch-size', type=int, default=10_000)
+    args = parser.parse_args()
+
+    db = RecSysDataBase(
+        database=args.database,
+        user=args.user,
+        password=args.password,
+        host=args.host,
+        port=args.port
+    )
+    n_keys, n_suppliers = export_snapshot(db, args.path, args.fetch_size)
+    print(f'Ключей: {n_keys}, поставщиков: {n_suppliers}')
+    db.close()
@@ -0,0 +1,162 @@
+import json
+import sqlite3
+import sys
+
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Mapping, Sequence, Tuple
+
+try:
+    # Импорт из пакета (db.sqlite_db) - те же классы, что у db.db.
+    from .db import CounterBackend, merge_rows
+except ImportError:
+    sys.path.append(str(Path(__file__).parent))
+    from db import CounterBackend, merge_rows
+
+
+class SQLiteDataBase(CounterBackend):
+    """
+    Встроенное в процесс хранилище счетчиков на SQLite с тем же API, что у
+    RecSysDataBase. Не требует сервера: path=':memory:' держит данные в
+    памяти процесса (тесты, бенчмарки), путь к файлу - на диске.
+    """
+    def __init__(self, path: str | Path = ':memory:') -> None:
+        self.path = str(path)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute('pragma journal_mode = wal;')
+        self.connection.execute('pragma synchronous = normal;')
+        self._lock = Lock()
+        self.dict_name = 'key2num'
+        self.create_dict()
+
+    def select(self, sql: str, params: Sequence = ()) -> List[Tuple]:
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+    def create_dict(self) -> bool:
+        sql = """
+        select count(*)
+            from sqlite_master
+            where type = 'table'
+                and name = ?;
+        """
+        if self.select(sql, (self.dict_name,))[0][0] != 0:
+            return False
+
+        with self._lock, self.connection:
+            self.connection.executescript(f"""
+            create table {self.dict_name}
+            (
+                key varchar(100) primary key,
+                inn_kpp varchar(22),
+                num int not null
+            ) without rowid;
+            create index index_{self.dict_name}_inn_kpp
+                on {self.dict_name}(inn_kpp);
+            """)
+        return True
+
+    def clear_dict(self) -> bool:
+        sql = """
+        select count(*)
+            from sqlite_master
+            where type = 'table'
+                and name = ?;
+        """
+        if self.select(sql, (self.dict_name,))[0][0] == 0:
+            return False
+
+        with self._lock, self.connection:
+            self.connection.execute(f'delete from {self.dict_name};')
+        return True
+
+    def incr(self, key: str, inn_kpp: str, num: int = 1) -> None:
+        self.incrby([(key, inn_kpp, num)])
+
+    def incrby(
+        self,
+        rows: Mapping[str, Tuple[str, int]] | Sequence[Tuple[str, str, int]]
+    ) -> None:
+        sql = f"""
+        insert into {self.dict_name} values
+        (?, ?, ?)
+        on conflict (key)
+        do update set
+            num = {self.dict_name}.num + excluded.num;
+        """
+        rows = merge_rows(rows)
+        with self._lock, self.connection:
+            self.connection.executemany(sql, rows)
+
+    def get(self, key: str) -> int:
+        sql = f"""
+        select num
+            from {self.dict_name}
+            where key = ?;
+        """
+        res = self.select(sql, (key,))
+        try:
+            return res[0][0]
+        except IndexError:
+            return 0
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, int]:
+        keys = list(keys)
+        res = dict.fromkeys(keys, 0)
+        if not keys:
+            return res
+
+        # Ключи передаются одним json-параметром, что обходит ограничение
+        # SQLite на кол-во параметров запроса.
+        sql = f"""
+        select key, num
+            from {self.dict_name}
+            where key in (select value from json_each(?));
+        """
+        res.update(self.select(sql, (json.dumps(keys),)))
+        return res
+
+    def get_innkpp(self, inn_kpp: str) -> List[Tuple[str, int]]:
+        sql = f"""
+        select key, num
+            from {self.dict_name}
+            where inn_kpp = ?;
+        """
+        return self.select(sql, (inn_kpp,))
+
+    def iter_innkpp(
+        self,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000
+    ) -> Iterator[Tuple[str, List[Tuple[str, int]]]]:
+        """Аналог RecSysDataBase.iter_innkpp."""
+        sql = f"""
+        select inn_kpp, key, num
+            from {self.dict_name}
+            {'' if inn_kpps is None else
+             'where inn_kpp in (select value from json_each(?))'}
+            order by inn_kpp;
+        """
+        params = () if inn_kpps is None else (json.dumps(list(inn_kpps)),)
+        with self._lock:
+            cur = self.connection.execute(sql, params)
+        cur.arraysize = fetch_size
+
+        def rows():
+            # Блокировка берется на каждую порцию, а не на весь проход,
+            # чтобы во время чтения можно было писать в ту же базу.
+            while True:
+                with self._lock:
+                    batch = cur.fetchmany()
+                if not batch:
+                    return
+                yield from batch
+
+        for inn_kpp, group in groupby(rows(), key=itemgetter(0)):
+            yield inn_kpp, [(key, num) for _, key, num in group]
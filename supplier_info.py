@@ -2,35 +2,293 @@ import re
 import json
 import sys
 
-from collections import Counter
-from typing import Iterable, Tuple, List
-from functools import cached_property, cache
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from itertools import groupby, repeat
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Tuple, List
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).parent.parent))
 from utils import NormDict, prepare_okpd2_code
-from db.db import KeyInfoBuilder, rc, fz, pr, ok, okw, okr, okrw, okc, okcw
+from db.db import CounterBackend, KeyInfoBuilder, KeyPool, rc, fz, pr, ok, okw, okr, okrw, okc, okcw
+
+
+class InfoPart(Mapping):
+    """Ключи одного типа из InfoCounter со счетчиками (только чтение)."""
+    __slots__ = ('_counts', '_type', '_keys')
+
+    def __init__(self, counts: Counter, type_: type, keys: List) -> None:
+        self._counts = counts
+        self._type = type_
+        self._keys = keys
+
+    def __getitem__(self, key: NamedTuple) -> int:
+        if type(key) is not self._type:
+            raise KeyError(key)
+        return dict.__getitem__(self._counts, key)
+
+    def __iter__(self) -> Iterator[NamedTuple]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+
+class InfoCounter(Counter):
+    """
+    Counter ключей профиля (rc, fz, pr, okw, ...) с индексом ключей по
+    типам: представления SupplierInfo читают только ключи своего типа
+    через part(). Индекс строится одним проходом при первом вызове part()
+    и дальше дополняется при добавлении ключей, поэтому профили, которые
+    только загружаются и хранятся, занимают столько же, сколько Counter.
+    Удаление ключей сбрасывает индекс.
+    """
+    __slots__ = ('_index',)
+
+    def __init__(
+        self,
+        counts: Mapping[NamedTuple, int] | Iterable[NamedTuple] | None = None,
+        /,
+        **kwargs: int
+    ) -> None:
+        self._index: Dict[type, List[NamedTuple]] | None = None
+        super().__init__(counts, **kwargs)
+
+    def part(self, type_: type) -> Mapping[NamedTuple, int]:
+        if self._index is None:
+            index = {}
+            for key in dict.__iter__(self):
+                keys = index.get(type(key))
+                if keys is None:
+                    index[type(key)] = [key]
+                else:
+                    keys.append(key)
+            self._index = index
+        keys = self._index.get(type_)
+        return _EMPTY if keys is None else InfoPart(self, type_, keys)
+
+    def update(
+        self,
+        counts: Mapping[NamedTuple, int] | Iterable[NamedTuple] | None = None,
+        /,
+        **kwargs: int
+    ) -> None:
+        index = self._index
+        if index is None:
+            super().update(counts, **kwargs)
+            return
+        if kwargs:
+            self.update(kwargs)
+        if counts is None:
+            return
+        if isinstance(counts, Mapping):
+            counts = counts.items()
+        else:
+            counts = zip(counts, repeat(1))
+        for key, num in counts:
+            old = dict.get(self, key)
+            if old is None:
+                index.setdefault(type(key), []).append(key)
+                dict.__setitem__(self, key, num)
+            else:
+                dict.__setitem__(self, key, old + num)
+
+    def __setitem__(self, key: NamedTuple, num: int) -> None:
+        if self._index is not None and not dict.__contains__(self, key):
+            self._index.setdefault(type(key), []).append(key)
+        dict.__setitem__(self, key, num)
+
+    def __delitem__(self, key: NamedTuple) -> None:
+        dict.__delitem__(self, key)
+        self._index = None
+
+    def pop(self, *args: Any) -> int:
+        self._index = None
+        return dict.pop(self, *args)
+
+    def popitem(self) -> Tuple[NamedTuple, int]:
+        self._index = None
+        return dict.popitem(self)
+
+    def setdefault(self, key: NamedTuple, num: int = 0) -> int:
+        if not dict.__contains__(self, key):
+            self[key] = num
+        return dict.__getitem__(self, key)
+
+    def clear(self) -> None:
+        self._index = None
+        dict.clear(self)
+
+
+_EMPTY: Mapping = {}
+# Тип свертки по ОКПД2 -> тип исходных ключей.
+FOLDS = {ok: okw, okr: okrw, okc: okcw}
+
+
+def fold_okpd(fold_type: type, key: NamedTuple, len_okpd: int) -> NamedTuple:
+    """Свертка ключа okw/okrw/okcw до len_okpd знаков кода ОКПД2."""
+    return fold_type(
+        prepare_okpd2_code(key.okpd2_code[:len_okpd]), *key[1:-1]
+    )
+
+
+class OkpdHierarchy:
+    """
+    Счетчики ключей профиля на уровнях иерархии ОКПД2. Хранятся только
+    листья (исходные ключи), разложенные по доп. полям ключа (регион,
+    заказчик). Уровень len_okpd сворачивается из листьев (см. fold_okpd)
+    при первом rollup на нем и дальше поддерживается в add, поэтому
+    повторные rollup работают за время, пропорциональное размеру ответа,
+    а память тратится только на запрошенные уровни.
+    """
+    def __init__(self, fold_type: type = ok) -> None:
+        self.fold_type = fold_type
+        # leaves[доп. поля] -> Counter исходных ключей.
+        self.leaves: Dict[tuple, Counter] = {}
+        # levels[len_okpd][доп. поля] -> Counter сверток.
+        self.levels: Dict[int, Dict[tuple, Counter]] = {}
+
+    @classmethod
+    def from_keys(
+        cls,
+        fold_type: type,
+        counts: Iterable[Tuple[NamedTuple, int]]
+    ) -> 'OkpdHierarchy':
+        model = cls(fold_type)
+        for key, count in counts:
+            model.add(key, count)
+        return model
+
+    def add(self, key: NamedTuple, count: int = 1) -> None:
+        extra = key[1:-1]
+        part = self.leaves.get(extra)
+        if part is None:
+            part = self.leaves[extra] = Counter()
+        part[key] += count
+        for len_okpd, level in self.levels.items():
+            part = level.get(extra)
+            if part is None:
+                part = level[extra] = Counter()
+            part[fold_okpd(self.fold_type, key, len_okpd)] += count
+
+    def level(self, len_okpd: int) -> Dict[tuple, Counter]:
+        # Коды не длиннее 12 знаков, более глубокие уровни совпадают.
+        len_okpd = max(0, min(len_okpd, 12))
+        level = self.levels.get(len_okpd)
+        if level is None:
+            level = self.levels[len_okpd] = {}
+            for extra, leaves in self.leaves.items():
+                part = level[extra] = Counter()
+                for key, count in leaves.items():
+                    part[fold_okpd(self.fold_type, key, len_okpd)] += count
+        return level
+
+    def rollup(
+        self,
+        len_okpd: int,
+        extra: Tuple[str, ...] | None = None,
+        norm_dict: type = NormDict
+    ) -> NormDict:
+        """
+        Свертка на уровне len_okpd. extra - значения доп. полей
+        (например, (region_code,)), чтобы получить свертку только по ним.
+        """
+        level = self.level(len_okpd)
+        if extra is not None:
+            return norm_dict.from_counter(level.get(tuple(extra), _EMPTY))
+        counts = {}
+        for part in level.values():
+            counts.update(part)
+        return norm_dict.from_counter(counts)
+
+
+class _ViewCache:
+    """
+    Построенные представления профиля (см. SupplierInfo._view): по типам
+    ключей, свертки по ОКПД2, иерархии ОКПД2 и ключи с устаревшими нормами.
+    """
+    __slots__ = ('views', 'folds', 'stale', 'hierarchies')
+
+    def __init__(self) -> None:
+        self.views: Dict[type, NormDict] = {}
+        self.folds: OrderedDict = OrderedDict()
+        self.stale = set()
+        self.hierarchies: Dict[Tuple[type, bool], OkpdHierarchy] = {}
 
 
 class SupplierInfo:
+    # Пул ключей по умолчанию (см. KeyPool); None - без пула. Пул держит все
+    # ключи, пока жив сам, поэтому общий для процесса пул включается явно,
+    # а обычно пул передается загрузчику (key_pool в from_rows,
+    # iter_from_db) и живет, пока живы загруженные с ним профили.
+    KEY_POOL: KeyPool | None = None
     KEYINFO_BUILDER = KeyInfoBuilder()
+    # Сколько сверток get_okpd*count хранится в одном профиле.
+    FOLDS_CACHE_SIZE = 16
+    # Класс представлений: NormDict или компактный ArrayNormDict.
+    NORM_DICT = NormDict
     DEP_PATH = Path(__file__).parent.parent/'dependencies' 
     with open(DEP_PATH/'msp_inn_reestr.json', 'r') as f:
         msp_inn_reestr = set(json.load(f))
 
-    def __init__(self, inn_kpp: str | None = None) -> None:
+    def __init__(
+        self,
+        inn_kpp: str | None = None,
+        key_pool: KeyPool | None = None
+    ) -> None:
         self.inn_kpp = inn_kpp
+        self.key_pool = self.KEY_POOL if key_pool is None else key_pool
         self.msp = None if inn_kpp is None else self._check_msp()
-        self.info = Counter()
+        self.info = InfoCounter()
+        # Представления info (см. _view) создаются при первом чтении: у
+        # профилей, которые только загружают и сохраняют, их нет вовсе.
+        self._cache: _ViewCache | None = None
 
     @classmethod
-    def from_rows(cls, inn_kpp: str, rows: Iterable[Tuple[str, int]]):
-        model = cls(inn_kpp)
-        for key, num in rows:
-            key_info = cls.KEYINFO_BUILDER.from_str(key)
-            model.info[key_info] = num
+    def from_rows(
+        cls,
+        inn_kpp: str,
+        rows: Iterable[Tuple[str, int]],
+        key_pool: KeyPool | None = None
+    ):
+        model = cls(inn_kpp, key_pool)
+        rows = list(rows)
+        key_infos = cls.KEYINFO_BUILDER.parse_many(key for key, _ in rows)
+        model.info.update(dict(zip(
+            model._intern_keys(key_infos), (num for _, num in rows)
+        )))
         return model
 
+    @classmethod
+    def from_info(
+        cls,
+        inn_kpp: str,
+        info: Iterable[Tuple[NamedTuple, int]],
+        key_pool: KeyPool | None = None
+    ):
+        """Аналог from_rows для уже разобранных ключей (см. TypedKey2Num)."""
+        model = cls(inn_kpp, key_pool)
+        info = dict(info)
+        model.info.update(dict(zip(model._intern_keys(info), info.values())))
+        return model
+
+    @classmethod
+    def iter_from_db(
+        cls,
+        db: CounterBackend,
+        inn_kpps: Iterable[str] | None = None,
+        fetch_size: int = 10_000,
+        key_pool: KeyPool | None = None
+    ) -> Iterator['SupplierInfo']:
+        """
+        Поставщики из БД по одному, за один последовательный проход по
+        таблице (см. RecSysDataBase.iter_innkpp). Подходит любое хранилище
+        с методом iter_innkpp. С key_pool одинаковые ключи всех профилей
+        прохода хранятся один раз.
+        """
+        for inn_kpp, rows in db.iter_innkpp(inn_kpps, fetch_size):
+            yield cls.from_rows(inn_kpp, rows, key_pool)
+
     def as_rows(self) -> List[Tuple[str, str, int]]:
         rows = []
         for key, num in self.region2count.items():
@@ -55,15 +313,15 @@ class SupplierInfo:
         
     def update_region2count(self, region_codes: Iterable[str]) -> None:
         rc_codes = (rc(str(region_code)) for region_code in region_codes)
-        self.info.update(rc_codes)
+        self._add(rc_codes)
     
     def update_fz2count(self, fz_codes: Iterable[str]) -> None:
         fz_codes = (fz(str(fz_code)) for fz_code in fz_codes)
-        self.info.update(fz_codes)
+        self._add(fz_codes)
 
     def update_price_cat2count(self, price_cats: Iterable[int]) -> None:
         pr_codes = (pr(int(price_cat)) for price_cat in price_cats)
-        self.info.update(pr_codes)
+        self._add(pr_codes)
 
     def update_okpd_iswin2count(
         self, 
@@ -74,7 +332,7 @@ class SupplierInfo:
             okw(str(prepare_okpd2_code(okpd2_code)), bool(is_win)) 
             for okpd2_code in okpd2_codes
         )
-        self.info.update(okw_codes)
+        self._add(okw_codes)
 
     def update_okpd_region_iswin2count(
         self, 
@@ -90,7 +348,7 @@ class SupplierInfo:
             )
             for okpd2_code in okpd2_codes
         )
-        self.info.update(okrw_codes)
+        self._add(okrw_codes)
 
     def update_okpd_customer_iswin2count(
         self, 
@@ -106,106 +364,149 @@ class SupplierInfo:
             )
             for okpd2_code in okpd2_codes
         )
-        self.info.update(okcw_codes)
+        self._add(okcw_codes)
 
-    @cached_property
+    @property
     def region2count(self) -> NormDict:
-        return NormDict.from_counter({
-            rc_: count for rc_, count in self.info.items() 
-            if isinstance(rc_, rc)
-        })
+        return self._view(rc)
 
-    @cached_property
+    @property
     def fz2count(self) -> NormDict:
-        return NormDict.from_counter({
-            fz_: count for fz_, count in self.info.items() 
-            if isinstance(fz_, fz)
-        })
+        return self._view(fz)
 
-    @cached_property
+    @property
     def price_cat2count(self) -> NormDict:
-        return NormDict.from_counter({
-            pr_: count for pr_, count in self.info.items() 
-            if isinstance(pr_, pr)
-        })
+        return self._view(pr)
 
-    @cached_property
+    @property
     def max_price_cat(self) -> int:
         return max(
-            pr_.price_cat for pr_ in self.info.keys()
-            if isinstance(pr_, pr)
+            pr_.price_cat for pr_ in self.info.part(pr)
         )
 
-    @cached_property
+    @property
     def okpd_iswin2count(self) -> NormDict:
-        return NormDict.from_counter({
-            okw_: count for okw_, count in self.info.items() 
-            if isinstance(okw_, okw)
-        })
+        return self._view(okw)
 
-    @cached_property
+    @property
     def okpd_region_iswin2count(self) -> NormDict:
-        return NormDict.from_counter({
-            okrw_: count for okrw_, count in self.info.items() 
-            if isinstance(okrw_, okrw)
-        })
+        return self._view(okrw)
 
-    @cached_property
+    @property
     def okpd_customer_iswin2count(self) -> NormDict:
-        return NormDict.from_counter({
-            okcw_: count for okcw_, count in self.info.items() 
-            if isinstance(okcw_, okcw)
-        })
+        return self._view(okcw)
 
-    @cache
     def get_okpd2count(
         self, 
         len_okpd: int = 12, 
         only_win: bool = False
     ) -> NormDict:
-        ok_codes = {
-            ok(prepare_okpd2_code(okw_.okpd2_code[:len_okpd])): count
-            for okw_, count in self.info.items() 
-            if isinstance(okw_, okw)
-            and ((only_win and ok.iswin) or (not only_win))
-        }
-        return NormDict.from_counter(ok_codes)
-
-    # @wrap_lru_cache
-    @cache
+        return self._view((ok, len_okpd, bool(only_win), None))
+
     def get_okpd_region2count(
         self, 
         len_okpd: int = 12,
-        only_win: bool = False
+        only_win: bool = False,
+        region_code: str | None = None
     ) -> NormDict:
-        okr_codes = {
-            okr(
-                prepare_okpd2_code(okrw_.okpd2_code[:len_okpd]), 
-                okrw_.region_code
-            ): count
-            for okrw_, count in self.info.items() 
-            if isinstance(okrw_, okrw)
-            and ((only_win and okrw_.iswin) or (not only_win))
-        }
-        return NormDict.from_counter(okr_codes)
-
-    # @wrap_lru_cache
-    @cache
+        extra = None if region_code is None else (str(region_code),)
+        return self._view((okr, len_okpd, bool(only_win), extra))
+
     def get_okpd_customer2count(
         self, 
         len_okpd: int = 5,
-        only_win: bool = False
+        only_win: bool = False,
+        customer_inn_kpp: str | None = None
     ) -> NormDict:
-        okc_codes = {
-            okc(
-                prepare_okpd2_code(okcw_.okpd2_code[:len_okpd]), 
-                okcw_.customer_inn_kpp
-            ): count
-            for okcw_, count in self.info.items()
-            if isinstance(okcw_, okcw)
-            and ((only_win and okcw_.iswin) or (not only_win))
-        }
-        return NormDict.from_counter(okc_codes)
+        extra = None if customer_inn_kpp is None else (str(customer_inn_kpp),)
+        return self._view((okc, len_okpd, bool(only_win), extra))
+
+    def okpd_hierarchy(
+        self,
+        fold_type: type = ok,
+        only_win: bool = False
+    ) -> OkpdHierarchy:
+        """Иерархия ОКПД2 профиля (ok, okr или okc), строится один раз."""
+        hierarchies = self._view_cache().hierarchies
+        hierarchy = hierarchies.get((fold_type, bool(only_win)))
+        if hierarchy is None:
+            hierarchy = hierarchies[fold_type, bool(only_win)] = \
+                OkpdHierarchy.from_keys(fold_type, (
+                    (key, count)
+                    for key, count in self.info.part(FOLDS[fold_type]).items()
+                    if key.iswin or not only_win
+                ))
+        return hierarchy
+
+    def _view(self, view_key: Any) -> NormDict:
+        """
+        Представление info по ключу: тип ключа (rc, okw, ...) или
+        (ok/okr/okc, len_okpd, only_win, доп. поля) для сверток по ОКПД2.
+        Построенные представления хранятся в экземпляре и дополняются в
+        _add, а нормы пересчитываются при первом чтении после изменений.
+        """
+        cache = self._view_cache()
+        views = cache.views if isinstance(view_key, type) else cache.folds
+        view = views.get(view_key)
+        if view is None:
+            view = views[view_key] = self._build_view(view_key)
+            if views is cache.folds and len(views) > self.FOLDS_CACHE_SIZE:
+                oldest = next(iter(views))
+                del views[oldest]
+                cache.stale.discard(oldest)
+        elif view_key in cache.stale:
+            view._calc_norm()
+            cache.stale.discard(view_key)
+        if views is cache.folds:
+            views.move_to_end(view_key)
+        return view
+
+    def _view_cache(self) -> _ViewCache:
+        if self._cache is None:
+            self._cache = _ViewCache()
+        return self._cache
+
+    def _build_view(self, view_key: Any) -> NormDict:
+        if isinstance(view_key, type):
+            return self.NORM_DICT.from_counter(self.info.part(view_key))
+        fold_type, len_okpd, only_win, extra = view_key
+        return self.okpd_hierarchy(fold_type, only_win).rollup(
+            len_okpd, extra, self.NORM_DICT
+        )
+
+    def _add(self, keys: Iterable[NamedTuple]) -> None:
+        """Добавить ключи в info и в уже построенные представления."""
+        keys = list(self._intern_keys(keys))
+        self.info.update(keys)
+        cache = self._cache
+        if not keys or cache is None or not (cache.views or cache.hierarchies):
+            return
+        for type_, group in groupby(keys, type):
+            group = list(group)
+            view = cache.views.get(type_)
+            if view is not None:
+                view.update(group)
+                cache.stale.add(type_)
+            for (fold_type, only_win), hierarchy in cache.hierarchies.items():
+                if FOLDS[fold_type] is type_:
+                    for key in group:
+                        if key.iswin or not only_win:
+                            hierarchy.add(key)
+            for view_key, view in cache.folds.items():
+                fold_type, len_okpd, only_win, extra = view_key
+                if FOLDS[fold_type] is not type_:
+                    continue
+                view.update(
+                    fold_okpd(fold_type, key, len_okpd) for key in group
+                    if (key.iswin or not only_win)
+                    and (extra is None or key[1:-1] == extra)
+                )
+                cache.stale.add(view_key)
+
+    def _intern_keys(self, keys: Iterable[NamedTuple]) -> Iterable[NamedTuple]:
+        if self.key_pool is None:
+            return keys
+        return map(self.key_pool.intern, keys)
 
     def _check_msp(self) -> bool:
         if self.inn_kpp.split('_')[0] in self.msp_inn_reestr:
@@ -223,3 +524,44 @@ class SupplierInfo:
             f'\tokpd_region2count: {self.get_okpd_region2count()},\n' +
             f'\tokpd_customer2count: {self.get_okpd_customer2count()})'
         )
+
+
+def info_sizeof(models: Iterable[SupplierInfo]) -> int:
+    """
+    Память (в байтах), занимаемая info профилей: словари, ключи и значения
+    внутри ключей, а также пулы ключей профилей целиком (пул держит и
+    ключи, которых уже нет ни в одном профиле). Общие для нескольких
+    профилей объекты (пул и ключи из него, интернированные строки)
+    учитываются один раз, поэтому сравнение с профилями без пула
+    показывает экономию от него.
+    """
+    seen = set()
+    size = 0
+
+    def add(obj) -> None:
+        nonlocal size
+        if id(obj) not in seen:
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+
+    def add_key(key_info) -> None:
+        if id(key_info) not in seen:
+            add(key_info)
+            for value in key_info:
+                add(value)
+
+    for model in models:
+        add(model.info)
+        if model.info._index is not None:
+            add(model.info._index)
+            for keys in model.info._index.values():
+                add(keys)
+        for key_info, num in model.info.items():
+            add(num)
+            add_key(key_info)
+        pool = model.key_pool
+        if pool is not None and id(pool._keys) not in seen:
+            add(pool._keys)
+            for key_info in pool._keys:
+                add_key(key_info)
+    return size
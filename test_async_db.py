@@ -0,0 +1,172 @@
+import asyncio
+import random
+import sys
+
+from pathlib import Path
+
+import psycopg
+
+sys.path.append(str(Path(__file__).parent))
+from db import RecSysDataBase
+from async_db import AsyncRecSysDataBase
+
+db = RecSysDataBase()
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+class TestAsyncRecSysDataBase:
+    def setup_method(self):
+        db.create_dict()
+        db.execute(f"""
+        delete from public.{db.dict_name}
+            where inn_kpp like 'test_async_%';
+        """)
+
+    def teardown_method(self):
+        self.setup_method()
+
+    def test_incr_get(self):
+        async def scenario():
+            async with AsyncRecSysDataBase() as adb:
+                assert await adb.get('test_async_id') == 0
+                await adb.incr('test_async_id', 'test_async_innkpp')
+                await adb.incr('test_async_id', 'test_async_innkpp', 10)
+                return await adb.get('test_async_id')
+        assert run(scenario()) == 11
+
+    def test_incrby(self):
+        async def scenario():
+            async with AsyncRecSysDataBase() as adb:
+                await adb.incrby({'test_async_id': ('test_async_innkpp', 1)})
+                await adb.incrby([
+                    ('test_async_id', 'test_async_innkpp', 2),
+                    ('test_async_id2', 'test_async_innkpp', 5),
+                ])
+                return (
+                    await adb.get('test_async_id'),
+                    await adb.get('test_async_id2')
+                )
+        assert run(scenario()) == (3, 5)
+
+    def test_incrby_merge(self):
+        async def scenario():
+            async with AsyncRecSysDataBase() as adb:
+                # Повторный ключ в одной пачке суммируется, а не роняет upsert.
+                await adb.incrby(
+                    (key, 'test_async_innkpp', num) for key, num in
+                    [('test_async_id', 1), ('test_async_id', 2)]
+                )
+                await adb.incrby([])
+                return await adb.get('test_async_id')
+        assert run(scenario()) == 3
+
+    def test_incrby_concurrent(self):
+        keys = [f'test_async_id{i}' for i in range(50)]
+
+        async def scenario():
+            async with AsyncRecSysDataBase(pool_size=(1, 8)) as adb:
+                batches = []
+                for seed in range(8):
+                    rows = [(key, 'test_async_innkpp', 1) for key in keys]
+                    random.Random(seed).shuffle(rows)
+                    batches.append(rows)
+                # Пересекающиеся пачки в разном порядке не взаимоблокируются.
+                await asyncio.gather(*(adb.incrby(rows) for rows in batches))
+                return await adb.get_many(keys)
+        assert run(scenario()) == dict.fromkeys(keys, 8)
+
+    def test_incrby_retry(self, monkeypatch):
+        calls = []
+        executemany = psycopg.AsyncCursor.executemany
+
+        async def flaky(cur, *args, **kwargs):
+            calls.append(1)
+            if len(calls) < 3:
+                raise psycopg.errors.DeadlockDetected()
+            return await executemany(cur, *args, **kwargs)
+
+        monkeypatch.setattr(psycopg.AsyncCursor, 'executemany', flaky)
+        monkeypatch.setattr(AsyncRecSysDataBase, 'RETRY_DELAY', 0)
+
+        async def scenario():
+            async with AsyncRecSysDataBase() as adb:
+                await adb.incr('test_async_id', 'test_async_innkpp', 2)
+                return await adb.get('test_async_id')
+        assert run(scenario()) == 2
+        assert len(calls) == 3
+
+    def test_incrby_partitioned(self):
+        table = f'{db.dict_name}_async_part_test'
+        db.execute(f"""
+        drop table if exists public.{table};
+        create table {table}
+        (
+            key text not null,
+            inn_kpp text not null,
+            num int not null,
+            primary key (key, inn_kpp)
+        ) partition by hash (inn_kpp);
+        create table {table}_p0
+            partition of {table}
+            for values with (modulus 1, remainder 0);
+        """)
+
+        async def scenario():
+            adb = AsyncRecSysDataBase()
+            adb.dict_name = table
+            async with adb:
+                assert adb.conflict_target == '(key, inn_kpp)'
+                await adb.incrby([
+                    ('test_async_id', 'test_async_innkpp', 1),
+                    ('test_async_id2', 'test_async_innkpp2', 2),
+                ])
+                await adb.incr('test_async_id', 'test_async_innkpp', 3)
+                return (
+                    await adb.get_innkpp('test_async_innkpp'),
+                    await adb.get_innkpp('test_async_innkpp2')
+                )
+        try:
+            assert run(scenario()) == (
+                [('test_async_id', 4)], [('test_async_id2', 2)]
+            )
+        finally:
+            db.execute(f'drop table if exists public.{table};')
+
+    def test_get_many(self):
+        db.incr('test_async_id', 'test_async_innkpp', 4)
+
+        async def scenario():
+            async with AsyncRecSysDataBase() as adb:
+                return (
+                    await adb.get_many(['test_async_id', 'test_async_none']),
+                    await adb.get_many([])
+                )
+        assert run(scenario()) == (
+            {'test_async_id': 4, 'test_async_none': 0}, {}
+        )
+
+    def test_get_innkpp(self):
+        db.incr('test_async_id', 'test_async_innkpp')
+        db.incr('test_async_id2', 'test_async_innkpp2', 2)
+
+        async def scenario():
+            async with AsyncRecSysDataBase(pool_size=(1, 2)) as adb:
+                single = await adb.get_innkpp('test_async_innkpp')
+                many = await adb.get_innkpp_many(
+                    ['test_async_innkpp', 'test_async_innkpp2', 'test_async_none']
+                )
+                gathered = await asyncio.gather(*(
+                    adb.get_innkpp('test_async_innkpp2') for _ in range(5)
+                ))
+                return single, many, gathered
+        single, many, gathered = run(scenario())
+        assert single == [('test_async_id', 1)]
+        assert many == {
+            'test_async_innkpp': [('test_async_id', 1)],
+            'test_async_innkpp2': [('test_async_id2', 2)],
+            'test_async_none': [],
+        }
+        assert gathered == [[('test_async_id2', 2)]] * 5
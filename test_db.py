@@ -1,14 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
 from itertools import product
+from time import sleep
+from unittest.mock import MagicMock
 
 import sys
 
 from pathlib import Path
 
+import psycopg2
+import psycopg2.errors
 import pytest
 
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
 sys.path.append(str(Path(__file__).parent))
 from db import (
-    RecSysDataBase, KeyInfoBuilder, rc, fz, pr, ok, okw, okr, okrw, okc, okcw
+    RecSysDataBase, IncrBuffer, KeyInfoBuilder, KeyPool, LRUCache, _MISSING,
+    merge_rows, retry_on_conflict,
+    rc, fz, pr, ok, okw, okr, okrw, okc, okcw
 )
 
 db = RecSysDataBase()
@@ -60,6 +69,42 @@ class TestRecSysDataBase:
         """
         db.execute(sql)
 
+    def test_create_dict_partitioned(self):
+        sql = f"""
+        alter table if exists public.{db.dict_name}
+            rename to {db.dict_name}_temp;
+        alter index if exists index_{db.dict_name}_inn_kpp
+            rename to index_{db.dict_name}_inn_kpp_temp;
+        """
+        db.execute(sql)
+
+        part_db = RecSysDataBase(partitions=4)
+        assert part_db.partitioned
+        assert part_db.conflict_target == '(key, inn_kpp)'
+        assert part_db.partition_names() == [
+            f'{db.dict_name}_p{i}' for i in range(4)
+        ]
+        assert RecSysDataBase().partitioned
+
+        part_db.incr('test_id', 'innkpp')
+        part_db.incrby([('test_id', 'innkpp', 2), ('test_id2', 'innkpp2', 1)])
+        part_db.incrby_bulk([('test_id', 'innkpp', 3), ('test_id3', 'innkpp3', 1)])
+        assert part_db.get_many(['test_id', 'test_id2', 'test_id3']) \
+            == {'test_id': 6, 'test_id2': 1, 'test_id3': 1}
+        assert part_db.get_innkpp('innkpp') == [('test_id', 6)]
+        assert part_db.vacuum_partitions() == part_db.partition_names()
+        part_db.close()
+
+        sql = f"""
+        drop table public.{db.dict_name};
+        alter table if exists public.{db.dict_name}_temp
+            rename to {db.dict_name};
+        alter index if exists index_{db.dict_name}_inn_kpp_temp
+            rename to index_{db.dict_name}_inn_kpp;
+        """
+        db.execute(sql)
+        assert not RecSysDataBase().partitioned
+
     def test_clear_dict(self):
         sql = f"""
         alter table if exists public.{db.dict_name}
@@ -130,6 +175,88 @@ class TestRecSysDataBase:
         db.incrby([('test_id', 'innkpp', 2), ('test_id2', 'innkpp', 2)])
         assert db.get('test_id') == 6
         assert db.get('test_id2') == 7
+        db.incrby([('test_id2', 'innkpp', 1), ('test_id', 'innkpp', 1),
+                   ('test_id2', 'innkpp', 1)])
+        assert db.get('test_id') == 7
+        assert db.get('test_id2') == 9
+        db.incrby([])
+
+        db.execute(sql)
+
+    def test_merge_rows(self):
+        assert merge_rows([]) == []
+        assert merge_rows({'b': ('i1', 1), 'a': ('i2', 2)}) \
+            == [('a', 'i2', 2), ('b', 'i1', 1)]
+        assert merge_rows([('b', 'i1', 1), ('a', 'i2', 2), ('b', 'i1', 3)]) \
+            == [('a', 'i2', 2), ('b', 'i1', 4)]
+        assert merge_rows(row for row in [('a', 'i', 1), ('a', 'i', 1)]) \
+            == [('a', 'i', 2)]
+        with pytest.raises(ValueError):
+            merge_rows({('a', 'i', 1)})
+
+    def test_retry_on_conflict(self):
+        calls = []
+
+        def action():
+            calls.append(1)
+            if len(calls) < 3:
+                raise psycopg2.errors.DeadlockDetected()
+            return len(calls)
+
+        with db.transaction():
+            with db.checkout() as cur:
+                assert retry_on_conflict(cur, action, delay=0) == 3
+                calls.clear()
+                with pytest.raises(psycopg2.errors.DeadlockDetected):
+                    retry_on_conflict(cur, action, max_retries=1, delay=0)
+                cur.execute('select 1;')
+                assert cur.fetchall() == [(1,)]
+
+    def test_incrby_concurrent(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key like 'test_conc_%';
+        """
+        db.execute(sql)
+
+        pool_db = RecSysDataBase(pool_size=(1, 4))
+        keys = [f'test_conc_{i:03}' for i in range(200)]
+        batches = [
+            [(key, 'innkpp', 1) for key in (keys if i % 2 else keys[::-1])] * 2
+            for i in range(8)
+        ]
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(pool_db.incrby, batches[:4]))
+            list(executor.map(pool_db.incrby_bulk, batches[4:]))
+        assert pool_db.get_many(keys) == dict.fromkeys(keys, 16)
+        pool_db.execute(sql)
+        pool_db.close()
+
+    def test_incrby_bulk(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key = 'test_id'
+                or key = 'test_id2';
+        """
+        db.execute(sql)
+
+        db.incrby_bulk({'test_id': ('innkpp', 1)})
+        assert db.get('test_id') == 1
+        assert db.get('test_id2') == 0
+        db.incrby_bulk([('test_id', 'innkpp', 2), ('test_id2', 'innkpp', 5)])
+        assert db.get('test_id') == 3
+        assert db.get('test_id2') == 5
+        db.incrby_bulk(
+            (('test_id', 'innkpp', 1) for _ in range(5)), chunk_size=2
+        )
+        assert db.get('test_id') == 8
+        assert db.get('test_id2') == 5
+        db.incrby_bulk([])
+        assert db.get('test_id') == 8
 
         db.execute(sql)
 
@@ -147,6 +274,24 @@ class TestRecSysDataBase:
         assert db.get('test_id') == 1
         db.execute(sql)
 
+    def test_get_many(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key = 'test_id'
+                or key = 'test_id2';
+        """
+        db.execute(sql)
+
+        assert db.get_many([]) == {}
+        assert db.get_many(['test_id', 'test_id2']) == {'test_id': 0, 'test_id2': 0}
+        db.incrby([('test_id', 'test_inn_kpp', 2), ('test_id2', 'test_inn_kpp', 3)])
+        assert db.get_many(['test_id', 'test_id2', 'test_id3']) \
+            == {'test_id': 2, 'test_id2': 3, 'test_id3': 0}
+        assert db.get_many(iter(['test_id'])) == {'test_id': 2}
+        db.execute(sql)
+
     def test_get_innkpp(self):
         db.create_dict()
         
@@ -161,11 +306,298 @@ class TestRecSysDataBase:
         assert db.get_innkpp('test_innkpp') == [('test_id', 1)]
         db.execute(sql)
 
+    def test_pool(self):
+        pool_db = RecSysDataBase(pool_size=(1, 4))
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key like 'test_pool_%';
+        """
+        pool_db.execute(sql)
+
+        keys = [f'test_pool_{i}' for i in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(
+                lambda key: pool_db.incr(key, 'test_innkpp', 3), keys * 2
+            ))
+            nums = list(executor.map(pool_db.get, keys))
+        assert nums == [6] * len(keys)
+        assert pool_db.connection is None
+
+        with pytest.raises(psycopg2.InterfaceError):
+            with pool_db.checkout() as cur:
+                cur.connection.close()
+        assert pool_db.get(keys[0]) == 6
+
+        pool_db.execute(sql)
+        pool_db.close()
+        assert pool_db.pool.closed
+        pool_db.new_connect()
+        assert pool_db.get(keys[0]) == 0
+        pool_db.close()
+
+    def test_pool_dead_connection(self, monkeypatch):
+        pool_db = RecSysDataBase(pool_size=(1, 2))
+        # Соединение, оборванное сервером: клиент о разрыве еще не знает.
+        dead = MagicMock(closed=0)
+        dead.get_transaction_status.return_value = TRANSACTION_STATUS_IDLE
+        dead.cursor.return_value.__enter__.return_value.execute.side_effect = \
+            psycopg2.OperationalError('server closed the connection')
+        getconn, putconn = pool_db.pool.getconn, pool_db.pool.putconn
+        conns = iter([dead])
+        discarded = []
+        monkeypatch.setattr(
+            pool_db.pool, 'getconn', lambda: next(conns, None) or getconn()
+        )
+        monkeypatch.setattr(
+            pool_db.pool, 'putconn',
+            lambda conn, close=False: discarded.append(conn) if conn is dead
+            else putconn(conn, close=close)
+        )
+        assert pool_db.get('test_pool_none') == 0
+        assert discarded == [dead]
+        monkeypatch.undo()
+
+        # То же с настоящим соединением, закрытым на стороне сервера.
+        with pool_db.checkout() as cur:
+            cur.execute('select pg_backend_pid();')
+            pid = cur.fetchone()[0]
+        db.execute(f'select pg_terminate_backend({pid});')
+        assert pool_db.get('test_pool_none') == 0
+        pool_db.close()
+
+    def test_iter_innkpp(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where inn_kpp like 'test_iter_%';
+        """
+        db.execute(sql)
+
+        db.incrby([
+            ('test_id1', 'test_iter_b', 1),
+            ('test_id2', 'test_iter_a', 2),
+            ('test_id3', 'test_iter_b', 3),
+            ('test_id4', 'test_iter_c', 4),
+        ])
+        res = list(db.iter_innkpp(['test_iter_b', 'test_iter_a'], fetch_size=1))
+        assert [inn_kpp for inn_kpp, _ in res] == ['test_iter_a', 'test_iter_b']
+        assert res[0][1] == [('test_id2', 2)]
+        assert sorted(res[1][1]) == [('test_id1', 1), ('test_id3', 3)]
+        assert list(db.iter_innkpp([])) == []
+
+        inn_kpps = [inn_kpp for inn_kpp, _ in db.iter_innkpp()]
+        assert inn_kpps == sorted(inn_kpps)
+        assert {'test_iter_a', 'test_iter_b', 'test_iter_c'} <= set(inn_kpps)
+        db.execute(sql)
+
+    @pytest.mark.parametrize('pool_size', [None, (1, 2)])
+    def test_iter_innkpp_with_writes(self, pool_size):
+        stream_db = RecSysDataBase(pool_size=pool_size)
+        sql = f"""
+        delete from public.{stream_db.dict_name}
+            where inn_kpp like 'test_iter_%';
+        """
+        stream_db.execute(sql)
+
+        stream_db.incrby([
+            (f'test_iter_id{i}', f'test_iter_{i}', 1) for i in range(5)
+        ])
+        seen = []
+        buf = IncrBuffer(stream_db, max_keys=1)
+        for inn_kpp, rows in stream_db.iter_innkpp(
+            [f'test_iter_{i}' for i in range(5)], fetch_size=1
+        ):
+            seen.append(inn_kpp)
+            # Запись производных счетчиков во время чтения.
+            stream_db.incr(f'test_iter_der_{inn_kpp}', 'test_iter_der', len(rows))
+            stream_db.incrby_bulk([(f'test_iter_bulk_{inn_kpp}', 'test_iter_der', 1)])
+            buf.incr(f'test_iter_buf_{inn_kpp}', 'test_iter_der')
+        buf.close()
+        assert seen == [f'test_iter_{i}' for i in range(5)]
+        assert stream_db.get('test_iter_der_test_iter_4') == 1
+        assert stream_db.get('test_iter_buf_test_iter_4') == 1
+        assert len(stream_db.get_innkpp('test_iter_der')) == 15
+
+        stream_db.execute(sql)
+        stream_db.close()
+
+    def test_transaction(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key = 'test_id'
+                or key = 'test_id2';
+        """
+        db.execute(sql)
+
+        with db.transaction():
+            db.incr('test_id', 'innkpp')
+            db.incrby_bulk([('test_id', 'innkpp', 2)])
+            db.incrby_bulk([('test_id2', 'innkpp', 1)])
+            assert db.get_many(['test_id', 'test_id2']) \
+                == {'test_id': 3, 'test_id2': 1}
+        assert db.get('test_id') == 3
+
+        with pytest.raises(ZeroDivisionError):
+            with db.transaction():
+                db.incr('test_id', 'innkpp', 10)
+                1 / 0
+        assert db.get('test_id') == 3
+        db.execute(sql)
+
+    def test_incr_buffer(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key = 'test_id'
+                or key = 'test_id2';
+        """
+        db.execute(sql)
+
+        buffer = IncrBuffer(db, max_keys=2, flush_interval=None)
+        for _ in range(5):
+            buffer.incr('test_id', 'innkpp')
+        assert len(buffer) == 1
+        assert db.get('test_id') == 0
+        buffer.incrby({'test_id2': ('innkpp', 3)})
+        assert len(buffer) == 0
+        assert db.get_many(['test_id', 'test_id2']) \
+            == {'test_id': 5, 'test_id2': 3}
+
+        with IncrBuffer(db, flush_interval=None) as buffer:
+            buffer.incr('test_id', 'innkpp', 2)
+            assert buffer.flush() == 1
+            assert buffer.flush() == 0
+            buffer.incrby([('test_id', 'innkpp', 1), ('test_id', 'innkpp', 1)])
+        assert db.get('test_id') == 9
+
+        buffer = IncrBuffer(db, flush_interval=0)
+        buffer.incr('test_id', 'innkpp')
+        assert db.get('test_id') == 10
+        db.execute(sql)
+
+    def test_cache(self):
+        db.create_dict()
+        
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key like 'test_cache_%';
+        """
+        db.execute(sql)
+
+        cache_db = RecSysDataBase(cache_size=100)
+        assert cache_db.get('test_cache_1') == 0
+        assert cache_db.get_innkpp('test_cache_innkpp') == []
+        db.incr('test_cache_1', 'test_cache_innkpp', 5)
+        # Запись из другого объекта не видна до истечения ttl.
+        assert cache_db.get('test_cache_1') == 0
+        assert cache_db.get_innkpp('test_cache_innkpp') == []
+        assert cache_db.cache.stats()['hits'] == 2
+
+        cache_db.incr('test_cache_1', 'test_cache_innkpp')
+        assert cache_db.get('test_cache_1') == 6
+        assert cache_db.get_innkpp('test_cache_innkpp') == [('test_cache_1', 6)]
+
+        cache_db.incrby([('test_cache_2', 'test_cache_innkpp', 2)])
+        assert cache_db.get_many(['test_cache_1', 'test_cache_2']) \
+            == {'test_cache_1': 6, 'test_cache_2': 2}
+        assert cache_db.get_many(['test_cache_1', 'test_cache_2']) \
+            == {'test_cache_1': 6, 'test_cache_2': 2}
+
+        with cache_db.transaction():
+            cache_db.incrby_bulk([('test_cache_2', 'test_cache_innkpp', 1)])
+        assert cache_db.get('test_cache_2') == 3
+        assert sorted(cache_db.get_innkpp('test_cache_innkpp')) \
+            == [('test_cache_1', 6), ('test_cache_2', 3)]
+
+        cache_db.execute(sql)
+        cache_db.close()
+
+    def test_cache_read_write_race(self):
+        sql = f"""
+        delete from public.{db.dict_name}
+            where key like 'test_cache_%';
+        """
+        db.execute(sql)
+
+        cache_db = RecSysDataBase(pool_size=(1, 2), cache_size=100)
+        select = cache_db.select
+
+        def racing_select(*args, **kwargs):
+            # Запись другого потока фиксируется и сбрасывает кеш между
+            # чтением из БД и записью прочитанного значения в кеш.
+            res = select(*args, **kwargs)
+            cache_db.incrby([
+                ('test_cache_1', 'test_cache_innkpp', 1),
+                ('test_cache_2', 'test_cache_innkpp', 1),
+            ])
+            return res
+
+        cache_db.select = racing_select
+        assert cache_db.get('test_cache_1') == 0
+        assert cache_db.get_many(['test_cache_2']) == {'test_cache_2': 1}
+        assert sorted(cache_db.get_innkpp('test_cache_innkpp')) \
+            == [('test_cache_1', 2), ('test_cache_2', 2)]
+        cache_db.select = select
+        # Устаревшие значения не остались в кеше.
+        assert cache_db.get('test_cache_1') == 3
+        assert cache_db.get_many(['test_cache_2']) == {'test_cache_2': 3}
+        assert sorted(cache_db.get_innkpp('test_cache_innkpp')) \
+            == [('test_cache_1', 3), ('test_cache_2', 3)]
+
+        cache_db.execute(sql)
+        cache_db.close()
+
     def test_gen_key(self):
         assert db.gen_key(1, True, False, 's') == '1:True:False:s'
         assert db.gen_key() == ''
         assert db.gen_key('11111_11111', '11.11.11.111', '09', 6) == '11111_11111:11.11.11.111:09:6'
 
+class TestLRUCache:
+    def test_get_set(self):
+        cache = LRUCache(maxsize=2)
+        assert cache.get('a') is _MISSING
+        assert cache.get('a', 0) == 0
+        cache.set('a', 1)
+        cache.set('b', 2)
+        assert cache.get('a') == 1
+        cache.set('c', 3)
+        assert cache.get('b', None) is None
+        assert cache.get('c') == 3
+        assert len(cache) == 2
+        assert cache.stats() \
+            == {'size': 2, 'hits': 2, 'misses': 3, 'evictions': 1}
+        cache.pop('a')
+        assert cache.get('a', None) is None
+        cache.clear()
+        assert len(cache) == 0
+
+    def test_token(self):
+        cache = LRUCache()
+        token = cache.token('a')
+        cache.pop('a')
+        cache.set('a', 1, token)
+        assert cache.get('a') is _MISSING
+        token = cache.token('a')
+        cache.set('a', 2, token)
+        assert cache.get('a') == 2
+        token = cache.token('b')
+        cache.clear()
+        cache.set('b', 1, token)
+        assert cache.get('b') is _MISSING
+
+    def test_ttl(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+        sleep(0.02)
+        assert cache.get('a', None) is None
+        assert len(cache) == 0
+
 class TestKeyInfoBuilder:
     @pytest.mark.parametrize(
         ('key', 'class_or_except'),
@@ -353,6 +785,47 @@ class TestKeyInfoBuilder:
         else:
             assert keyinfo_builder.parse_iswin(iswin) == res_or_except
 
+    def test_parse_many(self):
+        keys = [
+            'rc:7810098244_781001001:23',
+            'okw:7810098244_781001001:26.70.22.150:True',
+            'pr:7512000253_751201001:1',
+            'okw:7810098244_781001001:26.70.22:0',
+        ]
+        assert keyinfo_builder.parse_many(keys) \
+            == [keyinfo_builder.from_str(key) for key in keys]
+        assert keyinfo_builder.parse_many(iter(keys), columnar=True) == {
+            rc: {'index': [0], 'region_code': ['23']},
+            okw: {
+                'index': [1, 3],
+                'okpd2_code': ['26.70.22.150', '26.70.22'],
+                'iswin': [True, False],
+            },
+            pr: {'index': [2], 'price_cat': [1]},
+        }
+        assert keyinfo_builder.parse_many([]) == []
+        assert keyinfo_builder.parse_many([], columnar=True) == {}
+        with pytest.raises(ValueError):
+            keyinfo_builder.parse_many(keys + ['rc:7810098244_781001001:23:1'])
+        with pytest.raises(ValueError):
+            keyinfo_builder.parse_many(['ok:7810098244_781001001:26.70'])
+
+    def test_key_pool(self):
+        pool = KeyPool()
+        builder = KeyInfoBuilder(pool)
+        key = 'okrw:7115500500_711501001:20.14.75:48:True'
+        first = builder.from_str(key)
+        assert first == keyinfo_builder.from_str(key)
+        assert builder.from_str(key) is first
+        assert builder.okrw_from_str(key) is first
+        assert builder.parse_many([key, key]) == [first, first]
+        assert all(k is first for k in builder.parse_many([key, key]))
+        assert pool.intern(okrw('20.14.75', '48', True)) is first
+        assert len(pool) == 1
+        pool.clear()
+        assert len(pool) == 0
+        assert builder.from_str(key) is not first
+
     def test_gen_key(self):
         assert keyinfo_builder.gen_key(1, True, False, 's') == '1:True:False:s'
         assert keyinfo_builder.gen_key() == ''
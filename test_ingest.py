@@ -0,0 +1,58 @@
+import sys
+
+from operator import itemgetter
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from db import RecSysDataBase
+from ingest import route, run_sharded, parallel_incrby
+
+db = RecSysDataBase()
+
+
+def test_route():
+    assert route('7810098244_781001001', 4) == route('7810098244_781001001', 4)
+    assert {route(f'{i}_test', 3) for i in range(100)} == {0, 1, 2}
+
+
+def test_parallel_incrby():
+    sql = f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_ingest_%';
+    """
+    db.execute(sql)
+
+    rows = [
+        (f'test_ingest_id{i % 50}', f'test_ingest_{i % 50 // 5}', 1)
+        for i in range(1000)
+    ]
+    assert parallel_incrby(rows, workers=3, batch_size=64, chunk_size=16) == 1000
+    keys = [f'test_ingest_id{i}' for i in range(50)]
+    assert db.get_many(keys) == dict.fromkeys(keys, 20)
+
+    assert parallel_incrby(
+        {'test_ingest_id0': ('test_ingest_0', 5)}, workers=2
+    ) == 1
+    assert db.get('test_ingest_id0') == 25
+    assert parallel_incrby([], workers=2) == 0
+    db.execute(sql)
+
+
+def _double(batch):
+    return [(key, inn_kpp, num * 2) for key, inn_kpp, num in batch]
+
+
+def test_run_sharded_transform():
+    sql = f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_ingest_%';
+    """
+    db.execute(sql)
+
+    rows = [(f'test_ingest_id{i % 10}', f'test_ingest_{i % 10}', 1) for i in range(100)]
+    stats = run_sharded(rows, itemgetter(1), _double, workers=2, batch_size=16)
+    assert sum(items for items, _ in stats) == 100
+    assert sum(written for _, written in stats) == 100
+    keys = [f'test_ingest_id{i}' for i in range(10)]
+    assert db.get_many(keys) == dict.fromkeys(keys, 20)
+    db.execute(sql)
@@ -0,0 +1,96 @@
+import sys
+
+from pathlib import Path
+
+import numpy as np
+
+from .matrix import Vocab, MatrixBuilder, build_matrices, build_matrices_from_db
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from db.db import RecSysDataBase
+
+db = RecSysDataBase()
+
+
+def make_models():
+    s1 = SupplierInfo('test_matrix_1')
+    s1.update_okpd_iswin2count(['21.20.10.182', '21.20.10.182', '10.00.0'], True)
+    s1.update_region2count(['77', '50', '77'])
+    s1.update_okpd_customer_iswin2count(['21.20.10.182'], 'cust_1', True)
+    s2 = SupplierInfo('test_matrix_2')
+    s2.update_okpd_iswin2count(['10.00.0'], False)
+    s2.update_region2count(['50'])
+    s3 = SupplierInfo('test_matrix_3')
+    return [s1, s2, s3]
+
+
+def test_vocab():
+    vocab = Vocab(['a', 'b', 'a'])
+    assert len(vocab) == 2
+    assert vocab.add('c') == 2 and vocab.add('a') == 0
+    assert vocab[1] == 'b' and vocab.get('z') == -1
+    assert 'c' in vocab and 'z' not in vocab
+
+
+def test_build_matrices():
+    res = build_matrices(make_models())
+    okpd2 = res['okpd2']
+    assert okpd2.rows.labels == ['test_matrix_1', 'test_matrix_2', 'test_matrix_3']
+    assert okpd2.columns.labels == ['21.20.10.182', '10']
+    assert okpd2.counts.toarray().tolist() == [[2, 1], [0, 1], [0, 0]]
+    assert np.allclose(okpd2.norms.toarray(), [[2 / 3, 1 / 3], [0, 1], [0, 0]])
+    assert okpd2.counts.indptr.tolist() == [0, 2, 3, 3]
+
+    region = res['region']
+    assert region.counts.shape == (3, 2)
+    assert region.counts.toarray()[:, region.columns.get('50')].tolist() \
+        == [1, 1, 0]
+    assert res['customer'].counts.toarray().tolist() == [[1], [0], [0]]
+    assert res['customer'].columns.labels == ['cust_1']
+
+
+def test_stable_vocabs():
+    models = make_models()
+    first = build_matrices(models[1:], features=['region'])['region']
+    second = build_matrices(
+        models, features=['region'],
+        rows=first.rows, columns={'region': first.columns}
+    )['region']
+    assert second.rows.labels[:2] == first.rows.labels
+    assert second.columns.labels[:1] == first.columns.labels == ['50']
+    assert second.columns.labels == ['50', '77']
+    assert second.counts.toarray()[second.rows.get('test_matrix_1')].tolist() \
+        == [1, 2]
+
+
+def test_repeated_rows_and_custom_features():
+    s1, s2, _ = make_models()
+    builder = MatrixBuilder(
+        {'win': (lambda m: m.get_okpd2count(2, only_win=True),
+                 lambda key: key.okpd2_code)}
+    )
+    builder.update([s1, s2, s1])
+    win = builder.build()['win']
+    assert win.columns.labels == ['21', '10']
+    assert win.counts.toarray().tolist() == [[4, 2], [0, 0]]
+    assert MatrixBuilder().build()['okpd2'].counts.shape == (0, 0)
+
+
+def test_build_matrices_from_db():
+    db.create_dict()
+    db.execute(f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_matrix_%';
+    """)
+    for model in make_models():
+        db.incrby(model.as_rows())
+    res = build_matrices_from_db(
+        db, ['test_matrix_1', 'test_matrix_2'], features=['okpd2']
+    )['okpd2']
+    assert sorted(res.rows.labels) == ['test_matrix_1', 'test_matrix_2']
+    assert res.counts.toarray().sum() == 4
+    db.execute(f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_matrix_%';
+    """)
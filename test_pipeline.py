@@ -0,0 +1,58 @@
+import sys
+
+from pathlib import Path
+
+from .pipeline import Purchase, BuildReport, build_profiles, build_and_store
+
+sys.path.append(str(Path(__file__).parent.parent))
+from db.db import RecSysDataBase, rc, fz, pr, okw, okrw, okcw
+
+db = RecSysDataBase()
+records = [
+    Purchase('test_pipe_1', ['21.20.10.182'], '77', 'cust_1', '44fz', 500_000, True),
+    Purchase('test_pipe_1', ['21.20.10.182', '21.20.10.254'], '50', 'cust_2', '44fz', 100, False),
+    Purchase('test_pipe_2', ['10.00.0'], '77', 'cust_1', '223fz', 2_000_000, True),
+]
+
+
+def test_build_profiles():
+    profiles = build_profiles(records)
+    assert set(profiles) == {'test_pipe_1', 'test_pipe_2'}
+    s = profiles['test_pipe_1']
+    assert s.info[rc('77')] == 1
+    assert s.info[fz('44fz')] == 2
+    assert s.info[pr(1)] == 1 and s.info[pr(0)] == 1
+    assert s.info[okw('21.20.10.182', True)] == 1
+    assert s.info[okw('21.20.10.182', False)] == 1
+    assert s.info[okrw('21.20.10.254', '50', False)] == 1
+    assert s.info[okcw('21.20.10.182', 'cust_1', True)] == 1
+    assert profiles['test_pipe_2'].info[okw('10', True)] == 1
+
+
+def test_build_and_store():
+    sql = f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_pipe_%';
+    """
+    db.execute(sql)
+
+    report = build_and_store(
+        records + [rec._asdict() for rec in records],
+        workers=2,
+        batch_size=2,
+        verbose=False
+    )
+    assert isinstance(report, BuildReport)
+    assert report.records == 6
+    assert report.suppliers == 2
+
+    expected = build_profiles(records * 2)
+    rows = sorted(row for model in expected.values() for row in model.as_rows())
+    assert report.rows >= len(rows)
+    got = sorted(
+        (key, inn_kpp, num)
+        for inn_kpp in expected
+        for key, num in db.get_innkpp(inn_kpp)
+    )
+    assert got == rows
+    db.execute(sql)
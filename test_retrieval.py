@@ -0,0 +1,93 @@
+import sys
+
+from pathlib import Path
+
+import pytest
+
+from .retrieval import CandidateIndex
+from .scoring import Query, ScoringEngine
+from .supplier_info import SupplierInfo
+
+sys.path.append(str(Path(__file__).parent.parent))
+from db.sqlite_db import SQLiteDataBase
+
+
+def make_models():
+    s1 = SupplierInfo('test_ret_1')
+    s1.update_okpd_iswin2count(['21.20.10.182'] * 3, True)
+    s1.update_okpd_region_iswin2count(['21.20.10.182'], '77', True)
+    s1.update_okpd_customer_iswin2count(['21.20.10.182'], 'cust_1', True)
+    s2 = SupplierInfo('test_ret_2')
+    s2.update_okpd_iswin2count(['21.20.23.111', '10.11.11.110'], False)
+    s2.update_okpd_region_iswin2count(['21.20.23.111'] * 2, '50', False)
+    s3 = SupplierInfo('test_ret_3')
+    s3.update_okpd_iswin2count(['10.11.11.110'] * 5, True)
+    s3.update_okpd_region_iswin2count(['10.11.11.110'], '77', True)
+    return [s1, s2, s3]
+
+
+def test_search():
+    index = CandidateIndex().update(make_models())
+    assert index.search([('okpd2', '21')]) \
+        == [('test_ret_1', 3), ('test_ret_2', 1)]
+    assert index.search([('okpd2', '21.20.10.182')]) == [('test_ret_1', 3)]
+    assert index.search([('okpd2', '10'), ('region', '77')], mode='or') \
+        == [('test_ret_3', 6), ('test_ret_1', 1), ('test_ret_2', 1)]
+    assert index.search([('okpd2', '10'), ('region', '77')], mode='and') \
+        == [('test_ret_3', 6)]
+    assert index.search([('okpd2', '10'), ('region', '77')], top_n=1) \
+        == [('test_ret_3', 6)]
+    assert index.search([('okpd2', '99')]) == []
+    assert index.search([('okpd2', '99'), ('okpd2', '10')], mode='and') == []
+    assert index.search([]) == []
+    with pytest.raises(ValueError):
+        index.search([('okpd2', '10')], mode='xor')
+
+
+def test_incremental_add():
+    s1, s2, s3 = make_models()
+    index = CandidateIndex().update([s1, s2])
+    assert index.search([('okpd2', '10')]) == [('test_ret_2', 1)]
+    index.add(s3)
+    assert index.search([('okpd2', '10')]) \
+        == [('test_ret_3', 5), ('test_ret_2', 1)]
+    index.add(s2)
+    assert index.search([('okpd2', '10')]) \
+        == [('test_ret_3', 5), ('test_ret_2', 2)]
+    ids, counts = index.posting(('okpd2', '10'))
+    assert ids.tolist() == sorted(ids.tolist())
+
+
+def test_max_postings():
+    index = CandidateIndex(max_postings=1).update(make_models())
+    assert index.search([('okpd2', '10')]) == [('test_ret_3', 5)]
+
+
+def test_candidates():
+    models = make_models()
+    index = CandidateIndex().update(models)
+    query = Query(['21.20.10.100'], '50', 'cust_1', 100)
+    assert index.candidates(query) == [('test_ret_1', 4), ('test_ret_2', 3)]
+    assert index.candidates(query, top_n=1) == [('test_ret_1', 4)]
+    with pytest.raises(ValueError):
+        index.candidates(query, len_okpd=4)
+    assert CandidateIndex(okpd_depths=(2,)).update(models).candidates(
+        query, len_okpd=2
+    )
+
+    engine = ScoringEngine(models)
+    names = [name for name, _ in index.candidates(query)]
+    top = engine.top_k([query], candidates=names)[0]
+    assert {c.inn_kpp for c in top} == set(names)
+
+
+def test_from_db():
+    models = make_models()
+    sqlite = SQLiteDataBase()
+    sqlite.incrby([row for model in models for row in model.as_rows()])
+    index = CandidateIndex.from_db(sqlite, fetch_size=2)
+    expected = CandidateIndex().update(models)
+    query = Query(['21.20.10.100'], '50', 'cust_1', 100)
+    assert index.candidates(query) == expected.candidates(query)
+    assert index.search([('okpd2', '10')]) == expected.search([('okpd2', '10')])
+    sqlite.close()
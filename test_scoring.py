@@ -0,0 +1,102 @@
+import random
+
+import numpy as np
+import pytest
+
+from .scoring import Query, ScoringEngine, score_supplier, FEATURE_NAMES
+from .supplier_info import SupplierInfo
+
+codes = ['21.20.10.182', '21.20.10.254', '21.20.23.111', '10.11.11.110', '10.00.0']
+regions = ['77', '50', '24']
+customers = ['cust_1', 'cust_2', 'cust_3']
+
+
+@pytest.fixture(autouse=True)
+def msp_inn_reestr(monkeypatch):
+    # Реестр МСП для тестов вместо dependencies/msp_inn_reestr.json.
+    monkeypatch.setattr(SupplierInfo, 'msp_inn_reestr', {'9705031526'})
+
+
+def make_models(n=30, seed=0):
+    rnd = random.Random(seed)
+    models = []
+    for i in range(n):
+        model = SupplierInfo(f'{"9705031526" if i % 3 == 0 else f"{i:010}"}_{i:09}')
+        for _ in range(rnd.randint(0, 6)):
+            okpd2_codes = rnd.sample(codes, rnd.randint(1, 2))
+            region_code = rnd.choice(regions)
+            is_win = rnd.random() < 0.5
+            model.update_price_cat2count([rnd.randint(0, 3)])
+            model.update_okpd_region_iswin2count(okpd2_codes, region_code, is_win)
+            model.update_okpd_customer_iswin2count(
+                okpd2_codes, rnd.choice(customers), is_win
+            )
+        models.append(model)
+    return models
+
+
+queries = [
+    Query(['21.20.10.182'], '77', 'cust_1', 500_000),
+    Query(['21.20.10.254', '10.00.0'], '50', 'cust_2', 100),
+    Query(['99.99.99.999'], '01', 'cust_9', 5_000_000),
+]
+weights = {'okpd_region': 2., 'okpd_customer': 1., 'price_cat': .5, 'msp': .1}
+
+
+def test_score_matches_reference():
+    models = make_models()
+    engine = ScoringEngine(models, weights)
+    assert len(engine) == len(models)
+    cand, scores, contributions = engine.score(queries)
+    assert scores.shape == (len(queries), len(models))
+    assert contributions.shape == (len(FEATURE_NAMES), len(queries), len(models))
+    for q, query in enumerate(queries):
+        for i, c in enumerate(cand):
+            expected = score_supplier(models[c], query, weights)
+            assert scores[q, i] == pytest.approx(expected.score)
+            assert contributions[:, q, i].tolist() == pytest.approx(
+                [expected.contributions[name] for name in FEATURE_NAMES]
+            )
+
+
+def test_top_k():
+    models = make_models()
+    engine = ScoringEngine(models, weights)
+    top = engine.top_k(queries, k=5)
+    assert [len(res) for res in top] == [5, 5, 5]
+    for query, res in zip(queries, top):
+        expected = sorted(
+            (score_supplier(m, query, weights) for m in models),
+            key=lambda c: -c.score
+        )
+        assert [c.score for c in res] \
+            == pytest.approx([c.score for c in expected[:5]])
+        assert res[0].score == pytest.approx(sum(res[0].contributions.values()))
+
+
+def test_candidates():
+    models = make_models()
+    engine = ScoringEngine(models, weights)
+    names = [models[3].inn_kpp, models[1].inn_kpp, 'unknown']
+    cand, scores, _ = engine.score(queries, candidates=names)
+    assert [engine.rows[i] for i in cand] == names[:2]
+    assert scores.shape == (3, 2)
+    top = engine.top_k(queries[:1], k=10, candidates=names)
+    assert sorted(c.inn_kpp for c in top[0]) == sorted(names[:2])
+    assert engine.top_k(queries[:1], candidates=[]) == [[]]
+
+    # Повторы кандидатов не сдвигают оценки относительно кандидатов.
+    dup_cand, dup_scores, _ = engine.score(queries, candidates=names + names[:1])
+    assert dup_cand.tolist() == cand.tolist()
+    assert dup_scores.tolist() == scores.tolist()
+    top = engine.top_k(queries[:1], k=10, candidates=names * 2)
+    assert sorted(c.inn_kpp for c in top[0]) == sorted(names[:2])
+
+
+def test_msp():
+    models = make_models(3)
+    assert [m.msp for m in models] == [True, False, False]
+    engine = ScoringEngine(models, weights)
+    _, _, contributions = engine.score(queries[:1])
+    assert contributions[-1, 0].tolist() == [weights['msp'], 0., 0.]
+    assert ScoringEngine([]).top_k(queries) == [[], [], []]
@@ -0,0 +1,67 @@
+import random
+
+import pytest
+
+from .similarity import MinHashLSH, profile_tokens
+from .supplier_info import SupplierInfo
+
+codes = [f'{a:02}.{b:02}.{c:02}.{d:03}' for a, b, c, d in
+         zip(range(10, 90), range(80), range(80), range(100, 180))]
+
+
+def make_model(inn_kpp, okpd2_codes, region_code='77', customer='cust_1'):
+    model = SupplierInfo(inn_kpp)
+    model.update_okpd_iswin2count(okpd2_codes, True)
+    model.update_okpd_region_iswin2count(okpd2_codes[:1], region_code, True)
+    model.update_okpd_customer_iswin2count(okpd2_codes[:1], customer, True)
+    return model
+
+
+def jaccard(a, b):
+    a, b = profile_tokens(a), profile_tokens(b)
+    return len(a & b) / len(a | b)
+
+
+def test_profile_tokens():
+    model = make_model('test_sim_1', ['21.20.10.182'], '50', 'cust_2')
+    assert profile_tokens(model) == {'ok:21.20.10.182', 'r:50', 'c:cust_2'}
+    assert profile_tokens(SupplierInfo('test_sim_0')) == set()
+
+
+def test_query():
+    rnd = random.Random(0)
+    base = rnd.sample(codes, 30)
+    near = make_model('test_sim_near', base[:28] + rnd.sample(codes, 2))
+    models = [make_model('test_sim_base', base), near] + [
+        make_model(f'test_sim_{i}', rnd.sample(codes, 30), str(i), f'c{i}')
+        for i in range(30)
+    ]
+    index = MinHashLSH(num_perm=64, bands=16).update(models)
+    assert len(index) == len(models)
+    res = index.query('test_sim_base', k=3)
+    assert res[0][0] == 'test_sim_near'
+    assert res[0][1] == pytest.approx(jaccard(models[0], near), abs=0.2)
+    assert 'test_sim_base' not in dict(res)
+    assert index.query(models[0], k=1)[0][0] == 'test_sim_near'
+    assert index.query(SupplierInfo('test_sim_empty')) == []
+    with pytest.raises(KeyError):
+        index.query('test_sim_none')
+
+
+def test_incremental_update():
+    index = MinHashLSH(num_perm=32, bands=8)
+    a = make_model('test_sim_a', codes[:20])
+    b = make_model('test_sim_b', codes[40:60], '50', 'cust_2')
+    index.update([a, b])
+    assert index.query('test_sim_a') == []
+
+    index.add(make_model('test_sim_b', codes[:20]))
+    assert index.query('test_sim_a') == [('test_sim_b', 1.0)]
+    assert index.remove('test_sim_b') and not index.remove('test_sim_b')
+    assert 'test_sim_b' not in index
+    assert index.query('test_sim_a') == []
+
+    index.add(SupplierInfo('test_sim_a'))
+    assert 'test_sim_a' not in index and len(index) == 0
+    with pytest.raises(ValueError):
+        MinHashLSH(num_perm=10, bands=3)
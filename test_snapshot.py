@@ -0,0 +1,75 @@
+import sys
+
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).parent))
+from db import RecSysDataBase
+from snapshot import SnapshotDataBase, export_snapshot, write_snapshot, str_hash
+
+db = RecSysDataBase()
+suppliers = [
+    ('7810098244_781001001', [
+        ('rc:7810098244_781001001:23', 4),
+        ('fz:7810098244_781001001:44fz', 10),
+    ]),
+    ('9705031526_770501001', [
+        ('okw:9705031526_770501001:21.20.10.182:True', 3),
+    ]),
+    ('пустой', []),
+]
+
+
+def test_str_hash():
+    assert str_hash('abc') == str_hash('abc')
+    assert str_hash('abc') != str_hash('abd')
+    assert 0 <= str_hash('abc') < 2 ** 64
+
+
+def test_write_snapshot(tmp_path):
+    path = tmp_path / 'key2num.snap'
+    assert write_snapshot(path, suppliers) == (3, 3)
+    with SnapshotDataBase(path) as snap:
+        assert snap.get('rc:7810098244_781001001:23') == 4
+        assert snap.get('okw:9705031526_770501001:21.20.10.182:True') == 3
+        assert snap.get('rc:7810098244_781001001:24') == 0
+        assert snap.get_many(['fz:7810098244_781001001:44fz', 'none']) \
+            == {'fz:7810098244_781001001:44fz': 10, 'none': 0}
+        assert snap.get_innkpp('7810098244_781001001') == sorted(suppliers[0][1])
+        assert snap.get_innkpp('пустой') == []
+        assert snap.get_innkpp('none') == []
+        assert list(snap.iter_innkpp()) \
+            == [(inn_kpp, sorted(rows)) for inn_kpp, rows in suppliers]
+        assert list(snap.iter_innkpp(
+            ['9705031526_770501001', 'none', '7810098244_781001001',
+             '9705031526_770501001']
+        )) == [(inn_kpp, sorted(rows)) for inn_kpp, rows in suppliers[:2]]
+        assert list(snap.iter_innkpp([])) == []
+
+    path.write_bytes(b'not a snapshot' * 10)
+    with pytest.raises(ValueError):
+        SnapshotDataBase(path)
+
+
+def test_export_snapshot(tmp_path):
+    sql = f"""
+    delete from public.{db.dict_name}
+        where inn_kpp like 'test_snap_%';
+    """
+    db.execute(sql)
+    db.incrby([
+        ('test_snap_id1', 'test_snap_a', 1),
+        ('test_snap_id2', 'test_snap_a', 2),
+        ('test_snap_id3', 'test_snap_b', 3),
+    ])
+
+    path = tmp_path / 'key2num.snap'
+    n_keys, n_suppliers = export_snapshot(db, path, fetch_size=2)
+    with SnapshotDataBase(path) as snap:
+        assert snap.n_keys == n_keys
+        assert snap.n_suppliers == n_suppliers
+        for inn_kpp in ('test_snap_a', 'test_snap_b', 'test_snap_none'):
+            assert snap.get_innkpp(inn_kpp) == sorted(db.get_innkpp(inn_kpp))
+        assert snap.get('test_snap_id2') == 2
+    db.execute(sql)
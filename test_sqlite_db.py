@@ -0,0 +1,84 @@
+import sys
+
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from db import CounterBackend, RecSysDataBase
+from sqlite_db import SQLiteDataBase
+
+
+class TestSQLiteDataBase:
+    def test_backend(self):
+        assert issubclass(SQLiteDataBase, CounterBackend)
+        assert issubclass(RecSysDataBase, CounterBackend)
+        assert 'iter_innkpp' in CounterBackend.__abstractmethods__
+
+    def test_create_clear_dict(self, tmp_path):
+        db = SQLiteDataBase(tmp_path / 'key2num.db')
+        assert db.create_dict() == 0
+        db.incr('test_id', 'innkpp')
+        db.close()
+
+        db = SQLiteDataBase(tmp_path / 'key2num.db')
+        assert db.get('test_id') == 1
+        assert db.clear_dict() == 1
+        assert db.get('test_id') == 0
+        db.dict_name = 'none'
+        assert db.clear_dict() == 0
+        db.close()
+
+    def test_incr(self):
+        db = SQLiteDataBase()
+        assert db.get('test_id') == 0
+        db.incr('test_id', 'innkpp')
+        assert db.get('test_id') == 1
+        db.incr('test_id', 'innkpp', 10)
+        assert db.get('test_id') == 11
+
+    def test_incrby(self):
+        db = SQLiteDataBase()
+        db.incrby({'test_id': ('innkpp', 1)})
+        assert db.get('test_id') == 1
+        db.incrby([('test_id', 'innkpp', 2), ('test_id2', 'innkpp', 5),
+                   ('test_id', 'innkpp', 1)])
+        assert db.get('test_id') == 4
+        assert db.get('test_id2') == 5
+        db.incrby([])
+
+    def test_get_many(self):
+        db = SQLiteDataBase()
+        assert db.get_many([]) == {}
+        db.incrby([('test_id', 'innkpp', 2), ('test_id2', 'innkpp', 3)])
+        assert db.get_many(['test_id', 'test_id2', 'test_id3']) \
+            == {'test_id': 2, 'test_id2': 3, 'test_id3': 0}
+
+    def test_get_innkpp(self):
+        db = SQLiteDataBase()
+        assert db.get_innkpp('test_innkpp') == []
+        db.incr('test_id', 'test_innkpp')
+        assert db.get_innkpp('test_innkpp') == [('test_id', 1)]
+
+    def test_iter_innkpp(self):
+        db = SQLiteDataBase()
+        db.incrby([
+            ('test_id1', 'b', 1),
+            ('test_id2', 'a', 2),
+            ('test_id3', 'b', 3),
+            ('test_id4', 'c', 4),
+        ])
+        res = list(db.iter_innkpp(['b', 'a'], fetch_size=1))
+        assert [inn_kpp for inn_kpp, _ in res] == ['a', 'b']
+        assert sorted(res[1][1]) == [('test_id1', 1), ('test_id3', 3)]
+        assert [inn_kpp for inn_kpp, _ in db.iter_innkpp()] == ['a', 'b', 'c']
+        assert list(db.iter_innkpp([])) == []
+
+    def test_iter_innkpp_with_writes(self):
+        db = SQLiteDataBase()
+        db.incrby([(f'test_id{i}', f'innkpp{i}', 1) for i in range(5)])
+        seen = []
+        inn_kpps = [f'innkpp{i}' for i in range(5)]
+        for inn_kpp, rows in db.iter_innkpp(inn_kpps, fetch_size=2):
+            seen.append(inn_kpp)
+            db.incr(f'test_der_{inn_kpp}', 'der', len(rows))
+        assert seen == inn_kpps
+        assert len(db.get_innkpp('der')) == 5
@@ -1,15 +1,23 @@
+import gc
 import sys
 import string
+import weakref
+
+from collections import Counter
 
 from pathlib import Path
 
 import pytest
 
-from .supplier_info import SupplierInfo
+from .supplier_info import (
+    InfoCounter, OkpdHierarchy, SupplierInfo, fold_okpd, info_sizeof
+)
 
 sys.path.append(str(Path(__file__).parent.parent))
-from db.db import RecSysDataBase, rc, fz, pr, ok, okw, okr, okrw, okc, okcw
-from utils import NormDict
+from db.db import RecSysDataBase, KeyInfoBuilder, KeyPool, rc, fz, pr, ok, okw, okr, okrw, okc, okcw
+from utils import NormDict, ArrayNormDict
+from db.sqlite_db import SQLiteDataBase
+from db.typed_db import TypedKey2Num
 
 db = RecSysDataBase()
 inn_kpp = '9705031526_770501001'
@@ -39,6 +47,95 @@ class TestSupplierInfo:
         except:
             assert False
 
+    def test_from_info(self):
+        info = [(KeyInfoBuilder().from_str(key), num) for key, num in rows]
+        assert SupplierInfo.from_info(inn_kpp, info).info == s.info
+
+    def test_key_pool(self):
+        # Без явного пула ключи не накапливаются в общем пуле процесса.
+        assert SupplierInfo.KEY_POOL is None and s.key_pool is None
+
+        pool = KeyPool()
+        first = SupplierInfo.from_rows(inn_kpp, rows, pool)
+        other = SupplierInfo.from_rows(
+            '7810098244_781001001',
+            [(key.replace(inn_kpp, '7810098244_781001001'), num)
+             for key, num in rows],
+            pool
+        )
+        for key_info in other.info:
+            pooled = next(k for k in first.info if k == key_info)
+            assert pooled is key_info
+
+        other.update_okpd_region_iswin2count(['21.20.10.254'], '77', True)
+        assert other.info[okrw('21.20.10.254', '77', True)] == 18
+        added = next(k for k in other.info if k == okrw('21.20.10.254', '77', True))
+        assert pool.intern(okrw('21.20.10.254', '77', True)) is added
+        assert SupplierInfo.from_info(inn_kpp, first.info.items(), pool).info \
+            == first.info
+
+        suppliers = [f'{i:010}_{i:09}' for i in range(50)]
+        plain, pooled = [], []
+        for key_pool, models in ((None, plain), (KeyPool(), pooled)):
+            for supplier in suppliers:
+                models.append(SupplierInfo.from_rows(
+                    supplier,
+                    [(key.replace(inn_kpp, supplier), num) for key, num in rows],
+                    key_pool
+                ))
+        assert [m.info for m in plain] == [m.info for m in pooled]
+        assert info_sizeof(pooled) < info_sizeof(plain) / 2
+
+        # Пул живет, пока живы профили, загруженные с ним.
+        pool_ref = weakref.ref(pool)
+        del first, other, pool
+        gc.collect()
+        assert pool_ref() is None
+
+    def test_iter_from_db(self):
+        db.create_dict()
+        db.execute(f"""
+        delete from public.{db.dict_name}
+            where inn_kpp = '{inn_kpp}';
+        """)
+        assert list(SupplierInfo.iter_from_db(db, [inn_kpp])) == []
+        db.incrby([(key, inn_kpp, num) for key, num in rows])
+
+        models = list(SupplierInfo.iter_from_db(db, [inn_kpp], fetch_size=2))
+        assert len(models) == 1
+        assert models[0].inn_kpp == inn_kpp
+        assert models[0].info == s.info
+
+        pool = KeyPool()
+        models = list(SupplierInfo.iter_from_db(db, [inn_kpp], key_pool=pool))
+        assert models[0].info == s.info and models[0].key_pool is pool
+        assert len(pool) == len(rows)
+        db.execute(f"""
+        delete from public.{db.dict_name}
+            where inn_kpp = '{inn_kpp}';
+        """)
+
+    def test_iter_from_sqlite(self):
+        sqlite = SQLiteDataBase()
+        sqlite.incrby([(key, inn_kpp, num) for key, num in rows])
+        models = list(SupplierInfo.iter_from_db(sqlite, fetch_size=2))
+        assert [m.inn_kpp for m in models] == [inn_kpp]
+        assert models[0].info == s.info
+        assert models[0].region2count == s.region2count
+        sqlite.close()
+
+    def test_from_typed_db(self):
+        typed = TypedKey2Num(db, 'key2num_typed_supplier_test')
+        db.execute(f'drop table if exists public.{typed.table_name};')
+        typed.create_table()
+        typed.incrby((inn_kpp, key_info, num) for key_info, num in s.info.items())
+        model = SupplierInfo.from_info(inn_kpp, typed.get_innkpp(inn_kpp))
+        assert model.info == s.info
+        assert model.region2count == s.region2count and model.region2count
+        assert model.fz2count == s.fz2count and model.fz2count
+        assert model.okpd_iswin2count == s.okpd_iswin2count and model.okpd_iswin2count
+        db.execute(f'drop table if exists public.{typed.table_name};')
+
     def test_as_rows(self):
         assert set(s.as_rows()) == {(row[0], inn_kpp, row[1]) for row in rows}
 
@@ -161,3 +258,220 @@ class TestSupplierInfo:
         + ['21.20.10.191'] * 3 \
         + ['21.20.10.214'] * 1 \
         + ['21.20.10.214'] * 2
+
+
+class TestInfoCounter:
+    def test_counter_api(self):
+        info = InfoCounter()
+        assert info == InfoCounter() and len(info) == 0
+        info.update([rc('01'), rc('02'), rc('01')])
+        info.update([okw('11.1', True), fz('44fz'), fz('44fz')])
+        info.update({rc('01'): 3, pr(2): 1})
+        info[okw('22.2', False)] = 5
+        assert info[rc('01')] == 5
+        assert info[rc('99')] == 0
+        assert info.get(rc('99')) is None
+        assert info.get(fz('44fz')) == 2
+        assert rc('02') in info and rc('99') not in info
+        assert len(info) == 6
+        assert dict(info.part(rc)) == {rc('01'): 5, rc('02'): 1}
+        assert dict(info.part(okrw)) == {}
+        assert info == Counter({
+            rc('01'): 5, rc('02'): 1, okw('11.1', True): 1,
+            fz('44fz'): 2, pr(2): 1, okw('22.2', False): 5,
+        })
+        del info[rc('02')]
+        assert set(info) == {
+            rc('01'), okw('11.1', True), fz('44fz'), pr(2), okw('22.2', False)
+        }
+        assert InfoCounter(info) == info
+        assert dict(info.part(rc)) == {rc('01'): 5}
+
+        assert isinstance(info, Counter)
+        assert info.most_common(2) == [(rc('01'), 5), (okw('22.2', False), 5)]
+        assert info.total() == 14
+        assert list(info.elements()).count(fz('44fz')) == 2
+        assert info + Counter({pr(2): 1}) == Counter({
+            rc('01'): 5, okw('11.1', True): 1, fz('44fz'): 2, pr(2): 2,
+            okw('22.2', False): 5,
+        })
+        assert info - Counter({rc('01'): 5, fz('44fz'): 1}) == Counter({
+            okw('11.1', True): 1, fz('44fz'): 1, pr(2): 1, okw('22.2', False): 5,
+        })
+        info.subtract([pr(2)])
+        assert info[pr(2)] == 0 and pr(2) in info
+        info += Counter({rc('03'): 1})
+        assert pr(2) not in info
+        assert dict(info.part(rc)) == {rc('01'): 5, rc('03'): 1}
+        assert dict(info.part(pr)) == {}
+        info.setdefault(rc('04'), 2)
+        assert info.pop(rc('04')) == 2
+        assert dict(info.part(rc)) == {rc('01'): 5, rc('03'): 1}
+        info.clear()
+        assert info.part(rc) == {} and info.total() == 0
+
+    def test_views_use_parts(self):
+        model = SupplierInfo(inn_kpp)
+        model.update_okpd_iswin2count(['21.20.10.182', '21.20.10.254'], True)
+        model.update_okpd_iswin2count(['21.20.10.182'], False)
+        model.update_region2count(['77'])
+        assert dict(model.info.part(okw)) == {
+            okw('21.20.10.182', True): 1,
+            okw('21.20.10.254', True): 1,
+            okw('21.20.10.182', False): 1,
+        }
+        assert model.get_okpd2count(only_win=True) == NormDict.from_counter(
+            {ok('21.20.10.182'): 1, ok('21.20.10.254'): 1}
+        )
+        assert model.region2count == NormDict.from_counter({rc('77'): 1})
+
+    def test_incremental_views(self):
+        model = SupplierInfo(inn_kpp)
+        model.update_okpd_iswin2count(['21.20.10.182', '21.20.10.254'], True)
+        model.update_okpd_region_iswin2count(['21.20.10.182'], '77', False)
+        model.update_fz2count(['44fz'])
+        views = (
+            model.okpd_iswin2count,
+            model.fz2count,
+            model.get_okpd2count(5),
+            model.get_okpd2count(12, only_win=True),
+            model.get_okpd_region2count(5),
+        )
+        assert model.get_okpd2count(5) is views[2]
+
+        model.update_okpd_iswin2count(['21.20.10.182', '22.11.11.111'], False)
+        model.update_okpd_region_iswin2count(['21.20.10.254'], '77', True)
+        model.update_fz2count(['223fz', '44fz'])
+        model.update_region2count(['50'])
+        # Нормы обновляются при чтении представления, сам объект тот же.
+        current = (
+            model.okpd_iswin2count,
+            model.fz2count,
+            model.get_okpd2count(5),
+            model.get_okpd2count(12, only_win=True),
+            model.get_okpd_region2count(5),
+        )
+        assert all(a is b for a, b in zip(current, views))
+
+        rebuilt = SupplierInfo.from_info(inn_kpp, model.info.items())
+        for view, expected in zip(current, (
+            rebuilt.okpd_iswin2count,
+            rebuilt.fz2count,
+            rebuilt.get_okpd2count(5),
+            rebuilt.get_okpd2count(12, only_win=True),
+            rebuilt.get_okpd_region2count(5),
+        )):
+            assert view == expected
+            assert {k: v.norm for k, v in view.items()} \
+                == {k: v.norm for k, v in expected.items()}
+        assert model.get_okpd2count(5) \
+            == NormDict.from_counter({ok('21.2'): 3, ok('22.11'): 1})
+        assert model.fz2count.get_norm(fz('44fz'), 0) == 2 / 3
+
+    def test_views_per_instance(self):
+        model = SupplierInfo(inn_kpp)
+        model.update_okpd_iswin2count(['21.20.10.182'], True)
+        assert model._cache is None
+        for len_okpd in range(SupplierInfo.FOLDS_CACHE_SIZE + 4):
+            model.get_okpd2count(len_okpd)
+        assert len(model._cache.folds) == SupplierInfo.FOLDS_CACHE_SIZE
+
+        ref = weakref.ref(model)
+        del model
+        gc.collect()
+        assert ref() is None
+
+
+class TestOkpdHierarchy:
+    keys = {
+        okrw('21.20.10.182', '77', True): 3,
+        okrw('21.20.10.254', '77', False): 2,
+        okrw('21.20.10.254', '50', True): 1,
+        okrw('22.11', '50', True): 4,
+        okrw('01.1', '77', False): 1,
+    }
+
+    def brute_force(self, len_okpd, extra=None):
+        counts = Counter()
+        for key, count in self.keys.items():
+            if extra is None or key[1:-1] == extra:
+                counts[fold_okpd(okr, key, len_okpd)] += count
+        return NormDict.from_counter(counts)
+
+    def test_rollup(self):
+        hierarchy = OkpdHierarchy.from_keys(okr, self.keys.items())
+        for len_okpd in range(0, 15):
+            assert hierarchy.rollup(len_okpd) == self.brute_force(len_okpd)
+            for region_code in ('77', '50', '99'):
+                assert hierarchy.rollup(len_okpd, (region_code,)) \
+                    == self.brute_force(len_okpd, (region_code,))
+        assert hierarchy.rollup(2, ('77',)) == NormDict.from_counter(
+            {okr('21', '77'): 5, okr('01', '77'): 1}
+        )
+        assert hierarchy.rollup(5, ('77',)).get_norm(okr('21.2', '77'), 0) \
+            == 5 / 6
+
+    def test_add(self):
+        hierarchy = OkpdHierarchy(okr)
+        assert hierarchy.rollup(12) == NormDict()
+        for key, count in self.keys.items():
+            hierarchy.add(key, count)
+        for len_okpd in range(0, 15):
+            assert hierarchy.rollup(len_okpd) == self.brute_force(len_okpd)
+
+    def test_lazy_levels(self):
+        hierarchy = OkpdHierarchy(okr)
+        keys = list(self.keys.items())
+        for key, count in keys[:2]:
+            hierarchy.add(key, count)
+        assert hierarchy.levels == {}
+        hierarchy.rollup(5)
+        hierarchy.rollup(14, ('50',))
+        assert set(hierarchy.levels) == {5, 12}
+        # Уже построенные уровни дополняются в add.
+        for key, count in keys[2:]:
+            hierarchy.add(key, count)
+        assert set(hierarchy.levels) == {5, 12}
+        for len_okpd in (5, 12, 2):
+            assert hierarchy.rollup(len_okpd) == self.brute_force(len_okpd)
+
+    def test_supplier_info(self):
+        model = SupplierInfo(inn_kpp)
+        model.update_okpd_region_iswin2count(['21.20.10.182'], '77', True)
+        hierarchy = model.okpd_hierarchy(okr)
+        assert model.okpd_hierarchy(okr) is hierarchy
+        assert model.get_okpd_region2count(5, region_code='77') \
+            == NormDict.from_counter({okr('21.2', '77'): 1})
+
+        model.update_okpd_region_iswin2count(['21.20.10.254'], '77', False)
+        model.update_okpd_region_iswin2count(['22.11.11.111'], '50', True)
+        assert model.okpd_hierarchy(okr) is hierarchy
+        assert model.get_okpd_region2count(5, region_code='77') \
+            == NormDict.from_counter({okr('21.2', '77'): 2})
+        assert model.get_okpd_region2count(5, only_win=True) \
+            == NormDict.from_counter({okr('21.2', '77'): 1, okr('22.11', '50'): 1})
+        assert model.get_okpd_customer2count(customer_inn_kpp='1_1') \
+            == NormDict()
+
+    def test_array_norm_dict_views(self):
+        class ArraySupplierInfo(SupplierInfo):
+            NORM_DICT = ArrayNormDict
+
+        models = [SupplierInfo(inn_kpp), ArraySupplierInfo(inn_kpp)]
+        for model in models:
+            model.update_okpd_region_iswin2count(['21.20.10.182'], '77', True)
+            model.update_fz2count(['44fz'])
+            model.get_okpd_region2count(5)
+            model.fz2count
+            model.update_okpd_region_iswin2count(['21.20.10.254'], '50', True)
+            model.update_fz2count(['223fz', '44fz'])
+        plain, compact = models
+        assert isinstance(compact.fz2count, ArrayNormDict)
+        for name in ('fz2count', 'okpd_region_iswin2count'):
+            a, b = getattr(plain, name), getattr(compact, name)
+            assert a == b
+            assert {k: v.norm for k, v in a.items()} \
+                == {k: v.norm for k, v in b.items()}
+        assert compact.get_okpd_region2count(5) == plain.get_okpd_region2count(5)
+        assert compact.get_okpd_region2count(5).get_norm(okr('21.2', '50'), 0) \
+            == 0.5
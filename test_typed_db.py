@@ -0,0 +1,62 @@
+import sys
+
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent))
+from db import RecSysDataBase, rc, fz, pr, okw, okrw, okcw
+from typed_db import TypedKey2Num
+
+db = RecSysDataBase()
+typed = TypedKey2Num(db, 'key2num_typed_test')
+inn_kpp = 'test_typed_innkpp'
+rows = [
+    ('rc:test_typed_innkpp:52', 1),
+    ('fz:test_typed_innkpp:44fz', 1356),
+    ('pr:test_typed_innkpp:3', 123),
+    ('okw:test_typed_innkpp:21.20.10.182:True', 3),
+    ('okw:test_typed_innkpp:21.20.10.182:1', 2),
+    ('okrw:test_typed_innkpp:21.20.10.254:77:False', 17),
+    ('okcw:test_typed_innkpp:21.20.10.214:3205000938_324501001:0', 1),
+]
+info = {
+    rc('52'): 1,
+    fz('44fz'): 1356,
+    pr(3): 123,
+    okw('21.20.10.182', True): 5,
+    okrw('21.20.10.254', '77', False): 17,
+    okcw('21.20.10.214', '3205000938_324501001', False): 1,
+}
+
+
+class TestTypedKey2Num:
+    def setup_method(self):
+        db.execute(f"""
+        drop table if exists public.{typed.table_name};
+        delete from public.{db.dict_name}
+            where inn_kpp = '{inn_kpp}';
+        """)
+
+    def teardown_method(self):
+        self.setup_method()
+
+    def test_create_table(self):
+        assert typed.create_table() == 1
+        assert typed.create_table() == 0
+
+    def test_incrby(self):
+        typed.create_table()
+        assert typed.get_innkpp(inn_kpp) == []
+        typed.incrby((inn_kpp, key_info, num) for key_info, num in info.items())
+        typed.incrby([(inn_kpp, rc('52'), 1), (inn_kpp, rc('52'), 2)])
+        assert dict(typed.get_innkpp(inn_kpp)) == info | {rc('52'): 4}
+        typed.incrby([])
+
+    def test_migrate(self):
+        db.incrby([(key, inn_kpp, num) for key, num in rows])
+        assert typed.migrate([inn_kpp]) == len(info)
+        assert dict(typed.get_innkpp(inn_kpp)) == info
+        # Повторный перенос не удваивает значения.
+        typed.migrate()
+        assert dict(typed.get_innkpp(inn_kpp)) == info
+        typed.cluster()
+        assert dict(typed.get_innkpp(inn_kpp)) == info
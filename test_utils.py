@@ -1,6 +1,16 @@
+import random
+
+from collections import Counter
+
+import numpy as np
 import pytest
 
-from .utils import prepare_okpd2_code, get_price_cat
+from .utils import (
+    prepare_okpd2_code, get_price_cat, NormData, NormDict, ArrayNormDict,
+    AliasTable, prepare_okpd2_codes, prepare_okpd2_codes_array, encode_okpd2,
+    decode_okpd2, truncate_okpd2, is_okpd2_prefix, encode_okpd2_codes,
+    decode_okpd2_codes, truncate_okpd2_codes
+)
 
 
 def test_get_price_cat():
@@ -19,3 +29,185 @@ def test_prepare_okpd2_code():
     assert prepare_okpd2_code('11.11.10.020') == '11.11.10.020'
     assert prepare_okpd2_code('10.00.0') == '10'
     assert prepare_okpd2_code('01.12.10.000') == '01.12.1'
+
+
+class TestArrayNormDict:
+    def test_from_counter(self):
+        counter = {'a': 2, 'b': 1, 'c': 1}
+        d = ArrayNormDict.from_counter(counter)
+        assert d == NormDict.from_counter(counter)
+        assert NormDict.from_counter(counter) == d
+        assert d.get_count('a', 0) == 2 and d.get_count('z', 0) == 0
+        assert d.get_norm('a', 0) == 0.5 and d.get_norm('z', None) is None
+        assert d['b'].norm == 0.25 and d['b'] == 1
+        assert len(d) == 3 and 'c' in d and d.total == 4
+        assert list(d) == ['a', 'b', 'c']
+        assert ArrayNormDict() == NormDict()
+        assert ArrayNormDict().get_norm('a', 0.) == 0.
+
+    def test_update(self):
+        d = ArrayNormDict.from_elements(['a', 'b', 'a'])
+        d.update(['c', 'a'])
+        d.update(None)
+        assert dict((k, v.count) for k, v in d.items()) \
+            == {'a': 3, 'b': 1, 'c': 1}
+        # В отличие от NormDict нормы согласованы после update без пересчета.
+        assert d.get_norm('a', 0) == 3 / 5
+        d['b'] += 2
+        d['d'] = NormData(5)
+        assert d.get_count('b', 0) == 3 and d.get_norm('d', 0) == 5 / 12
+        del d['a']
+        assert 'a' not in d and d.total == 9
+        assert dict((k, v.count) for k, v in d.items()) \
+            == {'b': 3, 'c': 1, 'd': 5}
+        del d['d']
+        assert sorted(d.keys()) == ['b', 'c'] and d.get_norm('c', 0) == 0.25
+
+    def test_elements(self):
+        d = ArrayNormDict.from_counter({'ab': 2, 'ac': 1, 'b': 1})
+        assert sorted(d.elements('a')) == ['b', 'b', 'c']
+        assert sorted(d.elements('a', trunc_prefix=False)) == ['ab', 'ab', 'ac']
+        assert len(list(d.elements())) == 4
+
+
+@pytest.mark.parametrize('cls', [NormDict, ArrayNormDict])
+class TestSample:
+    def test_sample(self, cls):
+        d = cls.from_counter({'44fz': 1356, '223fz': 62, 'none': 0})
+        rnd = random.Random(0)
+        counts = Counter(d.sample(20_000, rnd=rnd))
+        assert set(counts) == {'44fz', '223fz'}
+        assert counts['223fz'] / 20_000 == pytest.approx(62 / 1418, abs=0.01)
+        assert d.sample(0) == []
+        assert cls().sample(0) == []
+        with pytest.raises(ValueError):
+            cls().sample(1)
+
+    def test_startswith(self, cls):
+        d = cls.from_counter({'ab': 3, 'ac': 1, 'b': 100})
+        rnd = random.Random(1)
+        assert set(d.sample(200, startswith='a', rnd=rnd)) == {'ab', 'ac'}
+        assert sorted(d.sample(2, replace=False, startswith='a', rnd=rnd)) \
+            == ['ab', 'ac']
+        with pytest.raises(ValueError):
+            d.sample(3, replace=False, startswith='a')
+
+    def test_without_replacement(self, cls):
+        d = cls.from_counter({f'k{i}': i + 1 for i in range(50)})
+        rnd = random.Random(2)
+        for k in (1, 10, 50):
+            res = d.sample(k, replace=False, rnd=rnd)
+            assert len(res) == k and len(set(res)) == k
+        heavy = Counter(
+            key for _ in range(300)
+            for key in d.sample(5, replace=False, rnd=rnd)
+        )
+        assert heavy['k49'] > heavy['k0']
+
+    def test_without_replacement_distribution(self, cls):
+        d = cls.from_counter({'a': 1, 'b': 2, 'c': 7})
+        rnd = random.Random(6)
+        n = 20_000
+        firsts, pairs = Counter(), Counter()
+        for _ in range(n):
+            res = d.sample(2, replace=False, rnd=rnd)
+            firsts[res[0]] += 1
+            pairs[frozenset(res)] += 1
+        # Последовательный выбор с перенормировкой: P(a в выборке) =
+        # 1 - P(b, затем c) - P(c, затем b).
+        assert firsts['c'] / n == pytest.approx(0.7, abs=0.015)
+        assert (n - pairs[frozenset('bc')]) / n \
+            == pytest.approx(1 - 0.2 * 7 / 8 - 0.7 * 2 / 3, abs=0.015)
+
+    def test_invalidation(self, cls):
+        d = cls.from_counter({'a': 1})
+        assert d.sample(3) == ['a'] * 3
+        d.update(['b'] * 1000)
+        assert 'b' in d.sample(50, rnd=random.Random(3))
+        del d['b']
+        assert d.sample(3) == ['a'] * 3
+        d['c'] = NormData(5)
+        assert set(d.sample(100, rnd=random.Random(4))) == {'a', 'c'}
+
+
+@pytest.mark.parametrize('mutate, expected', [
+    (lambda d: d.pop('b'), {'a'}),
+    (lambda d: d.popitem(), {'a'}),
+    (lambda d: d.setdefault('c', NormData(5)), {'a', 'b', 'c'}),
+    (lambda d: d.update(['c'] * 5), {'a', 'b', 'c'}),
+    (lambda d: d.__ior__({'c': NormData(5)}), {'a', 'b', 'c'}),
+])
+def test_norm_dict_invalidation(mutate, expected):
+    d = NormDict.from_counter({'a': 1, 'b': 1})
+    assert set(d.sample(100, rnd=random.Random(7))) == {'a', 'b'}
+    mutate(d)
+    assert set(d.sample(100, rnd=random.Random(8))) == expected
+
+
+def test_norm_dict_clear():
+    d = NormDict.from_counter({'a': 1})
+    assert d.sample(1) == ['a']
+    d.clear()
+    with pytest.raises(ValueError):
+        d.sample(1)
+
+
+def test_alias_table():
+    table = AliasTable(['a', 'b', 'c'], [1, 2, 7])
+    rnd = random.Random(5)
+    counts = Counter(table.draw(rnd) for _ in range(30_000))
+    for key, weight in zip('abc', (1, 2, 7)):
+        assert counts[key] / 30_000 == pytest.approx(weight / 10, abs=0.01)
+
+
+OKPD2_CODES = [
+    '11.11.10.000', '11.11.11.2', '11.11.10.020', '10.00.0', '01.12.10.000',
+    '21.20.10.182', '21.2', '00.1', '1', '',
+]
+
+
+class TestOkpd2Encoding:
+    @pytest.mark.parametrize('code', OKPD2_CODES)
+    def test_round_trip(self, code):
+        value = encode_okpd2(code)
+        assert decode_okpd2(value) == prepare_okpd2_code(code)
+        assert encode_okpd2(decode_okpd2(value)) == value
+
+    @pytest.mark.parametrize('code', OKPD2_CODES)
+    def test_truncate(self, code):
+        value = encode_okpd2(code)
+        for len_okpd in range(13):
+            truncated = truncate_okpd2(value, len_okpd)
+            assert truncated == encode_okpd2(code[:len_okpd])
+            assert decode_okpd2(truncated) == prepare_okpd2_code(code[:len_okpd])
+            assert is_okpd2_prefix(truncated, value, len_okpd)
+
+    def test_order(self):
+        codes = sorted(prepare_okpd2_code(code) for code in OKPD2_CODES)
+        assert sorted(codes, key=encode_okpd2) == codes
+
+    @pytest.mark.parametrize(
+        'code', ['1a', '11-11', '11..1', '11.11.11.2222']
+    )
+    def test_invalid(self, code):
+        with pytest.raises(ValueError):
+            encode_okpd2(code)
+        with pytest.raises(ValueError):
+            encode_okpd2_codes(np.array([code]))
+        with pytest.raises(ValueError):
+            prepare_okpd2_codes_array(np.array([code]))
+
+    def test_vectorized(self):
+        codes = np.array(OKPD2_CODES)
+        values = encode_okpd2_codes(codes)
+        assert values.tolist() == [encode_okpd2(code) for code in OKPD2_CODES]
+        assert decode_okpd2_codes(values).tolist() == [
+            prepare_okpd2_code(code) for code in OKPD2_CODES
+        ]
+        assert prepare_okpd2_codes(codes) == prepare_okpd2_codes(OKPD2_CODES)
+        assert prepare_okpd2_codes_array(codes).tolist() == \
+            prepare_okpd2_codes(OKPD2_CODES)
+        assert truncate_okpd2_codes(values, 5).tolist() == [
+            truncate_okpd2(value, 5) for value in values.tolist()
+        ]
+        assert encode_okpd2_codes(codes.reshape(2, 5)).shape == (2, 5)
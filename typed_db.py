@@ -0,0 +1,216 @@
+import sys
+
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Tuple
+
+from psycopg2.extras import execute_values
+
+try:
+    # Импорт из пакета (db.typed_db): ключи - те же классы, что у db.db,
+    # иначе SupplierInfo не узнает их типы.
+    from .db import RecSysDataBase, retry_on_conflict, rc, fz, pr, okw, okrw, okcw
+except ImportError:
+    sys.path.append(str(Path(__file__).parent))
+    from db import RecSysDataBase, retry_on_conflict, rc, fz, pr, okw, okrw, okcw
+
+
+KIND2TYPE = {0: rc, 1: fz, 2: pr, 3: okw, 4: okrw, 5: okcw}
+TYPE2KIND = {type_: kind for kind, type_ in KIND2TYPE.items()}
+COLUMNS = (
+    'okpd2_code', 'region_code', 'customer_inn_kpp', 'fz', 'price_cat', 'iswin'
+)
+DEFAULTS = {
+    'okpd2_code': '',
+    'region_code': '',
+    'customer_inn_kpp': '',
+    'fz': '',
+    'price_cat': -1,
+    'iswin': False,
+}
+# Поля NamedTuple ключей совпадают с именами колонок, поэтому ключ
+# собирается из строки выборки без разбора строк.
+KIND2POSITIONS = {
+    kind: tuple(COLUMNS.index(field) + 1 for field in type_._fields)
+    for kind, type_ in KIND2TYPE.items()
+}
+
+
+class TypedKey2Num:
+    """
+    Альтернативное хранение key2num с типизированными колонками вместо
+    склеенного через ':' ключа. Первичный ключ начинается с inn_kpp и
+    включает num, поэтому чтение поставщика идет index-only сканом,
+    а после cluster() строки одного поставщика лежат рядом.
+    """
+    def __init__(
+        self,
+        db: RecSysDataBase,
+        table_name: str = 'key2num_typed'
+    ) -> None:
+        self.db = db
+        self.table_name = table_name
+
+    def create_table(self) -> bool:
+        sql = f"""
+        select count(*)
+            from pg_catalog.pg_tables
+            where schemaname = 'public'
+                and tablename = '{self.table_name}';
+        """
+        if self.db.select(sql)[0][0] != 0:
+            return False
+
+        sql = f"""
+        create table public.{self.table_name}
+        (
+            kind smallint not null,
+            inn_kpp varchar(22) not null,
+            okpd2_code varchar(12) not null default '',
+            region_code varchar(8) not null default '',
+            customer_inn_kpp varchar(22) not null default '',
+            fz varchar(8) not null default '',
+            price_cat smallint not null default -1,
+            iswin boolean not null default false,
+            num int not null,
+            constraint {self.table_name}_pkey primary key (
+                inn_kpp, kind, okpd2_code, region_code,
+                customer_inn_kpp, fz, price_cat, iswin
+            ) include (num)
+        );
+        """
+        self.db.execute(sql)
+        return True
+
+    def cluster(self) -> None:
+        """Физически упорядочить таблицу по поставщикам и обновить статистику."""
+        self.db.execute(f"""
+        cluster public.{self.table_name} using {self.table_name}_pkey;
+        analyze public.{self.table_name};
+        """)
+
+    def incrby(self, rows: Iterable[Tuple[str, NamedTuple, int]]) -> None:
+        """rows - тройки (inn_kpp, ключ rc/fz/pr/okw/okrw/okcw, num)."""
+        values = {}
+        for inn_kpp, key_info, num in rows:
+            cols = DEFAULTS | key_info._asdict()
+            row = (TYPE2KIND[type(key_info)], inn_kpp,
+                   *(cols[col] for col in COLUMNS))
+            values[row] = values.get(row, 0) + num
+        if not values:
+            return
+
+        sql = f"""
+        insert into public.{self.table_name}
+            (kind, inn_kpp, {', '.join(COLUMNS)}, num)
+        values %s
+        on conflict on constraint {self.table_name}_pkey
+        do update set
+            num = {self.table_name}.num + excluded.num;
+        """
+        # Упорядоченные строки блокируются параллельными загрузками в
+        # одном порядке, конфликты все равно повторяются с задержкой.
+        values = [(*row, values[row]) for row in sorted(values)]
+        with self.db.transaction():
+            with self.db.checkout() as cur:
+                retry_on_conflict(
+                    cur, lambda: execute_values(cur, sql, values),
+                    self.db.MAX_RETRIES, self.db.RETRY_DELAY
+                )
+
+    def get_innkpp(self, inn_kpp: str) -> List[Tuple[NamedTuple, int]]:
+        """Ключи поставщика в виде готовых NamedTuple и их значения."""
+        sql = f"""
+        select kind, {', '.join(COLUMNS)}, num
+            from public.{self.table_name}
+            where inn_kpp = %s;
+        """
+        return [
+            (KIND2TYPE[row[0]]._make(row[i] for i in KIND2POSITIONS[row[0]]),
+             row[-1])
+            for row in self.db.select(sql, (inn_kpp,))
+        ]
+
+    def migrate(self, inn_kpps: Iterable[str] | None = None) -> int:
+        """
+        Перенести строки из исходной таблицы db.dict_name одним
+        set-based запросом. Повторный запуск перезаписывает значения,
+        поэтому безопасен. Возвращает кол-во записанных строк.
+        """
+        self.create_table()
+        where = '' if inn_kpps is None else 'and inn_kpp = any(%s)'
+        params = None if inn_kpps is None else (list(inn_kpps),)
+        sql = f"""
+        insert into public.{self.table_name}
+            (kind, inn_kpp, {', '.join(COLUMNS)}, num)
+        select kind, inn_kpp, {', '.join(COLUMNS)}, sum(num)
+            from (
+                select
+                    case k[1]
+                        when 'rc' then 0 when 'fz' then 1 when 'pr' then 2
+                        when 'okw' then 3 when 'okrw' then 4 when 'okcw' then 5
+                    end as kind,
+                    inn_kpp,
+                    case when k[1] in ('okw', 'okrw', 'okcw')
+                        then k[3] else '' end as okpd2_code,
+                    case k[1] when 'rc' then k[3] when 'okrw' then k[4]
+                        else '' end as region_code,
+                    case k[1] when 'okcw' then k[4]
+                        else '' end as customer_inn_kpp,
+                    case k[1] when 'fz' then k[3] else '' end as fz,
+                    case k[1] when 'pr' then k[3]::smallint
+                        else -1 end as price_cat,
+                    case
+                        when k[1] not in ('okw', 'okrw', 'okcw') then false
+                        when k[array_length(k, 1)] = 'True' then true
+                        when k[array_length(k, 1)] = 'False' then false
+                        else k[array_length(k, 1)]::int <> 0
+                    end as iswin,
+                    num
+                from (
+                    select
+                        string_to_array(key, ':') as k,
+                        coalesce(inn_kpp, split_part(key, ':', 2)) as inn_kpp,
+                        num
+                        from public.{self.db.dict_name}
+                        where split_part(key, ':', 1)
+                            in ('rc', 'fz', 'pr', 'okw', 'okrw', 'okcw')
+                            {where}
+                ) as parts
+            ) as typed
+            group by kind, inn_kpp, {', '.join(COLUMNS)}
+        on conflict on constraint {self.table_name}_pkey
+        do update set
+            num = excluded.num;
+        """
+        with self.db.transaction():
+            with self.db.checkout() as cur:
+                cur.execute(sql, params)
+                return cur.rowcount
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(
+        description='Перенос key2num в типизированную таблицу.'
+    )
+    parser.add_argument('--database', default='postgres')
+    parser.add_argument('--user', default='postgres')
+    parser.add_argument('--password', default='12345')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5432)
+    parser.add_argument('--table-name', default='key2num_typed')
+    parser.add_argument('--cluster', action='store_true')
+    args = parser.parse_args()
+
+    db = RecSysDataBase(
+        database=args.database,
+        user=args.user,
+        password=args.password,
+        host=args.host,
+        port=args.port
+    )
+    typed = TypedKey2Num(db, args.table_name)
+    print(f'Перенесено строк: {typed.migrate()}')
+    if args.cluster:
+        typed.cluster()
+    db.close()
@@ -1,8 +1,12 @@
 import re
 
+import random
+
+from array import array
 from functools import lru_cache, wraps
+from heapq import nlargest
 from itertools import chain
-from typing import Any, Iterable, List, Mapping
+from typing import Any, Iterable, Iterator, List, Mapping, Sequence, Tuple
 
 
 def wrap_lru_cache(maxsize):
@@ -49,6 +53,138 @@ def prepare_okpd2_codes(okpd2_codes: Iterable[str]) -> List[str]:
     return [prepare_okpd2_code(oc) for oc in okpd2_codes]
 
 
+# Целочисленное представление ОКПД2: 9 цифр кода 'XX.XX.XX.XXX' по 4 бита,
+# первая цифра - в старших битах. Коды, отличающиеся только хвостовыми
+# нулями, совпадают, поэтому значение однозначно задает нормализованную
+# строку prepare_okpd2_code, а усечение до уровня иерархии и сравнение
+# префиксов - битовые маски. Порядок значений совпадает с порядком кодов.
+OKPD2_DIGIT_POS = (0, 1, 3, 4, 6, 7, 9, 10, 11)
+OKPD2_DOT_POS = (2, 5, 8)
+OKPD2_BITS = 4 * len(OKPD2_DIGIT_POS)
+# Кол-во цифр в первых len_okpd символах кода (len_okpd = 0..12).
+OKPD2_DIGITS_IN = tuple(
+    sum(pos < n for pos in OKPD2_DIGIT_POS) for n in range(13)
+)
+
+
+def _okpd2_mask(n_digits: int) -> int:
+    return ((1 << 4 * n_digits) - 1) << (OKPD2_BITS - 4 * n_digits)
+
+
+def encode_okpd2(okpd2_code: str) -> int:
+    """Код ОКПД2 (в любой форме записи) -> целое. ValueError, если код
+    не в формате 'XX.XX.XX.XXX' или его префикса."""
+    if len(okpd2_code) > 12:
+        raise ValueError(f'Код ОКПД2 `{okpd2_code}` слишком длинный.')
+    value = 0
+    for pos, char in enumerate(okpd2_code):
+        if pos in OKPD2_DOT_POS:
+            if char != '.':
+                raise ValueError(f'Код ОКПД2 `{okpd2_code}` записан некорректно.')
+            continue
+        if not '0' <= char <= '9':
+            raise ValueError(f'Код ОКПД2 `{okpd2_code}` записан некорректно.')
+        value = value << 4 | ord(char) - 48
+    return value << OKPD2_BITS - 4 * OKPD2_DIGITS_IN[len(okpd2_code)]
+
+
+def decode_okpd2(value: int) -> str:
+    """Целое -> нормализованный код, как у prepare_okpd2_code."""
+    digits = [
+        value >> OKPD2_BITS - 4 * (i + 1) & 15
+        for i in range(len(OKPD2_DIGIT_POS))
+    ]
+    n_digits = max((i + 1 for i, d in enumerate(digits) if d), default=0)
+    length = _okpd2_length(n_digits)
+    chars = []
+    for i, digit in enumerate(digits):
+        if i in (2, 4, 6):
+            chars.append('.')
+        chars.append(chr(48 + digit))
+    return ''.join(chars)[:length]
+
+
+def _okpd2_length(n_digits: int) -> int:
+    length = OKPD2_DIGIT_POS[n_digits - 1] + 1 if n_digits else 0
+    if length == 1:
+        return 2
+    if 8 < length < 12:
+        return 12
+    return length
+
+
+def truncate_okpd2(value: int, len_okpd: int) -> int:
+    """Аналог prepare_okpd2_code(code[:len_okpd]) для целого кода."""
+    return value & _okpd2_mask(OKPD2_DIGITS_IN[max(0, min(len_okpd, 12))])
+
+
+def is_okpd2_prefix(prefix: int, value: int, len_okpd: int) -> bool:
+    """Совпадает ли value с prefix в первых len_okpd символах."""
+    return truncate_okpd2(value, len_okpd) == truncate_okpd2(prefix, len_okpd)
+
+
+def encode_okpd2_codes(okpd2_codes: Iterable[str]):
+    """Векторный encode_okpd2: массив строк -> массив int64 (нужен NumPy)."""
+    import numpy as np
+
+    codes = np.asarray(okpd2_codes, dtype=str)
+    if codes.size and np.char.str_len(codes).max() > 12:
+        raise ValueError('Среди кодов ОКПД2 есть слишком длинные.')
+    chars = np.ascontiguousarray(codes.astype('U12')).view(np.uint32)
+    chars = chars.reshape(codes.shape + (12,)).astype(np.int64)
+    present = chars != 0
+    dots = chars[..., list(OKPD2_DOT_POS)]
+    digits = chars[..., list(OKPD2_DIGIT_POS)] - 48
+    digit_present = present[..., list(OKPD2_DIGIT_POS)]
+    valid = (
+        ((dots == ord('.')) | (dots == 0)).all(axis=-1)
+        & (((digits >= 0) & (digits <= 9)) | ~digit_present).all(axis=-1)
+        # Пропусков внутри кода быть не может.
+        & (np.diff(present.astype(np.int8), axis=-1) <= 0).all(axis=-1)
+    )
+    if not valid.all():
+        bad = codes[~valid].ravel()[0]
+        raise ValueError(f'Код ОКПД2 `{bad}` записан некорректно.')
+    digits = np.where(digit_present, digits, 0)
+    shifts = np.arange(OKPD2_BITS - 4, -1, -4, dtype=np.int64)
+    return (digits << shifts).sum(axis=-1)
+
+
+def decode_okpd2_codes(values):
+    """Векторный decode_okpd2: массив целых -> массив строк (нужен NumPy)."""
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.int64)
+    shifts = np.arange(OKPD2_BITS - 4, -1, -4, dtype=np.int64)
+    digits = values[..., None] >> shifts & 15
+    n_digits = np.where(
+        digits.any(axis=-1),
+        len(OKPD2_DIGIT_POS) - np.argmax(digits[..., ::-1] != 0, axis=-1),
+        0
+    )
+    lengths = np.array([_okpd2_length(n) for n in range(10)])[n_digits]
+    chars = np.full(values.shape + (12,), ord('.'), dtype=np.uint32)
+    chars[..., list(OKPD2_DIGIT_POS)] = digits + 48
+    chars[np.arange(12) >= lengths[..., None]] = 0
+    return chars.view('U12').reshape(values.shape)
+
+
+def prepare_okpd2_codes_array(okpd2_codes):
+    """
+    Векторный prepare_okpd2_codes (нужен NumPy): массив строк -> массив
+    нормализованных строк той же формы. В отличие от prepare_okpd2_code
+    коды проверяются (см. encode_okpd2_codes) - ValueError на некорректном.
+    """
+    return decode_okpd2_codes(encode_okpd2_codes(okpd2_codes))
+
+
+def truncate_okpd2_codes(values, len_okpd: int):
+    """Векторный truncate_okpd2 (нужен NumPy)."""
+    import numpy as np
+
+    return np.asarray(values, dtype=np.int64) & truncate_okpd2(-1, len_okpd)
+
+
 class NormData:
     __slots__ = ('count', 'norm')
     def __init__(self, count: int = 0, norm: float | None = None) -> None:
@@ -78,10 +214,102 @@ class NormData:
         return f'(c: {self.count}, n: {round(self.norm, 2)})'
 
 
-class NormDict(dict):
+class AliasTable:
+    """
+    Таблица псевдонимов (метод Уолкера): выбор ключа с вероятностью,
+    пропорциональной весу, за O(1) после построения за O(n).
+    """
+    __slots__ = ('keys', 'weights', 'prob', 'alias')
+
+    def __init__(self, keys: Sequence[Any], weights: Sequence[int]) -> None:
+        self.keys = list(keys)
+        self.weights = list(weights)
+        n = len(self.keys)
+        total = sum(self.weights)
+        scaled = [w * n / total for w in self.weights]
+        self.prob = [1.] * n
+        self.alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+        while small and large:
+            i, j = small.pop(), large.pop()
+            self.prob[i], self.alias[i] = scaled[i], j
+            scaled[j] += scaled[i] - 1
+            (small if scaled[j] < 1 else large).append(j)
+
+    def draw(self, rnd: random.Random) -> Any:
+        i = int(rnd.random() * len(self.keys))
+        if rnd.random() >= self.prob[i]:
+            i = self.alias[i]
+        return self.keys[i]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+
+class WeightedSampling:
+    """
+    Выборка ключей пропорционально счетчикам без разворачивания
+    elements(). Таблицы псевдонимов строятся лениво (отдельно для каждого
+    префикса) и сбрасываются при изменении счетчиков.
+    """
     __slots__ = ()
+    # Сколько таблиц префиксов хранится одновременно.
+    MAX_SAMPLERS = 32
+
+    def sample(
+        self,
+        k: int = 1,
+        replace: bool = True,
+        startswith: str = '',
+        rnd: random.Random | None = None
+    ) -> List[Any]:
+        """
+        k ключей с вероятностью, пропорциональной счетчику. startswith
+        ограничивает выборку строковыми ключами с этим префиксом. Без
+        возвращения ключи не повторяются.
+        """
+        rnd = rnd or random
+        table = self._alias_table(startswith)
+        if replace:
+            if k and not len(table):
+                raise ValueError('Нет ключей с ненулевым счетчиком.')
+            return [table.draw(rnd) for _ in range(k)]
+
+        if k > len(table):
+            raise ValueError(f'Нельзя выбрать {k} ключей без возвращения.')
+        # Взвешенная выборка без возвращения за O(n log k)
+        # (Efraimidis-Spirakis): порядок ключей тот же, что при
+        # последовательном выборе с перенормировкой оставшихся весов.
+        return [
+            key for _, key in nlargest(k, (
+                (rnd.random() ** (1 / w), key)
+                for key, w in zip(table.keys, table.weights)
+            ), key=lambda pair: pair[0])
+        ]
+
+    def _alias_table(self, startswith: str) -> AliasTable:
+        samplers = self._samplers
+        if samplers is None:
+            samplers = self._samplers = {}
+        table = samplers.get(startswith)
+        if table is None:
+            keys, weights = [], []
+            for key, count in self._key_counts():
+                if count > 0 and (not startswith or key.startswith(startswith)):
+                    keys.append(key)
+                    weights.append(count)
+            if len(samplers) >= self.MAX_SAMPLERS:
+                samplers.clear()
+            table = samplers[startswith] = AliasTable(keys, weights)
+        return table
+
+
+class NormDict(WeightedSampling, dict):
+    __slots__ = ('_samplers',)
     def __init__(self) -> None:
         super().__init__()
+        self._samplers = None
 
     @classmethod
     def from_counter(cls, counter: Mapping[str, int]):
@@ -106,6 +334,39 @@ class NormDict(dict):
             else:
                 self[elem] = NormData(1)
 
+    def __setitem__(self, key: Any, value: NormData) -> None:
+        self._samplers = None
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: Any) -> None:
+        self._samplers = None
+        super().__delitem__(key)
+
+    # Методы dict ниже не вызывают __setitem__/__delitem__, поэтому
+    # кэш сэмплеров сбрасывается в каждом явно.
+    def pop(self, key: Any, *default: Any) -> Any:
+        self._samplers = None
+        return super().pop(key, *default)
+
+    def popitem(self) -> Tuple[Any, NormData]:
+        self._samplers = None
+        return super().popitem()
+
+    def clear(self) -> None:
+        self._samplers = None
+        super().clear()
+
+    def setdefault(self, key: Any, default: NormData = None) -> NormData:
+        self._samplers = None
+        return super().setdefault(key, default)
+
+    def __ior__(self, other: Mapping[Any, NormData]):
+        self._samplers = None
+        return super().__ior__(other)
+
+    def _key_counts(self) -> Iterable[Tuple[Any, int]]:
+        return ((k, v.count) for k, v in self.items())
+
     def elements(
         self, 
         startswith: str = '', 
@@ -137,3 +398,140 @@ class NormDict(dict):
         sum_count = sum(v.count for v in self.values())
         for k in self.keys():
             self[k].norm = self[k].count / sum_count
+
+
+class ArrayNormDict(WeightedSampling):
+    """
+    Альтернатива NormDict без объекта NormData на каждый ключ: счетчики
+    лежат в массиве, ключи - в словаре ключ -> позиция, сумма счетчиков
+    поддерживается при каждом изменении. Норма считается при чтении,
+    поэтому обновление стоит O(1) на ключ и нормы всегда согласованы.
+    """
+    __slots__ = ('_index', '_keys', '_counts', '_total', '_samplers')
+
+    def __init__(self) -> None:
+        self._index = {}
+        self._keys = []
+        self._counts = array('q')
+        self._total = 0
+        self._samplers = None
+
+    @classmethod
+    def from_counter(cls, counter: Mapping[Any, int]):
+        model = cls()
+        for k, v in counter.items():
+            model._add(k, int(v))
+        return model
+
+    @classmethod
+    def from_elements(cls, elements: Iterable[Any]):
+        model = cls()
+        model.update(elements)
+        return model
+
+    def update(self, elements: Iterable[Any] | None) -> None:
+        if elements is None: return
+        for elem in elements:
+            self._add(elem, 1)
+
+    def elements(
+        self, 
+        startswith: str = '', 
+        trunc_prefix: bool = True
+    ) -> Iterable[str]:
+        start = len(startswith) if trunc_prefix else 0
+        return chain.from_iterable(
+            [k[start:]] * c for k, c in zip(self._keys, self._counts)
+            if k.startswith(startswith)
+        )
+
+    def get_count(self, key: Any, default: Any) -> int:
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return self._counts[i]
+
+    def get_norm(self, key: Any, default: Any) -> float:
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return self._counts[i] / self._total if self._total else 0.
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def _calc_norm(self) -> None:
+        # Нормы считаются при чтении, метод оставлен для совместимости.
+        pass
+
+    def _key_counts(self) -> Iterable[Tuple[Any, int]]:
+        return zip(self._keys, self._counts)
+
+    def _add(self, key: Any, count: int) -> None:
+        self._samplers = None
+        i = self._index.get(key)
+        if i is None:
+            self._index[key] = len(self._keys)
+            self._keys.append(key)
+            self._counts.append(count)
+        else:
+            self._counts[i] += count
+        self._total += count
+
+    def __getitem__(self, key: Any) -> NormData:
+        i = self._index[key]
+        count = self._counts[i]
+        return NormData(count, count / self._total if self._total else 0.)
+
+    def __setitem__(self, key: Any, value: int | NormData) -> None:
+        self._samplers = None
+        i = self._index.get(key)
+        count = int(value)
+        if i is None:
+            self._add(key, count)
+        else:
+            self._total += count - self._counts[i]
+            self._counts[i] = count
+
+    def __delitem__(self, key: Any) -> None:
+        # На место удаленного ключа переносится последний.
+        i = self._index.pop(key)
+        self._samplers = None
+        self._total -= self._counts[i]
+        last_key, last_count = self._keys.pop(), self._counts.pop()
+        if i < len(self._keys):
+            self._keys[i], self._counts[i] = last_key, last_count
+            self._index[last_key] = i
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self[key] if key in self._index else default
+
+    def keys(self) -> Iterator[Any]:
+        return iter(self._keys)
+
+    def values(self) -> Iterator[NormData]:
+        return (self[k] for k in self._keys)
+
+    def items(self) -> Iterator[Tuple[Any, NormData]]:
+        return ((k, self[k]) for k in self._keys)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (Mapping, ArrayNormDict)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            k in other and int(other[k]) == c
+            for k, c in zip(self._keys, self._counts)
+        )
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))